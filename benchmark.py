@@ -0,0 +1,455 @@
+"""
+Benchmark of the path searches.
+
+Builds grids from synthetic terrain or from chunk dumps saved with the
+"dump" chat command, runs the same start/goal queries through the searches
+and writes nodes expanded, time, path length and allocations of every
+query to a json file. Give a previous result file to --compare to see how
+the totals moved.
+"""
+
+import argparse
+import array
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+from datetime import datetime
+
+import syspath_fix
+syspath_fix.update_sys_path()
+
+import twistedbot.config as config
+import twistedbot.logbot as logbot
+import twistedbot.utils as utils
+from twistedbot import griddump
+from twistedbot.axisbox import AABB
+from twistedbot.grid import Chunk, ChunkColumn
+from twistedbot.pathfinding import AStarBBCol, AStarCoords, AStarMultiCoords, AStarSectionsCoords, SectionGraph, path_cache
+from twistedbot.sectionstore import section_hash
+from twistedbot.world import Dimension, World
+
+
+log = logbot.getlogger("BENCHMARK")
+
+STONE = 1
+STILL_WATER = 9
+STILL_LAVA = 11
+LADDER = 65
+
+# ground level of the synthetic worlds
+GROUND = 16
+
+
+class Terrain(object):
+    """ blocks of a square of chunks, turned into chunk columns for a grid """
+
+    def __init__(self, size):
+        self.size = size
+        self.min_x = -size * 16
+        self.max_x = size * 16 - 1
+        self.block_types = {}
+        self.meta = {}
+        # queries start and end at these heights, everywhere if None
+        self.query_y = None
+
+    def set(self, x, y, z, block_type, meta=0):
+        if not (self.min_x <= x <= self.max_x and self.min_x <= z <= self.max_x and 0 <= y < 256):
+            return
+        key = (x >> 4, z >> 4, y >> 4)
+        block_types = self.block_types.get(key, None)
+        if block_types is None:
+            block_types = self.block_types[key] = array.array('B', [0] * 4096)
+            self.meta[key] = array.array('B', [0] * 2048)
+        pos = (y & 15) * 256 + (z & 15) * 16 + (x & 15)
+        block_types[pos] = block_type
+        half = self.meta[key][pos >> 1]
+        self.meta[key][pos >> 1] = (half & 15) | (meta << 4) if pos & 1 else (half & 240) | meta
+
+    def fill(self, x0, y0, z0, x1, y1, z1, block_type, meta=0):
+        """ box of blocks, both corners included """
+        for x in xrange(x0, x1 + 1):
+            for y in xrange(y0, y1 + 1):
+                for z in xrange(z0, z1 + 1):
+                    self.set(x, y, z, block_type, meta)
+
+    def columns(self):
+        columns = []
+        for chunk_x in xrange(-self.size, self.size):
+            for chunk_z in xrange(-self.size, self.size):
+                block_types = [None for _ in xrange(Chunk.levels)]
+                meta = [None for _ in xrange(Chunk.levels)]
+                hashes = [None for _ in xrange(Chunk.levels)]
+                primary_bit = 0
+                for level in xrange(Chunk.levels):
+                    key = (chunk_x, chunk_z, level)
+                    if key not in self.block_types:
+                        continue
+                    block_types[level] = self.block_types[key]
+                    meta[level] = self.meta[key]
+                    hashes[level] = section_hash(block_types[level], meta[level])
+                    primary_bit |= 1 << level
+                if primary_bit:
+                    columns.append(ChunkColumn(chunk_x, chunk_z, True, primary_bit, block_types, meta, hashes, None))
+        return columns
+
+
+def ground(terrain, height=GROUND):
+    terrain.fill(terrain.min_x, 0, terrain.min_x, terrain.max_x, height - 1, terrain.max_x, STONE)
+
+
+def flat_world(rnd, size):
+    """ flat ground with pillars and holes """
+    terrain = Terrain(size)
+    ground(terrain)
+    for x in xrange(terrain.min_x, terrain.max_x + 1):
+        for z in xrange(terrain.min_x, terrain.max_x + 1):
+            r = rnd.random()
+            if r < 0.1:
+                terrain.fill(x, GROUND, z, x, GROUND + rnd.randint(0, 3), z, STONE)
+            elif r < 0.13:
+                terrain.fill(x, GROUND - 2, z, x, GROUND - 1, z, 0)
+    return terrain
+
+
+def stairs_world(rnd, size):
+    """ terraces one block apart rising and falling in both directions """
+    terrain = Terrain(size)
+    ground(terrain)
+
+    def wave(v, period):
+        t = v % (2 * period)
+        return t if t < period else 2 * period - t
+    for x in xrange(terrain.min_x, terrain.max_x + 1):
+        for z in xrange(terrain.min_x, terrain.max_x + 1):
+            height = wave(x // 3, 6) + wave(z // 4, 5)
+            if height > 0:
+                terrain.fill(x, GROUND, z, x, GROUND + height - 1, z, STONE)
+    return terrain
+
+
+def caves_world(rnd, size):
+    """ solid rock with winding tunnels """
+    terrain = Terrain(size)
+    ground(terrain, 64)
+    for _ in xrange(size * size * 6):
+        x = rnd.randint(terrain.min_x, terrain.max_x)
+        y = rnd.randint(8, 52)
+        z = rnd.randint(terrain.min_x, terrain.max_x)
+        dx, dz = rnd.choice(utils.cross)
+        for _ in xrange(rnd.randint(20, 60)):
+            terrain.fill(x, y, z, x + rnd.randint(0, 1), y + 1 + rnd.randint(0, 1), z + rnd.randint(0, 1), 0)
+            if rnd.random() < 0.2:
+                dx, dz = rnd.choice(utils.cross)
+            x += dx
+            z += dz
+            y = max(4, min(58, y + rnd.choice((-1, 0, 0, 0, 1))))
+    return terrain
+
+
+def water_world(rnd, size):
+    """ flat ground with ponds to swim through """
+    terrain = Terrain(size)
+    ground(terrain)
+    for _ in xrange(size * size * 3):
+        x = rnd.randint(terrain.min_x, terrain.max_x)
+        z = rnd.randint(terrain.min_x, terrain.max_x)
+        depth = rnd.randint(1, 4)
+        terrain.fill(x, GROUND - depth, z, x + rnd.randint(3, 12), GROUND - 1, z + rnd.randint(3, 12), STILL_WATER)
+    return terrain
+
+
+def ladders_world(rnd, size):
+    """ plateaus eight blocks high, walls climbable on ladders only """
+    terrain = Terrain(size)
+    ground(terrain)
+    step = 8
+    raised = {}
+    for x in xrange(terrain.min_x, terrain.max_x + 1, step):
+        for z in xrange(terrain.min_x, terrain.max_x + 1, step):
+            raised[(x // step, z // step)] = rnd.random() < 0.5
+            if raised[(x // step, z // step)]:
+                terrain.fill(x, GROUND, z, x + step - 1, GROUND + 7, z + step - 1, STONE)
+    # ladder metadata says which side the ladder is attached to
+    facing = {(0, 1): 2, (0, -1): 3, (1, 0): 4, (-1, 0): 5}
+    for (px, pz), high in raised.iteritems():
+        if high:
+            continue
+        for (dx, dz), meta in facing.iteritems():
+            if not raised.get((px + dx, pz + dz), False) or rnd.random() < 0.5:
+                continue
+            # the cell next to the wall, somewhere along it
+            along = rnd.randint(1, step - 2)
+            if dx:
+                x = px * step + (step - 1 if dx > 0 else 0)
+                z = pz * step + along
+            else:
+                x = px * step + along
+                z = pz * step + (step - 1 if dz > 0 else 0)
+            terrain.fill(x, GROUND, z, x, GROUND + 7, z, LADDER, meta)
+    return terrain
+
+
+def lava_world(rnd, size):
+    """ maze with loops and lava pits in its corridors """
+    terrain = Terrain(size)
+    ground(terrain)
+    cell = 4
+    cells = (terrain.max_x - terrain.min_x + 1) // cell
+    terrain.fill(terrain.min_x, GROUND, terrain.min_x, terrain.max_x, GROUND + 2, terrain.max_x, STONE)
+    # not on top of the walls
+    terrain.query_y = (GROUND, GROUND)
+
+    def corridor(i, j, ni, nj):
+        x0 = terrain.min_x + min(i, ni) * cell + 1
+        z0 = terrain.min_x + min(j, nj) * cell + 1
+        x1 = terrain.min_x + max(i, ni) * cell + cell - 2
+        z1 = terrain.min_x + max(j, nj) * cell + cell - 2
+        terrain.fill(x0, GROUND, z0, x1, GROUND + 2, z1, 0)
+        if rnd.random() < 0.15:
+            terrain.set(rnd.randint(x0, x1), GROUND - 1, rnd.randint(z0, z1), STILL_LAVA)
+    visited = set([(0, 0)])
+    stack = [(0, 0)]
+    while stack:
+        i, j = stack[-1]
+        free = [(i + di, j + dj) for di, dj in utils.cross if 0 <= i + di < cells and 0 <= j + dj < cells and (i + di, j + dj) not in visited]
+        if not free:
+            stack.pop()
+            continue
+        ni, nj = rnd.choice(free)
+        visited.add((ni, nj))
+        stack.append((ni, nj))
+        corridor(i, j, ni, nj)
+    # a perfect maze has detours longer than the search limit
+    for i in xrange(cells - 1):
+        for j in xrange(cells - 1):
+            if rnd.random() < 0.25:
+                corridor(i, j, i + 1, j)
+            if rnd.random() < 0.25:
+                corridor(i, j, i, j + 1)
+    return terrain
+
+
+WORLDS = {
+    "flat": flat_world,
+    "stairs": stairs_world,
+    "caves": caves_world,
+    "water": water_world,
+    "ladders": ladders_world,
+    "lava": lava_world,
+}
+
+SEARCHES = ["coords", "multi", "bbcol", "sections"]
+
+
+def standable_cells(grid, rnd, count, query_y=None, tries=200000):
+    """ random cells the bot can stand in """
+    min_x = min(x for x, _ in grid.chunks) * 16
+    max_x = max(x for x, _ in grid.chunks) * 16 + 15
+    min_z = min(z for _, z in grid.chunks) * 16
+    max_z = max(z for _, z in grid.chunks) * 16 + 15
+    if query_y is None:
+        min_y = 1
+        max_y = max(i for chunk in grid.chunks.itervalues() for i in xrange(chunk.levels) if chunk.block_types[i] is not None) * 16 + 17
+    else:
+        min_y, max_y = query_y
+    cells = []
+    for _ in xrange(tries):
+        x = rnd.randint(min_x, max_x)
+        y = rnd.randint(min_y, max_y)
+        z = rnd.randint(min_z, max_z)
+        if grid.grid_space.can_stand(x, y, z):
+            cells.append(utils.Vector(x, y, z))
+            if len(cells) == count:
+                break
+    return cells
+
+
+def make_queries(grid, rnd, count, query_y=None):
+    """ (start, goal, more goals) of count queries """
+    cells = standable_cells(grid, rnd, count * 6, query_y)
+    queries = []
+    for i in xrange(min(count, len(cells) // 6)):
+        start, goal = cells[i * 6], cells[i * 6 + 1]
+        queries.append((start, goal, cells[i * 6 + 1:i * 6 + 6]))
+    return queries
+
+
+def new_search(kind, dimension, start, goal, goals):
+    if kind == "coords":
+        return AStarCoords(dimension=dimension, start_coords=start, goal_coords=goal)
+    elif kind == "multi":
+        return AStarMultiCoords(dimension=dimension, start_coords=start, multiple_goals=goals)
+    elif kind == "bbcol":
+        return AStarBBCol(dimension=dimension, start_coords=start, bb=AABB.from_block_cube(goal.x, goal.y, goal.z))
+    elif kind == "sections":
+        return AStarSectionsCoords(dimension=dimension, start_coords=start, goal_coords=goal)
+    raise ValueError("unknown search %s" % kind)
+
+
+def clear_caches(grid):
+    grid.grid_space.clear()
+    grid.section_graph = SectionGraph(grid.grid_space)
+    path_cache.entries.clear()
+
+
+def run_query(kind, dimension, start, goal, goals, count_objects):
+    """ result of one search run to the end """
+    search = new_search(kind, dimension, start, goal, goals)
+    search.time_budget = float("inf")
+    objects = None
+    gc.collect()
+    gc.disable()
+    try:
+        if count_objects:
+            objects = len(gc.get_objects())
+        t_start = utils.monotonic()
+        try:
+            while True:
+                search.next()
+        except StopIteration:
+            pass
+        wall_time = utils.monotonic() - t_start
+        if count_objects:
+            objects = len(gc.get_objects()) - objects
+    finally:
+        gc.enable()
+    path = search.path
+    return {
+        "start": start.tuple,
+        "goal": goal.tuple,
+        "found": path is not None,
+        "iterations": search.astar.iter_count,
+        "nodes_expanded": search.nodes_expanded,
+        "wall_time": wall_time,
+        "path_steps": len(path) if path is not None else None,
+        "path_cost": path[0].g if path else None,
+        "objects": objects,
+    }
+
+
+def summarize(results):
+    """ totals by world and search """
+    totals = {}
+    for r in results:
+        key = "%s %s" % (r["world"], r["search"])
+        total = totals.setdefault(key, {"queries": 0, "found": 0, "iterations": 0, "nodes_expanded": 0, "wall_time": 0.0, "path_cost": 0.0, "objects": 0})
+        total["queries"] += 1
+        total["iterations"] += r["iterations"]
+        total["nodes_expanded"] += r["nodes_expanded"]
+        total["wall_time"] += r["wall_time"]
+        if r["found"]:
+            total["found"] += 1
+            total["path_cost"] += r["path_cost"]
+        if r["objects"] is not None:
+            total["objects"] += r["objects"]
+    return totals
+
+
+def git_revision():
+    try:
+        with open(os.devnull, "w") as devnull:
+            return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(totals, arguments, filename):
+    with open(filename) as f:
+        report = json.load(f)
+    old = report["totals"]
+    for name in ("size", "queries", "seed", "warm"):
+        if report["arguments"].get(name) != arguments[name]:
+            print "WARNING: %s was %s in %s, the queries differ" % (name, report["arguments"].get(name), filename)
+    print "%-20s %12s %12s %12s %8s" % ("", "iterations", "time", "cost", "found")
+    for key in sorted(totals):
+        if key not in old:
+            continue
+        new_total, old_total = totals[key], old[key]
+        ratios = []
+        for field in ("iterations", "wall_time", "path_cost"):
+            if old_total.get(field):
+                ratios.append("%+11.1f%%" % (100.0 * (new_total[field] - old_total[field]) / old_total[field]))
+            else:
+                ratios.append("%12s" % "-")
+        print "%-20s %s %s %s %3d/%-4d" % (key, ratios[0], ratios[1], ratios[2], new_total["found"], old_total["found"])
+
+
+def start():
+    parser = argparse.ArgumentParser(description='Benchmark path searches.')
+    parser.add_argument('--world', action='append', dest='worlds', choices=sorted(WORLDS),
+                        help='synthetic world, repeat for more, all if no world and no dump given')
+    parser.add_argument('--dump', action='append', dest='dumps', default=[],
+                        help='chunk dump saved by the dump command, repeat for more')
+    parser.add_argument('--search', action='append', dest='searches', choices=SEARCHES,
+                        help='search to run, repeat for more, all by default')
+    parser.add_argument('--size', type=int, default=4,
+                        help='synthetic worlds are 2*size chunks wide')
+    parser.add_argument('--queries', type=int, default=20,
+                        help='queries in every world')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='seed of terrain and queries')
+    parser.add_argument('--warm', action='store_true',
+                        help='keep node states and paths cached between queries')
+    parser.add_argument('--jump-points', action='store_true', dest='jump_points',
+                        help='searches jump over open flat ground')
+    parser.add_argument('--no-objects', action='store_false', dest='count_objects',
+                        help='do not count allocated objects, counting is slow with big heaps')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='result file')
+    parser.add_argument('--compare', default=None,
+                        help='earlier result file to compare with')
+    args = parser.parse_args()
+    worlds = args.worlds
+    if worlds is None and not args.dumps:
+        worlds = sorted(WORLDS)
+    searches = args.searches or SEARCHES
+    config.PATHFIND_JUMP_POINTS = args.jump_points
+    world = World(bot_name="benchmark")
+    results = []
+    sources = [(name, None) for name in worlds or []] + [(None, dump) for dump in args.dumps]
+    for name, dump in sources:
+        dimension = Dimension(world, 0)
+        grid = dimension.grid
+        rnd = random.Random(args.seed)
+        query_y = None
+        if dump is None:
+            terrain = WORLDS[name](rnd, args.size)
+            grid._commit_columns(terrain.columns())
+            query_y = terrain.query_y
+        else:
+            griddump.load(grid, dump)
+            name = dump
+        queries = make_queries(grid, rnd, args.queries, query_y)
+        log.msg("world %s, %d chunks, %d queries" % (name, len(grid.chunks), len(queries)))
+        for kind in searches:
+            for i, (start, goal, goals) in enumerate(queries):
+                if not args.warm:
+                    clear_caches(grid)
+                result = run_query(kind, dimension, start, goal, goals, args.count_objects)
+                result.update({"world": name, "search": kind, "query": i})
+                results.append(result)
+    totals = summarize(results)
+    report = {
+        "date": datetime.now().isoformat(),
+        "revision": git_revision(),
+        "python": "%s %s" % (platform.python_implementation(), platform.python_version()),
+        "arguments": vars(args),
+        "totals": totals,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print "%-20s %8s %12s %12s %10s %12s %10s" % ("", "found", "iterations", "expanded", "time", "cost", "objects")
+    for key in sorted(totals):
+        t = totals[key]
+        print "%-20s %3d/%-4d %12d %12d %10.3f %12.1f %10d" % (key, t["found"], t["queries"], t["iterations"], t["nodes_expanded"], t["wall_time"], t["path_cost"], t["objects"])
+    print "results written to %s" % args.output
+    if args.compare:
+        compare(totals, vars(args), args.compare)
+
+
+if __name__ == '__main__':
+    start()
@@ -65,17 +65,19 @@ def start():
     args = parser.parse_args()
     if args.log2file:
         logbot.start_bot_filelog()
-    config.USERNAME = args.botname
-    config.PASSWORD = args.botpass
-    config.EMAIL = args.botemail
-    config.USE_ENCRYPTION = args.use_encryption or args.onlinemode
-    config.ONLINE_LOGIN = args.onlinemode
-    if config.USE_ENCRYPTION:
-        factory.import_encryption()  
-    config.COMMANDER = args.commandername.lower()
     host = args.serverhost
     port = args.serverport
-    world = World(host=host, port=port, commander_name=args.commandername, bot_name=args.botname)
+    bot_config = config.BotConfig(USERNAME=args.botname,
+                                  PASSWORD=args.botpass,
+                                  EMAIL=args.botemail,
+                                  USE_ENCRYPTION=args.use_encryption or args.onlinemode,
+                                  ONLINE_LOGIN=args.onlinemode,
+                                  COMMANDER=args.commandername.lower(),
+                                  SERVER_HOST=host,
+                                  SERVER_PORT=port)
+    if bot_config.USE_ENCRYPTION:
+        factory.import_encryption()
+    world = World(host=host, port=port, commander_name=args.commandername, bot_name=args.botname, bot_config=bot_config)
     try:
         from twisted.internet import stdio
         stdio.StandardIO(ConsoleChat(world))
@@ -90,7 +92,7 @@ def start():
 
     @inlineCallbacks
     def connect():
-        if config.ONLINE_LOGIN:
+        if bot_config.ONLINE_LOGIN:
             yield mc_factory.online_auth()
         if mc_factory.clean_to_connect:
             reactor.connectTCP(host, port, mc_factory)
@@ -0,0 +1,174 @@
+"""
+Fuzz check of the packet codecs.
+
+Feeds random bodies of every packet id to construct, to the compiled
+parsers and to the hand written decoders in fastpackets, and reports every
+body on which they disagree. A body counts as agreement when all decoders
+return the same values or all of them fail. Packets with a hand written
+encoder are encoded back from the decoded record and from the construct
+Container, both have to give the body construct builds again. Run it after
+touching the packet table or the codecs, exits with status 1 on any
+mismatch.
+"""
+
+import argparse
+import random
+import sys
+from collections import Mapping
+from StringIO import StringIO
+
+import syspath_fix
+syspath_fix.update_sys_path()
+
+import twistedbot.logbot as logbot
+from twistedbot import fastpackets
+from twistedbot import packets
+
+
+log = logbot.getlogger("FUZZ")
+
+# counts and lengths are drawn mostly small so that bodies parse
+BYTES = [0, 0, 1, 2, 3, 0x7f, 0x80, 0xff]
+
+
+def random_body(rnd, size):
+    body = []
+    for _ in xrange(size):
+        if rnd.random() < 0.5:
+            body.append(rnd.choice(BYTES))
+        else:
+            body.append(rnd.randint(0, 255))
+    return "".join(chr(b) for b in body)
+
+
+def plain(obj):
+    """ records, Containers and lists as plain dicts and lists """
+    if fastpackets.is_record(obj):
+        return dict((name, plain(value)) for name, value in zip(obj._fields, obj))
+    if isinstance(obj, Mapping):
+        return dict((name, plain(value)) for name, value in obj.iteritems())
+    if isinstance(obj, (list, tuple)):
+        return [plain(value) for value in obj]
+    if isinstance(obj, float):
+        return repr(obj)
+    return obj
+
+
+def decode(decoder, body):
+    try:
+        return True, plain(decoder(body))
+    except Exception as e:
+        return False, e.__class__.__name__
+
+
+def construct_parse(con, body):
+    """ parse with construct, returns the result and the bytes it used """
+    stream = StringIO(body)
+    try:
+        return True, plain(con.parse_stream(stream)), stream.tell()
+    except Exception as e:
+        return False, e.__class__.__name__, len(body)
+
+
+def encode(encoder, p):
+    try:
+        return True, encoder(p).encode("hex")
+    except Exception as e:
+        return False, e.__class__.__name__
+
+
+def round_trip(pid, body):
+    """
+    results of encoding the decoded body, None when construct can not
+    parse it. The body construct builds from its parse comes first, it
+    differs from the body where fields have more than one encoding, like
+    a bool of 2.
+    """
+    con = packets.packets[pid]
+    try:
+        container = con.parse(body)
+    except Exception:
+        return None
+    results = [("construct", encode(con.build, container)),
+               ("container", encode(fastpackets.encoders[pid], container))]
+    ok, record = True, None
+    try:
+        record = fastpackets.decoders[pid](body)
+    except Exception as e:
+        ok, record = False, e.__class__.__name__
+    if ok:
+        results.append(("record", encode(fastpackets.encoders[pid], record)))
+        packet_encoder = packets.PacketEncoder(pid)
+        results.append(("make", encode(lambda p: packet_encoder.encode(p)[1:], record)))
+    else:
+        results.append(("record", (False, record)))
+    return results
+
+
+def fuzz_packet(pid, rnd, rounds, max_size):
+    """ returns the mismatches of packet pid as (body, results) """
+    decoders = []
+    if pid in packets.compiled_parsers:
+        decoders.append(("compiled", packets.compiled_parsers[pid]))
+    if pid in fastpackets.decoders:
+        decoders.append(("fast", fastpackets.decoders[pid]))
+    mismatches = []
+    if not decoders:
+        return mismatches
+    con = packets.packets[pid]
+    for _ in xrange(rounds):
+        body = random_body(rnd, rnd.randint(0, max_size))
+        ok, value, used = construct_parse(con, body)
+        # bodies come cut to the packet length, bytes construct left over are not part of it
+        body = body[:used]
+        results = [("construct", (ok, value))]
+        for name, decoder in decoders:
+            results.append((name, decode(decoder, body)))
+        if disagree(results):
+            mismatches.append((body, results))
+        if pid in fastpackets.encoders:
+            results = round_trip(pid, body)
+            if results is not None and disagree(results):
+                mismatches.append((body, results))
+    return mismatches
+
+
+def disagree(results):
+    oks = set(result[0] for _, result in results)
+    if oks == set([False]):
+        return False
+    return len(oks) > 1 or any(result != results[0][1] for _, result in results[1:])
+
+
+def start():
+    parser = argparse.ArgumentParser(description='Compare packet decoders on random bodies.')
+    parser.add_argument('--pid', action='append', dest='pids', type=int,
+                        help='packet id to check, repeat for more, all by default')
+    parser.add_argument('--rounds', type=int, default=2000,
+                        help='random bodies of every packet id')
+    parser.add_argument('--size', type=int, default=64,
+                        help='maximum body length')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='seed of the random bodies')
+    parser.add_argument('--show', type=int, default=3,
+                        help='mismatches printed for every packet id')
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    pids = args.pids or sorted(packets.packets)
+    failed = 0
+    for pid in pids:
+        mismatches = fuzz_packet(pid, rnd, args.rounds, args.size)
+        if not mismatches:
+            continue
+        failed += 1
+        log.msg("packet %d: %d of %d bodies disagree" % (pid, len(mismatches), args.rounds))
+        for body, results in mismatches[:args.show]:
+            log.msg("  body %s" % body.encode("hex"))
+            for name, result in results:
+                log.msg("    %-9s %s" % (name, result[1]))
+    log.msg("%d packet ids checked, %d disagree" % (len(pids), failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(start())
@@ -0,0 +1,79 @@
+import signal
+import argparse
+
+import syspath_fix
+syspath_fix.update_sys_path()
+
+from twisted.internet import reactor
+
+import twistedbot.factory as factory
+import twistedbot.config as config
+import twistedbot.logbot as logbot
+from twistedbot.world import World
+from twistedbot.sectionstore import SectionStore
+
+
+log = logbot.getlogger("MAIN")
+
+
+def start():
+    parser = argparse.ArgumentParser(description='Run many bots in one process.')
+    parser.add_argument('--serverhost', default=config.SERVER_HOST,
+                        dest='serverhost', help='Minecraft server host')
+    parser.add_argument('--serverport', type=int, default=config.SERVER_PORT,
+                        dest='serverport', help='Minecraft server port')
+    parser.add_argument('--count', type=int, default=10,
+                        dest='count', help='number of bots')
+    parser.add_argument('--nameprefix', default=config.USERNAME,
+                        dest='nameprefix',
+                        help='bot usernames are the prefix followed by the bot number')
+    parser.add_argument('--use_encryption',
+                        action='store_true',
+                        help='use encryption, the bots do not log in online')
+    parser.add_argument('--commandername', default=config.COMMANDER,
+                        dest='commandername',
+                        help='your username that you use in Minecraft')
+    parser.add_argument('--stagger', type=float, default=0.5,
+                        dest='stagger',
+                        help='seconds between connects of two consecutive bots')
+    parser.add_argument('--log2file',
+                        action='store_true',
+                        help='Save log data to file')
+    args = parser.parse_args()
+    if args.log2file:
+        logbot.start_bot_filelog()
+    host = args.serverhost
+    port = args.serverport
+    if args.use_encryption:
+        factory.import_encryption()
+    factories = []
+    section_store = SectionStore()
+    for i in xrange(args.count):
+        bot_name = "%s%d" % (args.nameprefix, i)
+        # numbered bots have no accounts to authenticate with
+        bot_config = config.BotConfig(USERNAME=bot_name,
+                                      USE_ENCRYPTION=args.use_encryption,
+                                      ONLINE_LOGIN=False,
+                                      COMMANDER=args.commandername.lower(),
+                                      SERVER_HOST=host,
+                                      SERVER_PORT=port)
+        world = World(host=host, port=port, commander_name=args.commandername, bot_name=bot_name,
+                      bot_config=bot_config, section_store=section_store)
+        mc_factory = factory.MineCraftFactory(world)
+        factories.append(mc_factory)
+        reactor.callLater(i * args.stagger, reactor.connectTCP, host, port, mc_factory)
+        reactor.addSystemEventTrigger("before", "shutdown", world.on_shutdown)
+    log.msg("starting %d bots, connecting every %.2f seconds" % (args.count, args.stagger))
+
+    def customKeyboardInterruptHandler(signum, stackframe):
+        log.msg("CTRL-C from user, exiting....")
+        for mc_factory in factories:
+            mc_factory.log_connection_lost = False
+        reactor.callFromThread(reactor.stop)
+
+    signal.signal(signal.SIGINT, customKeyboardInterruptHandler)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    start()
@@ -8,7 +8,8 @@ import argparse
 from twisted.internet import reactor
 from twisted.internet.protocol import Protocol, Factory
 
-from twistedbot.packets import make_packet, parse_packets, packets
+from twistedbot.packets import make_packet, packets
+from twistedbot.framing import PacketBuffer, LazyPayload
 from twistedbot import encryption
 from twistedbot import logbot
 from twistedbot import config
@@ -33,10 +34,21 @@ class ProxyProtocol(Protocol):
     def parse_encrypted_stream(self, bytestream):
         plaintext = self.decipher.decrypt(bytestream)
         self.opposite_proxy_side.protocol.sendData(plaintext)
-        data = self.leftover + plaintext
-        parsed_packets, self.leftover = parse_packets(data)
+        self.buffer.append(plaintext)
+        parsed_packets = self.buffer.read_packets()
         processor.process_packets(self.mgsside, parsed_packets,
-                                  encrypted=True, leftover=self.leftover)
+                                  encrypted=True, leftover=self.buffer.leftover)
+
+    def read_frames(self, bytestream):
+        """
+        unencrypted part of the stream, returns list of tuples
+        (packet id, payload, raw packet bytes)
+        """
+        self.buffer.append(bytestream)
+        frames = [(pid, LazyPayload(pid, body), chr(pid) + str(body)) for pid, body in self.buffer.frames()]
+        processor.process_packets(
+            self.mgsside, [(pid, payload) for pid, payload, _ in frames], leftover=self.buffer.leftover)
+        return frames
 
     def start_encryption(self):
         self.encryption_on = True
@@ -50,7 +62,7 @@ class ProxyServerProtocol(ProxyProtocol):
         self.factory = factory
         self.encryption_on = False
         self.parser = self.parse_stream
-        self.leftover = ""
+        self.buffer = PacketBuffer(lazy=True)
         self.mgsside = self.factory.mgsside
         self.log = self.factory.log
         self.opposite_proxy_side = self.factory.proxyclient
@@ -64,26 +76,22 @@ class ProxyServerProtocol(ProxyProtocol):
         self.factory.proxyclient.protocol.transport.loseConnection()
 
     def parse_stream(self, bytestream):
-        data = self.leftover + bytestream
-        parsed_packets, self.leftover = parse_packets(data)
-        processor.process_packets(
-            self.mgsside, parsed_packets, leftover=self.leftover)
-        for p in parsed_packets:
-            if p[0] == 253:
-                self.on_encryption_key_request(p[1])
+        for pid, payload, raw in self.read_frames(bytestream):
+            if pid == 253:
+                self.on_encryption_key_request(payload)
                 self.factory.proxyclient.protocol.send_encryption_key_request(
-                    p[1])
-            elif p[0] == 252:
+                    payload)
+            elif pid == 252:
                 """ STEP 4: initiate encryption on both side. """
-                self.factory.proxyclient.protocol.sendData(data)
+                self.factory.proxyclient.protocol.sendData(raw)
                 self.start_encryption()
                 self.factory.proxyclient.protocol.start_encryption()
-            elif p[0] == 254:
-                self.factory.proxyclient.protocol.sendData(data)
-            elif p[0] == 255:
-                self.factory.proxyclient.protocol.sendData(data)
+            elif pid == 254:
+                self.factory.proxyclient.protocol.sendData(raw)
+            elif pid == 255:
+                self.factory.proxyclient.protocol.sendData(raw)
             else:
-                log.msg("packet %d cannot be unencrypted" % p[0])
+                log.msg("packet %d cannot be unencrypted" % pid)
 
     def on_encryption_key_request(self, c):
         """
@@ -151,7 +159,7 @@ class ProxyClientProtocol(ProxyProtocol):
         self.factory = factory
         self.encryption_on = False
         self.parser = self.parse_stream
-        self.leftover = ""
+        self.buffer = PacketBuffer(lazy=True)
         self.mgsside = self.factory.mgsside
         self.log = self.factory.log
         self.proxyserver = ProxyServerFactory(self.factory)
@@ -170,24 +178,20 @@ class ProxyClientProtocol(ProxyProtocol):
         if self.proxyserver.protocol is None:
             self.log.msg(
                 "Not having connection to server yet, postpone proxying")
-            self.leftover += bytestream
+            self.buffer.append(bytestream)
             return
-        data = self.leftover + bytestream
-        parsed_packets, self.leftover = parse_packets(data)
-        processor.process_packets(
-            self.mgsside, parsed_packets, leftover=self.leftover)
-        for p in parsed_packets:
-            if p[0] == 252:
-                self.on_encryption_key_responce(p[1])
+        for pid, payload, raw in self.read_frames(bytestream):
+            if pid == 252:
+                self.on_encryption_key_responce(payload)
                 self.proxyserver.protocol.send_encryption_key_response()
-            elif p[0] == 2:
-                self.proxyserver.protocol.send_handshake(p[1])
-            elif p[0] == 254:
-                self.proxyserver.protocol.sendData(data)
-            elif p[0] == 255:
-                self.proxyserver.protocol.sendData(data)
+            elif pid == 2:
+                self.proxyserver.protocol.send_handshake(payload.decode())
+            elif pid == 254:
+                self.proxyserver.protocol.sendData(raw)
+            elif pid == 255:
+                self.proxyserver.protocol.sendData(raw)
             else:
-                log.msg("packet %d cannot be unencrypted" % p[0])
+                log.msg("packet %d cannot be unencrypted" % pid)
 
     def on_encryption_key_responce(self, c):
         """
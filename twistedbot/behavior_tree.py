@@ -1,18 +1,18 @@
 
-from twisted.internet.task import cooperate
+import heapq
+
 from twisted.internet.defer import inlineCallbacks
 
 import items
 import recipes
-import config
 import logbot
 import utils
 import fops
 import dig
 import packets
 import blocks
-from pathfinding import AStarBBCol, AStarCoords, AStarMultiCoords
-from gridspace import GridSpace
+import pathworker
+from pathfinding import AStarBBCol, AStarCoords, AStarMultiCoords, AStarSectionsCoords, TravelPlan, cooperate
 from inventory import InventoryManipulation
 
 
@@ -71,9 +71,30 @@ class BlackBoard(object):
         self.receive_inventory = self._world.inventories.get_open_window
         self.blocks_around = self._world.grid.blocks_in_distance
 
+    def watch_block_changes(self, watcher):
+        events = self._world.eventregister
+        events.on_block_change.subscribe(watcher.on_block_change)
+        events.on_multi_block_change.subscribe(watcher.on_multi_block_change)
+        events.on_explosion.subscribe(watcher.on_explosion)
+
+    def unwatch_block_changes(self, watcher):
+        events = self._world.eventregister
+        events.on_block_change.unsubscribe(watcher.on_block_change)
+        events.on_multi_block_change.unsubscribe(watcher.on_multi_block_change)
+        events.on_explosion.unsubscribe(watcher.on_explosion)
+
     def positions_to_dig(self, coords):
-        gs = GridSpace(self.grid)
-        return list(gs.positions_to_dig(coords))
+        return list(self.grid.grid_space.positions_to_dig(coords))
+
+    def positions_to_dig_blocks(self, blocks):
+        """ cells to stand on when digging or using any of the blocks, each with its nearest block """
+        goals = {}
+        for block in blocks:
+            for position in self.grid.grid_space.positions_to_dig(block.coords):
+                other = goals.get(position, None)
+                if other is None or (block.coords - position).size_pow < (other.coords - position).size_pow:
+                    goals[position] = block
+        return goals
 
     def add_subbehavior(self, behavior):
         self._manager.bqueue.append(behavior)
@@ -107,6 +128,10 @@ class BlackBoard(object):
     def bot_object(self):
         return self._bot.bot_object
 
+    @property
+    def config(self):
+        return self._world.config
+
     @property
     def grid(self):
         return self._world.grid
@@ -697,26 +722,30 @@ class CollectMine(BTSequencer):
         self.itemstack = itemstack
         self.recipe = recipe
         self.name = 'mine %s' % self.itemstack
-        self.blocks_around = []
+        self.dig_goals = {}
 
     def is_valid(self):
-        return self.blocks_around
+        return len(self.dig_goals) > 0
 
     def setup(self):
         _, self.have_tool, self.mine_tool = self.blackboard.inventory_tool_for_block(self.recipe.block)
-        self.blocks_around = self.blackboard.blocks_around(self.blackboard.bot_object.position, block_number=self.recipe.block.number, block_filter=self.recipe.block_filter)
+        position = self.blackboard.bot_object.position
+        blocks_around = self.blackboard.blocks_around(position, block_number=self.recipe.block.number, block_filter=self.recipe.block_filter)
+        # every block is a few hundred goal cells, only the nearest go to the search
+        candidates = heapq.nsmallest(self.blackboard.config.COLLECT_MINE_CANDIDATES, blocks_around, key=lambda b: (b.coords - position).size_pow)
+        self.dig_goals = self.blackboard.positions_to_dig_blocks(candidates)
 
     def choices(self):
         if not self.have_tool:
             yield self.make_behavior(Collect, itemstack=self.blackboard.inventory_min_tool_for_block(self.recipe.block))
-        for block in self.blocks_around:
-            yield self.make_behavior(GetTo, digtarget=block.coords)
-            if not self.have_tool:
-                yield self.make_behavior(Collect, itemstack=self.blackboard.inventory_min_tool_for_block(self.recipe.block))
-            yield self.make_behavior(InventorySelectActive, itemstack=self.mine_tool)
-            yield self.make_behavior(DigBlock, block=block)
-            yield self.make_behavior(WaitForDrop, block=block, itemstack=self.recipe.itemstack, drop_everytime=self.recipe.drop_everytime)
-            break
+        travel = self.make_behavior(TravelTo, multiple_goals=self.dig_goals.keys())
+        yield travel
+        block = self.dig_goals[travel.reached]
+        if not self.have_tool:
+            yield self.make_behavior(Collect, itemstack=self.blackboard.inventory_min_tool_for_block(self.recipe.block))
+        yield self.make_behavior(InventorySelectActive, itemstack=self.mine_tool)
+        yield self.make_behavior(DigBlock, block=block)
+        yield self.make_behavior(WaitForDrop, block=block, itemstack=self.recipe.itemstack, drop_everytime=self.recipe.drop_everytime)
 
 
 class CollectCraft(BTSequencer):
@@ -780,7 +809,6 @@ class CraftItem(BTSelector):
         self.itemstack = itemstack
         self.recipe = recipe
         self.name = 'craft %s' % self.itemstack
-        self.sorted_tables = None
         log.msg(self.name)
 
     def is_valid(self):
@@ -799,36 +827,33 @@ class CraftItem(BTSelector):
     def is_tables_around(self):
         return len(self.crafting_tables_around) > 0
 
-    def get_closest_table(self):
-        self.crafting_tables_around = sorted(self.crafting_tables_around, key=lambda b: (b.coords - self.blackboard.bot_object.position).size_pow)
-        return self.crafting_tables_around.pop(0)
-
     def choices(self):
         if self.recipe.need_bench:
-            while self.is_tables_around:
-                table = self.get_closest_table()
-                yield self.make_behavior(CraftItemAtTable, recipe=self.recipe, craftingtable=table)
+            yield self.make_behavior(CraftItemAtTable, recipe=self.recipe, craftingtables=self.crafting_tables_around)
         else:
             yield self.make_behavior(CraftItemInventory, recipe=self.recipe)
 
 
 class CraftItemAtTable(BTSequencer):
-    def __init__(self, recipe=None, craftingtable=None, **kwargs):
+    """ one search to the nearest reachable of the tables, then crafts there """
+
+    def __init__(self, recipe=None, craftingtables=None, **kwargs):
         super(CraftItemAtTable, self).__init__(**kwargs)
         self.recipe = recipe
-        self.craftingtable = craftingtable
-        self.name = "go to %s and craft %s" % (craftingtable, recipe)
+        self.craftingtables = craftingtables
+        self.name = "go to one of %d crafting tables and craft %s" % (len(craftingtables), recipe)
         log.msg(self.name)
 
     def is_valid(self):
-        return len(self.dig_positions) > 0
+        return len(self.dig_goals) > 0
 
     def setup(self):
-        self.dig_positions = self.blackboard.positions_to_dig(self.craftingtable.coords)
+        self.dig_goals = self.blackboard.positions_to_dig_blocks(self.craftingtables)
 
     def choices(self):
-        yield self.make_behavior(TravelTo, coords=self.craftingtable.coords, multiple_goals=self.dig_positions)
-        yield self.make_behavior(CraftItemTable, recipe=self.recipe, craftingtable=self.craftingtable)
+        travel = self.make_behavior(TravelTo, multiple_goals=self.dig_goals.keys())
+        yield travel
+        yield self.make_behavior(CraftItemTable, recipe=self.recipe, craftingtable=self.dig_goals[travel.reached])
 
 
 class TravelTo(BTSequencer):
@@ -839,12 +864,17 @@ class TravelTo(BTSequencer):
         self.travel_multiple_goals = multiple_goals
         self.shorten_path_by = shorten_path_by
         self.path = None
+        self.plan = None
+        # goal cell the path leads to
+        self.reached = None
         log.msg(self.name)
 
     @property
     def name(self):
         if self.travel_coords is not None:
             return 'travel to %s from %s' % (self.blackboard.get_block_coords(self.travel_coords), self.blackboard.bot_standing_on_block(self.blackboard.bot_object))
+        elif self.travel_multiple_goals is not None:
+            return 'travel to nearest of %d cells from %s' % (len(self.travel_multiple_goals), self.blackboard.bot_standing_on_block(self.blackboard.bot_object))
         else:
             return 'travel to %s from %s' % (self.travel_bb.bottom_center, self.blackboard.bot_standing_on_block(self.blackboard.bot_object))
 
@@ -858,33 +888,70 @@ class TravelTo(BTSequencer):
             yield utils.reactor_break()
             sb = self.blackboard.bot_standing_on_block(self.blackboard.bot_object)
         else:
-            if self.travel_multiple_goals is not None:
-                d = cooperate(AStarMultiCoords(dimension=self.blackboard.dimension,
-                                               start_coords=sb.coords,
-                                               goal_coords=self.travel_coords,
-                                               multiple_goals=self.travel_multiple_goals)).whenDone()
-            elif self.travel_coords is not None:
-                d = cooperate(AStarCoords(dimension=self.blackboard.dimension,
-                                          start_coords=sb.coords,
-                                          goal_coords=self.travel_coords)).whenDone()
+            if self.travel_multiple_goals is None and self.travel_coords is not None and self.blackboard.config.PATHFIND_WORKERS > 0:
+                d = pathworker.workers(self.blackboard.config).search(self.blackboard.grid, sb.coords, self.travel_coords)
             else:
-                d = cooperate(AStarBBCol(dimension=self.blackboard.dimension,
-                                         start_coords=sb.coords,
-                                         bb=self.travel_bb)).whenDone()
+                if self.travel_multiple_goals is not None:
+                    search = AStarMultiCoords(dimension=self.blackboard.dimension,
+                                              start_coords=sb.coords,
+                                              multiple_goals=self.travel_multiple_goals)
+                elif self.travel_coords is not None:
+                    if (sb.coords - self.travel_coords).manhatan_size > self.blackboard.config.PATHFIND_SECTIONS_DISTANCE:
+                        search_cls = AStarSectionsCoords
+                    else:
+                        search_cls = AStarCoords
+                    search = search_cls(dimension=self.blackboard.dimension,
+                                        start_coords=sb.coords,
+                                        goal_coords=self.travel_coords)
+                else:
+                    search = AStarBBCol(dimension=self.blackboard.dimension,
+                                        start_coords=sb.coords,
+                                        bb=self.travel_bb)
+                d = cooperate(search).whenDone()
+                d.addCallback(lambda search: search.path)
             d.addErrback(logbot.exit_on_error)
-            astar = yield d
-            if astar.path is not None:
+            path = yield d
+            if path is not None:
                 current_start = self.blackboard.bot_standing_on_block(self.blackboard.bot_object)
                 if sb == current_start:
-                    self.path = astar.path
+                    self.path = path
+                    self.reached = path[0].coords
                     if self.shorten_path_by > 0:
                         self.path = self.path[self.shorten_path_by:]
                     self.start_coords = current_start.coords
+                    self.plan = TravelPlan(self.blackboard.grid.grid_space, self.path, self.blackboard.config.PATH_SMOOTH_STEPS)
+                    self.blackboard.watch_block_changes(self.plan)
 
     def choices(self):
-        for step in reversed(self.path):
-            yield self.make_behavior(MoveTo, start=self.start_coords, target=step.coords)
-            self.start_coords = step.coords
+        while not self.plan.finished:
+            self.start_coords, step = self.plan.take_step()
+            yield self.make_behavior(MoveTo, start=self.start_coords, target=step)
+
+    @inlineCallbacks
+    def tick(self):
+        if not self.plan.repair():
+            log.msg('cannot repair path from %s' % self.start_coords)
+            self.status = Status.failure
+        else:
+            yield super(TravelTo, self).tick()
+        if self.status in (Status.success, Status.failure):
+            self.stop_watching()
+
+    def from_child(self, child):
+        if child.status == Status.failure and self.plan.reroute():
+            self.status = Status.running
+            return
+        super(TravelTo, self).from_child(child)
+        if self.status == Status.failure:
+            self.stop_watching()
+
+    def stop_watching(self):
+        if self.plan is not None:
+            self.blackboard.unwatch_block_changes(self.plan)
+            self.plan = None
+
+    def cleanup(self):
+        self.stop_watching()
 
 
 class MoveTo(BTAction):
@@ -894,16 +961,21 @@ class MoveTo(BTAction):
         self.start_coords = start
         self.was_at_target = False
         self.hold_position_flag = False
+        self.checked_versions = None
         self.name = 'move to %s' % str(self.target_coords)
 
     def _check_status(self, b_obj):
-        gs = GridSpace(self.blackboard.grid)
-        self.start_state = gs.get_state_coords(self.start_coords)
-        self.target_state = gs.get_state_coords(self.target_coords)
-        go = gs.can_go(self.start_state, self.target_state)
-        if not go:
-            log.msg('cannot go between %s %s' % (self.start_state, self.target_state))
-            return Status.failure
+        gs = self.blackboard.grid.grid_space
+        # the move is checked again only after blocks around it changed
+        versions = gs.versions_between(self.start_coords, self.target_coords)
+        if versions != self.checked_versions:
+            self.start_state = gs.get_state_coords(self.start_coords)
+            self.target_state = gs.get_state_coords(self.target_coords)
+            go = gs.can_go_straight(self.start_state, self.target_state)
+            if not go:
+                log.msg('cannot go between %s %s' % (self.start_state, self.target_state))
+                return Status.failure
+            self.checked_versions = versions
         if not self.was_at_target:
             self.was_at_target = self.target_state.vertical_center_in(b_obj.position)
         if self.target_state.base_in(b_obj.aabb) and self.target_state.touch_platform(b_obj.position):
@@ -971,7 +1043,7 @@ class ShowCursor(BTAction):
     def __init__(self, player=None, **kwargs):
         super(ShowCursor, self).__init__(**kwargs)
         self.player = player
-        self.name = 'show player %s cursor' % config.COMMANDER
+        self.name = 'show player %s cursor' % self.blackboard.commander_name
 
     def on_start(self):
         player_look_vector = utils.yaw_pitch_to_vector(self.player.yaw, self.player.pitch)
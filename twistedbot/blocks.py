@@ -1,4 +1,5 @@
 
+import array
 import re
 
 import logbot
@@ -1879,4 +1880,64 @@ class Dropper(BlockCube):
     material = materials.rock
 
 
+block_kinds = [None for _ in xrange(256 * 16)]
+for cls in block_list:
+    if cls is not None:
+        for meta in xrange(16):
+            block_kinds[cls.number << 4 | meta] = cls(None, None, None, None, meta)
+
+
+def block_kind(number, meta):
+    """
+    Shared block of type number with meta, without grid and coordinates.
+    Only properties that do not depend on the position or the neighbours
+    can be read from it.
+    """
+    return block_kinds[number << 4 | meta]
+
+
+FALL_THROUGH = 1
+STAND_ON = 1 << 1
+FREE = 1 << 2
+CLIMBABLE = 1 << 3  # not set for vines, they are climbable only next to a cube
+BURNING = 1 << 4
+WATER = 1 << 5
+LADDER = 1 << 6
+VINE = 1 << 7
+LIQUID = 1 << 8
+AVOID = 1 << 9  # lava, fire and cobweb
+NON_SOLID = 1 << 10
+
+
+def kind_flags(kind):
+    flags = 0
+    if kind.can_fall_through:
+        flags |= FALL_THROUGH
+    if kind.can_stand_on:
+        flags |= STAND_ON
+    if kind.is_free:
+        flags |= FREE
+    if kind.is_vine:
+        flags |= VINE
+    elif kind.is_climbable:
+        flags |= CLIMBABLE
+    if kind.is_burning:
+        flags |= BURNING
+    if kind.is_water:
+        flags |= WATER
+    if kind.is_ladder:
+        flags |= LADDER
+    if kind.material.is_liquid:
+        flags |= LIQUID
+    if kind.is_lava or kind.number == Fire.number or kind.number == Cobweb.number:
+        flags |= AVOID
+    if isinstance(kind, BlockNonSolid):
+        flags |= NON_SOLID
+    return flags
+
+
+# properties of block_kinds as bit flags, same index
+block_flags = array.array('H', [0 if kind is None else kind_flags(kind) for kind in block_kinds])
+
+
 log.msg("registered %d blocks" % len(block_map))
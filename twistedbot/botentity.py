@@ -4,7 +4,6 @@ import math
 
 import config
 import utils
-import packets
 import logbot
 import fops
 import blocks
@@ -144,11 +143,11 @@ class BotEntity(object):
             utils.do_now(self.behavior_tree.tick)
 
     def send_location(self, b_obj):
+        """ every tick, plain dicts are enough for the fixed layout encoder """
         self.world.send_packet("player position&look", {
-            "position": packets.Container(x=b_obj.x, y=b_obj.y, z=b_obj.z,
-                                          stance=b_obj.stance),
-            "orientation": packets.Container(yaw=b_obj.yaw, pitch=b_obj.pitch),
-            "grounded": packets.Container(grounded=b_obj.on_ground)})
+            "position": {"x": b_obj.x, "y": b_obj.y, "z": b_obj.z, "stance": b_obj.stance},
+            "orientation": {"yaw": b_obj.yaw, "pitch": b_obj.pitch},
+            "grounded": {"grounded": b_obj.on_ground}})
 
     def send_action(self, b_obj):
         """
@@ -218,7 +217,7 @@ class BotEntity(object):
         return is_in_water
 
     def handle_lava_movement(self, b_obj):
-        for blk in self.world.grid.blocks_in_aabb(
+        for blk in self.world.grid.block_kinds_in_aabb(
                 b_obj.aabb.expand(-0.1,
                                   -0.4,
                                   -0.1)):
@@ -369,7 +368,7 @@ class BotEntity(object):
         slowdown = 0.91
         if b_obj.on_ground:
             slowdown = 0.546
-            block = self.world.grid.get_block(b_obj.grid_x, b_obj.grid_y - 1, b_obj.grid_z)
+            block = self.world.grid.get_block_kind(b_obj.grid_x, b_obj.grid_y - 1, b_obj.grid_z)
             if block is not None:
                 slowdown = block.slipperiness * 0.91
         return slowdown
@@ -404,7 +403,7 @@ class BotEntity(object):
 
     def is_in_web(self, b_obj):
         bb = b_obj.aabb.expand(dx=-0.001, dy=-0.001, dz=-0.001)
-        for blk in self.world.grid.blocks_in_aabb(bb):
+        for blk in self.world.grid.block_kinds_in_aabb(bb):
             if isinstance(blk, blocks.Cobweb):
                 return True
         return False
@@ -413,7 +412,7 @@ class BotEntity(object):
         bb = b_obj.aabb
         eye_y = bb.min_y + eye_height
         ey = utils.grid_shift(eye_y)
-        blk = self.world.grid.get_block(bb.gridpos_x, ey, bb.gridpos_z)
+        blk = self.world.grid.get_block_kind(bb.gridpos_x, ey, bb.gridpos_z)
         if blk.is_water:
             wh = blk.height_percent - 0.11111111
             return eye_y < (ey + 1 - wh)
@@ -4,7 +4,6 @@ from collections import deque
 
 from pyparsing import ParseException, Word, OneOrMore, alphanums
 
-import config
 import behavior_tree as bt
 import logbot
 
@@ -47,7 +46,7 @@ class Chat(object):
                     self.chat_spam_treshold_count += 20
                     self.world.send_packet("chat message", {"message": "spam protection, posponing chat"})
                 return
-            if config.WHISPER:
+            if self.world.config.WHISPER:
                 msg = "/tell %s %s" % (self.world.commander.name, msg)
             #TODO split msg in a better way
             if len(msg) > 100:
@@ -51,6 +51,7 @@ SPEED_LIQUID_JUMP = 0.04
 SPEED_CLIMB = 0.2
 
 TIME_STEP = 0.05
+CHUNK_COMMIT_LIMIT = 32  # chunk columns added to the grid per tick
 
 COST_JUMP = 1.1
 COST_LADDER = 0.21 / \
@@ -58,5 +59,33 @@ COST_LADDER = 0.21 / \
 COST_FALL = 1.1
 COST_DIRECT = 1
 COST_DIAGONAL = math.sqrt(2) * COST_DIRECT
+COST_SWIM = 2  # per block, swimming is about half as fast as walking
+COST_BURNING = 20  # extra for a step into fire or lava, 0 to ignore
 PATHFIND_LIMIT = 400  # roughly in blocks
+PATHFIND_TIME_BUDGET = 0.005  # seconds of path search per reactor turn
+PATHFIND_JUMP_POINTS = False  # jump over open flat ground, fewer expansions but the scans cost time too
+PATHFIND_SECTIONS_DISTANCE = 64  # longer trips are searched over sections first
+PATHFIND_WORKERS = 0  # processes for path searches, 0 searches in the reactor
+PATHFIND_WORKER_MARGIN = 32  # blocks around start and goal sent to a worker
+COLLECT_MINE_CANDIDATES = 16  # nearest blocks searched at once when mining
+GRIDSPACE_CACHE_LIMIT = 50000  # node states kept per dimension
+PATH_CACHE_SIZE = 64  # found paths kept for repeated trips
+PATH_SMOOTH_STEPS = 16  # most cells walked in one straight move, 0 moves cell by cell
 HORIZONTAL_MOVE_DISTANCE_LIMIT = 2.83
+
+
+class BotConfig(object):
+    """
+    Settings of one bot. Values not given here fall back to the module
+    defaults above, so many bots can run side by side without mutating
+    this module.
+    """
+
+    def __init__(self, **settings):
+        self.__dict__.update(settings)
+
+    def __getattr__(self, name):
+        try:
+            return globals()[name]
+        except KeyError:
+            raise AttributeError(name)
@@ -7,12 +7,12 @@ from twisted.internet import reactor
 from twisted.web.client import getPage
 from twisted.internet.defer import inlineCallbacks
 
-import config
 import hashlib
 import logbot
 import proxy_processors.default
 import utils
-from packets import parse_packets, make_packet, packets_by_name, Container
+from packets import make_packet, packets_by_name, Container
+from framing import PacketBuffer
 from proxy_processors.default import process_packets as packet_printout
 
 encryption = None
@@ -37,9 +37,10 @@ class MineCraftProtocol(Protocol):
         self.world = world
         self.world.protocol = self
         self.event = world.eventregister
-        self.leftover = ""
+        self.buffer = PacketBuffer(lazy=True)
         self.encryption_on = False
         self.packets = deque()
+        self.outgoing = []
 
         self.router = {
             0: self.p_ping,
@@ -113,6 +114,7 @@ class MineCraftProtocol(Protocol):
 
     def connectionLost(self, reason):
         self.packets = deque()
+        self.outgoing = []
         self.event.on_connection_lost.fire()
 
     def sendData(self, bytestream):
@@ -129,17 +131,33 @@ class MineCraftProtocol(Protocol):
     def parse_stream(self, bytestream):
         if self.encryption_on:
             bytestream = self.decipher.decrypt(bytestream)
-        parsed_packets, self.leftover = parse_packets(self.leftover + bytestream)
-        if config.DEBUG:
-            packet_printout("SERVER", parsed_packets, self.encryption_on, self.leftover)
+        self.buffer.append(bytestream)
+        parsed_packets = self.buffer.read_packets()
+        if self.world.config.DEBUG:
+            packet_printout("SERVER", parsed_packets, self.encryption_on, self.buffer.leftover)
         self.packets.extend(parsed_packets)
         self.packet_iter(self.packets)
 
-    def send_packet(self, name, payload):
+    def send_packet(self, name, payload, immediate=False):
+        """
+        After login the packets are queued and written together by
+        flush_packets at the end of the world tick. Immediate packets
+        are written right away, after anything already queued.
+        """
         p = make_packet(name, payload)
-        if config.DEBUG:
+        if self.world.config.DEBUG:
             packet_printout("CLIENT", [(packets_by_name[name], Container(**payload))])
-        self.sendData(p)
+        if immediate or not self.world.logged_in:
+            self.flush_packets()
+            self.sendData(p)
+        else:
+            self.outgoing.append(p)
+
+    def flush_packets(self):
+        if self.outgoing:
+            data = "".join(self.outgoing)
+            self.outgoing = []
+            self.sendData(data)
 
     def packet_iter(self, ipackets):
         while ipackets:
@@ -280,7 +298,7 @@ class MineCraftProtocol(Protocol):
 
     def p_chunk(self, c):
         self.event.on_load_chunk.fire(x=c.x, z=c.z, continuous=c.continuous, primary_bit=c.primary_bitmap,
-                                      add_bit=c.add_bitmap, data_array=c.data.decode('zlib'))
+                                      add_bit=c.add_bitmap, zlib_data=c.data)
 
     def p_multi_block_change(self, c):
         self.event.on_multi_block_change.fire(x=c.x, z=c.z, blocks=c.blocks)
@@ -299,7 +317,7 @@ class MineCraftProtocol(Protocol):
         pass
 
     def p_bulk_chunk(self, c):
-        self.event.on_load_bulk_chunk.fire(metas=c.meta, data_array=c.data.decode('zlib'), light_data=c.light_data)
+        self.event.on_load_bulk_chunk.fire(metas=c.meta, zlib_data=c.data, light_data=c.light_data)
 
     def p_explosion(self, c):
         self.event.on_explosion.fire(x=c.x, y=c.y, z=c.z, radius=c.radius, records=c.records, player_motion_x=c.player_motion_x,  player_motion_y=c.player_motion_y, player_motion_z=c.player_motion_z) 
@@ -401,20 +419,20 @@ class MineCraftProtocol(Protocol):
         else:
             d = "%x" % d
         hashstr = d
-        url = "http://session.minecraft.net/game/joinserver.jsp?user=%s&serverId=%s&sessionId=%s" % (config.USERNAME, hashstr, self.factory.session_id)
+        url = "http://session.minecraft.net/game/joinserver.jsp?user=%s&serverId=%s&sessionId=%s" % (self.world.config.USERNAME, hashstr, self.factory.session_id)
         response = yield getPage(url).addErrback(logbot.exit_on_error)
         log.msg("responce from http://session.minecraft.net: %s" % response)
 
     @inlineCallbacks
     def p_encryption_key_request(self, c):
         self.event.on_encryption_key_request.fire(server_id=c.server_id, public_key=c.public_key, verify_token=c.verify_token)
-        if config.USE_ENCRYPTION:
+        if self.world.config.USE_ENCRYPTION:
             self.cipher = encryption.make_aes(self.factory.client_key, self.factory.client_key)
             self.decipher = encryption.make_aes(self.factory.client_key, self.factory.client_key)
             public_key = encryption.load_pubkey(c.public_key)
             enc_shared_sercet = encryption.encrypt(self.factory.client_key, public_key)
             enc_4bytes = encryption.encrypt(c.verify_token, public_key)
-            if config.ONLINE_LOGIN:
+            if self.world.config.ONLINE_LOGIN:
                 yield self.do_auth(c.server_id, c.public_key)
             self.send_packet("encryption key response",
                              {"shared_length": len(enc_shared_sercet),
@@ -432,21 +450,21 @@ class MineCraftFactory(ReconnectingClientFactory):
     def __init__(self, world):
         self.world = world
         self.world.factory = self
-        self.maxDelay = config.CONNECTION_MAX_DELAY
-        self.initialDelay = config.CONNECTION_INITIAL_DELAY
+        self.maxDelay = self.world.config.CONNECTION_MAX_DELAY
+        self.initialDelay = self.world.config.CONNECTION_INITIAL_DELAY
         self.delay = self.initialDelay
         self.log_connection_lost = True
         self.client_key = None
         self.clean_to_connect = True
 
     def startFactory(self):
-        if config.USE_ENCRYPTION:
+        if self.world.config.USE_ENCRYPTION:
             self.client_key = encryption.get_random_bytes()
 
     @inlineCallbacks
     def online_auth(self):
         log.msg('doing online login')
-        url = "http://login.minecraft.net/?user=%s&password=%s&version=1337" % (config.EMAIL, config.PASSWORD)
+        url = "http://login.minecraft.net/?user=%s&password=%s&version=1337" % (self.world.config.EMAIL, self.world.config.PASSWORD)
         response = yield getPage(url).addErrback(logbot.exit_on_error)
         log.msg("responce from http://login.minecraft.net: %s" % response)
         if ":" not in response:  # TODO well this is blunt approach, should use code with http code check
@@ -454,16 +472,16 @@ class MineCraftFactory(ReconnectingClientFactory):
             log.msg("did not authenticate with mojang, quiting")
             reactor.stop()
         else:
-            _, _, config.USERNAME, self.session_id, _ = response.split(':')
-            log.msg("my username according to Minecraft is %s" % config.USERNAME)
+            _, _, self.world.config.USERNAME, self.session_id, _ = response.split(':')
+            log.msg("my username according to Minecraft is %s" % self.world.config.USERNAME)
             utils.do_later(10, self.keep_alive)
 
     @inlineCallbacks
     def keep_alive(self):
         log.msg('keep alive to https://login.minecraft.net')
-        url = "https://login.minecraft.net/session?name=%s&session=%s" % (config.USERNAME, self.session_id)
+        url = "https://login.minecraft.net/session?name=%s&session=%s" % (self.world.config.USERNAME, self.session_id)
         yield getPage(url)
-        utils.do_later(config.KEEP_ALIVE_PERIOD, self.keep_alive)
+        utils.do_later(self.world.config.KEEP_ALIVE_PERIOD, self.keep_alive)
 
     def startedConnecting(self, connector):
         log.msg('started connecting to %s:%d' % (connector.host, connector.port))
@@ -0,0 +1,293 @@
+"""
+Hand written codecs for the high frequency packets.
+
+Packets listed here are decoded with precompiled struct formats into
+namedtuple records instead of going through construct. Records carry the
+same field names as the construct definitions in packets.py, so handlers
+can not tell the difference. Ids not listed here use construct.
+"""
+
+from collections import namedtuple
+from functools import wraps
+from codecs import utf_16_be_decode, utf_16_be_encode
+from struct import Struct, error
+
+
+def is_record(obj):
+    return isinstance(obj, tuple) and hasattr(obj, "_fields")
+
+
+def _plain(value):
+    """ records of this module, also in lists, as dicts """
+    if is_record(value):
+        return dict((name, _plain(field)) for name, field in zip(value._fields, value))
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _accepts_records(encode):
+    """ encode reads fields by name, records are turned into dicts first """
+    @wraps(encode)
+    def encode_any(p):
+        if is_record(p):
+            p = _plain(p)
+        return encode(p)
+    return encode_any
+
+
+def _field(body, start, size):
+    """ size bytes from start, fails like construct on a short body """
+    if size < 0 or start + size > len(body):
+        raise error("field of %d bytes at %d, body has %d" % (size, start, len(body)))
+    return body[start:start + size]
+
+
+KeepAlive = namedtuple("KeepAlive", "pid")
+TimeUpdate = namedtuple("TimeUpdate", "timestamp daytime")
+Position = namedtuple("Position", "x y stance z")
+Orientation = namedtuple("Orientation", "yaw pitch")
+Grounded = namedtuple("Grounded", "grounded")
+PlayerPositionLook = namedtuple("PlayerPositionLook", "position orientation grounded")
+EntityVelocity = namedtuple("EntityVelocity", "eid x y z")
+DestroyEntity = namedtuple("DestroyEntity", "count eids")
+EntityRelativeMove = namedtuple("EntityRelativeMove", "eid dx dy dz")
+EntityLook = namedtuple("EntityLook", "eid yaw pitch")
+EntityLookRelativeMove = namedtuple("EntityLookRelativeMove", "eid dx dy dz yaw pitch")
+EntityTeleport = namedtuple("EntityTeleport", "eid x y z yaw pitch")
+EntityHeadLook = namedtuple("EntityHeadLook", "eid yaw")
+ChunkData = namedtuple("ChunkData", "x z continuous primary_bitmap add_bitmap size data")
+MultiBlockChange = namedtuple("MultiBlockChange", "x z count datasize blocks")
+BlockRecord = namedtuple("BlockRecord", "x z y block_id meta")
+BlockChange = namedtuple("BlockChange", "x y z type meta")
+MapChunkBulk = namedtuple("MapChunkBulk", "count size light_data data meta")
+ChunkMeta = namedtuple("ChunkMeta", "x z primary_bitmap add_bitmap")
+NamedSoundEffect = namedtuple("NamedSoundEffect", "sound_name x y z volume pitch")
+
+
+keep_alive = Struct(">i")
+time_update = Struct(">qq")
+position_look = Struct(">ddddffB")
+entity_velocity = Struct(">Ihhh")
+entity_count = Struct(">b")
+entity_relative_move = Struct(">Ibbb")
+entity_look = Struct(">IBB")
+entity_look_relative_move = Struct(">IbbbBB")
+entity_teleport = Struct(">IiiiBB")
+entity_head_look = Struct(">IB")
+chunk_data = Struct(">ii?HHi")
+multi_block_change = Struct(">iiHi")
+block_change = Struct(">iBiHB")
+map_chunk_bulk = Struct(">hi?")
+chunk_meta = Struct(">iihh")
+string_length = Struct(">H")
+named_sound = Struct(">iIifB")
+
+
+def _bool(value):
+    return value != 0
+
+
+def decode_keep_alive(body):
+    return KeepAlive(*keep_alive.unpack(body))
+
+
+def decode_time_update(body):
+    return TimeUpdate(*time_update.unpack(body))
+
+
+def decode_position_look(body):
+    x, y, stance, z, yaw, pitch, grounded = position_look.unpack(body)
+    return PlayerPositionLook(Position(x, y, stance, z), Orientation(yaw, pitch), Grounded(grounded))
+
+
+def decode_entity_velocity(body):
+    return EntityVelocity(*entity_velocity.unpack(body))
+
+
+def decode_destroy_entity(body):
+    count = entity_count.unpack_from(body)[0]
+    # construct reads no eids for a negative count
+    return DestroyEntity(count, list(Struct(">%dI" % max(0, count)).unpack_from(body, 1)))
+
+
+def decode_entity_relative_move(body):
+    return EntityRelativeMove(*entity_relative_move.unpack(body))
+
+
+def decode_entity_look(body):
+    return EntityLook(*entity_look.unpack(body))
+
+
+def decode_entity_look_relative_move(body):
+    return EntityLookRelativeMove(*entity_look_relative_move.unpack(body))
+
+
+def decode_entity_teleport(body):
+    return EntityTeleport(*entity_teleport.unpack(body))
+
+
+def decode_entity_head_look(body):
+    return EntityHeadLook(*entity_head_look.unpack(body))
+
+
+def decode_chunk_data(body):
+    x, z, continuous, primary_bitmap, add_bitmap, size = chunk_data.unpack_from(body)
+    start = chunk_data.size
+    return ChunkData(x, z, continuous, primary_bitmap, add_bitmap, size, _field(body, start, size))
+
+
+def decode_multi_block_change(body):
+    x, z, count, datasize = multi_block_change.unpack_from(body)
+    blocks = []
+    for v in Struct(">%dI" % count).unpack_from(body, multi_block_change.size):
+        blocks.append(BlockRecord(v >> 28, (v >> 24) & 15, (v >> 16) & 255, (v >> 4) & 4095, v & 15))
+    return MultiBlockChange(x, z, count, datasize, blocks)
+
+
+def decode_block_change(body):
+    return BlockChange(*block_change.unpack(body))
+
+
+def decode_map_chunk_bulk(body):
+    count, size, light_data = map_chunk_bulk.unpack_from(body)
+    start = map_chunk_bulk.size
+    data = _field(body, start, size)
+    offset = start + size
+    meta = []
+    for _ in xrange(count):
+        meta.append(ChunkMeta(*chunk_meta.unpack_from(body, offset)))
+        offset += chunk_meta.size
+    return MapChunkBulk(count, size, light_data, data, meta)
+
+
+def decode_named_sound(body):
+    length = string_length.unpack_from(body)[0] * 2
+    start = string_length.size
+    sound_name = utf_16_be_decode(body[start:start + length])[0]
+    return NamedSoundEffect(sound_name, *named_sound.unpack_from(body, start + length))
+
+
+@_accepts_records
+def encode_keep_alive(p):
+    return keep_alive.pack(p["pid"])
+
+
+@_accepts_records
+def encode_time_update(p):
+    return time_update.pack(p["timestamp"], p["daytime"])
+
+
+@_accepts_records
+def encode_position_look(p):
+    position = p["position"]
+    orientation = p["orientation"]
+    return position_look.pack(position["x"], position["y"], position["stance"], position["z"],
+                              orientation["yaw"], orientation["pitch"], p["grounded"]["grounded"])
+
+
+@_accepts_records
+def encode_entity_velocity(p):
+    return entity_velocity.pack(p["eid"], p["x"], p["y"], p["z"])
+
+
+@_accepts_records
+def encode_destroy_entity(p):
+    return entity_count.pack(p["count"]) + Struct(">%dI" % p["count"]).pack(*p["eids"])
+
+
+@_accepts_records
+def encode_entity_relative_move(p):
+    return entity_relative_move.pack(p["eid"], p["dx"], p["dy"], p["dz"])
+
+
+@_accepts_records
+def encode_entity_look(p):
+    return entity_look.pack(p["eid"], p["yaw"], p["pitch"])
+
+
+@_accepts_records
+def encode_entity_look_relative_move(p):
+    return entity_look_relative_move.pack(p["eid"], p["dx"], p["dy"], p["dz"], p["yaw"], p["pitch"])
+
+
+@_accepts_records
+def encode_entity_teleport(p):
+    return entity_teleport.pack(p["eid"], p["x"], p["y"], p["z"], p["yaw"], p["pitch"])
+
+
+@_accepts_records
+def encode_entity_head_look(p):
+    return entity_head_look.pack(p["eid"], p["yaw"])
+
+
+@_accepts_records
+def encode_chunk_data(p):
+    return chunk_data.pack(p["x"], p["z"], _bool(p["continuous"]), p["primary_bitmap"],
+                           p["add_bitmap"], p["size"]) + p["data"]
+
+
+@_accepts_records
+def encode_multi_block_change(p):
+    records = [(b["x"] << 28) | (b["z"] << 24) | (b["y"] << 16) | (b["block_id"] << 4) | b["meta"] for b in p["blocks"]]
+    return multi_block_change.pack(p["x"], p["z"], p["count"], p["datasize"]) + \
+        Struct(">%dI" % p["count"]).pack(*records)
+
+
+@_accepts_records
+def encode_block_change(p):
+    return block_change.pack(p["x"], p["y"], p["z"], p["type"], p["meta"])
+
+
+@_accepts_records
+def encode_map_chunk_bulk(p):
+    if len(p["meta"]) != p["count"]:
+        raise error("%d chunk metas for a count of %d" % (len(p["meta"]), p["count"]))
+    out = [map_chunk_bulk.pack(p["count"], p["size"], _bool(p["light_data"])), p["data"]]
+    for m in p["meta"]:
+        out.append(chunk_meta.pack(m["x"], m["z"], m["primary_bitmap"], m["add_bitmap"]))
+    return "".join(out)
+
+
+@_accepts_records
+def encode_named_sound(p):
+    sound_name = utf_16_be_encode(p["sound_name"])[0]
+    return string_length.pack(len(sound_name) / 2) + sound_name + \
+        named_sound.pack(p["x"], p["y"], p["z"], p["volume"], p["pitch"])
+
+
+decoders = {
+    0: decode_keep_alive,
+    4: decode_time_update,
+    13: decode_position_look,
+    28: decode_entity_velocity,
+    29: decode_destroy_entity,
+    31: decode_entity_relative_move,
+    32: decode_entity_look,
+    33: decode_entity_look_relative_move,
+    34: decode_entity_teleport,
+    35: decode_entity_head_look,
+    51: decode_chunk_data,
+    52: decode_multi_block_change,
+    53: decode_block_change,
+    56: decode_map_chunk_bulk,
+    62: decode_named_sound,
+}
+
+encoders = {
+    0: encode_keep_alive,
+    4: encode_time_update,
+    13: encode_position_look,
+    28: encode_entity_velocity,
+    29: encode_destroy_entity,
+    31: encode_entity_relative_move,
+    32: encode_entity_look,
+    33: encode_entity_look_relative_move,
+    34: encode_entity_teleport,
+    35: encode_entity_head_look,
+    51: encode_chunk_data,
+    52: encode_multi_block_change,
+    53: encode_block_change,
+    56: encode_map_chunk_bulk,
+    62: encode_named_sound,
+}
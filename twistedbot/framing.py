@@ -0,0 +1,355 @@
+"""
+Incremental framing of the packet stream.
+
+Received bytes are appended to a growable buffer with a read cursor.
+For every packet id there is a skipper, compiled once from the construct
+definition in packets.py, that only works out where the packet ends. It
+reads just the length and count fields it needs and raises NeedMoreData
+when the packet is not complete yet, so a packet is parsed only once, after
+all of its bytes arrived. Bodies can be left undecoded until a handler
+actually looks at them.
+"""
+
+from StringIO import StringIO
+
+from construct import Construct, Struct, MetaArray, RepeatUntil
+from construct import MetaField, StaticField, FormatField, Switch, Value
+from construct import Peek, Buffered, Reconfig, Subconstruct, Adapter
+from construct import ConstructError
+
+from packets import packets, decode_packet
+
+
+class NeedMoreData(Exception):
+    def __init__(self, missing=1):
+        self.missing = missing
+
+
+class UnknownPacket(Exception):
+    def __init__(self, pid):
+        self.pid = pid
+
+    def __str__(self):
+        return "unknown packet id %d" % self.pid
+
+
+class _Context(dict):
+    """ lightweight stand-in for construct Container used by length lambdas """
+    __slots__ = []
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _need(buf, end):
+    if end > len(buf):
+        raise NeedMoreData(end - len(buf))
+
+
+def _static_size(con):
+    if con._is_flag(Construct.FLAG_DYNAMIC):
+        return None
+    try:
+        return con.sizeof()
+    except ConstructError:
+        return None
+
+
+def compile_skipper(con, embedded=False):
+    """
+    Returns function skip(buf, pos, ctx) that returns the position after
+    the construct, filling ctx with the values the later fields depend on.
+    """
+    if isinstance(con, FormatField):
+        return _skip_format(con)
+    elif isinstance(con, StaticField):
+        return _skip_static(con.length)
+    elif isinstance(con, MetaField):
+        return _skip_meta(con)
+    elif isinstance(con, Struct):  # Sequence too
+        return _skip_struct(con, embedded)
+    elif isinstance(con, MetaArray):
+        return _skip_array(con)
+    elif isinstance(con, RepeatUntil):
+        return _skip_repeat(con)
+    elif isinstance(con, Switch):
+        return _skip_switch(con, embedded)
+    elif isinstance(con, Value):
+        return _skip_value(con)
+    elif isinstance(con, Peek):
+        return _skip_peek(con)
+    elif isinstance(con, Buffered):
+        return _skip_buffered(con)
+    elif isinstance(con, Reconfig):
+        return compile_skipper(con.subcon, embedded=con._is_flag(Construct.FLAG_EMBED))
+    elif isinstance(con, Adapter) or type(con) is Subconstruct:
+        return compile_skipper(con.subcon, embedded=embedded)
+    return _skip_fallback(con)
+
+
+def _skip_format(con):
+    name = con.name
+    size = con.length
+    unpack_from = con.packer.unpack_from
+
+    def skip(buf, pos, ctx):
+        end = pos + size
+        _need(buf, end)
+        ctx[name] = unpack_from(buf, pos)[0]
+        return end
+    return skip
+
+
+def _skip_static(size):
+    def skip(buf, pos, ctx):
+        end = pos + size
+        _need(buf, end)
+        return end
+    return skip
+
+
+def _skip_meta(con):
+    lengthfunc = con.lengthfunc
+
+    def skip(buf, pos, ctx):
+        end = pos + lengthfunc(ctx)
+        _need(buf, end)
+        return end
+    return skip
+
+
+def _skip_struct(con, embedded):
+    size = _static_size(con)
+    if size is not None and not embedded:
+        return _skip_static(size)
+    nested = con.nested and not embedded
+    name = con.name
+    subs = [compile_skipper(sc) for sc in con.subcons]
+
+    def skip(buf, pos, ctx):
+        if nested:
+            sub_ctx = _Context(_=ctx)
+            ctx[name] = sub_ctx
+        else:
+            sub_ctx = ctx
+        for sub in subs:
+            pos = sub(buf, pos, sub_ctx)
+        return pos
+    return skip
+
+
+def _skip_array(con):
+    countfunc = con.countfunc
+    size = _static_size(con.subcon)
+    if size is not None:
+        def skip(buf, pos, ctx):
+            end = pos + size * countfunc(ctx)
+            _need(buf, end)
+            return end
+        return skip
+    sub = compile_skipper(con.subcon)
+
+    def skip(buf, pos, ctx):
+        for _ in xrange(countfunc(ctx)):
+            pos = sub(buf, pos, ctx)
+        return pos
+    return skip
+
+
+def _skip_repeat(con):
+    predicate = con.predicate
+    name = con.subcon.name
+    sub = compile_skipper(con.subcon)
+
+    def skip(buf, pos, ctx):
+        while True:
+            pos = sub(buf, pos, ctx)
+            if predicate(ctx.get(name), ctx):
+                return pos
+    return skip
+
+
+def _skip_switch(con, embedded):
+    keyfunc = con.keyfunc
+    cases = dict((k, compile_skipper(v, embedded=embedded)) for k, v in con.cases.iteritems())
+    if con.default is Switch.NoDefault:
+        default = None
+    else:
+        default = compile_skipper(con.default, embedded=embedded)
+
+    def skip(buf, pos, ctx):
+        sub = cases.get(keyfunc(ctx), default)
+        if sub is None:
+            raise ConstructError("no switch case for %r" % keyfunc(ctx))
+        return sub(buf, pos, ctx)
+    return skip
+
+
+def _skip_value(con):
+    name = con.name
+    func = con.func
+
+    def skip(buf, pos, ctx):
+        ctx[name] = func(ctx)
+        return pos
+    return skip
+
+
+def _skip_peek(con):
+    name = con.name
+    sub = compile_skipper(con.subcon)
+
+    def skip(buf, pos, ctx):
+        try:
+            sub(buf, pos, ctx)
+        except NeedMoreData:
+            ctx[name] = None
+        return pos
+    return skip
+
+
+def _skip_buffered(con):
+    """ bit structs, values are decoded because switches may key on them """
+    size = _static_size(con)
+    if size is None:
+        return _skip_fallback(con)
+    name = con.name
+
+    def skip(buf, pos, ctx):
+        end = pos + size
+        _need(buf, end)
+        ctx[name] = con._parse(StringIO(str(buf[pos:end])), ctx)
+        return end
+    return skip
+
+
+def _skip_fallback(con):
+    """ anything unusual is measured by parsing it with construct """
+    name = con.name
+
+    def skip(buf, pos, ctx):
+        stream = StringIO(str(buf[pos:]))
+        try:
+            ctx[name] = con._parse(stream, ctx)
+        except ConstructError:
+            raise NeedMoreData()
+        return pos + stream.tell()
+    return skip
+
+
+skippers = dict((pid, compile_skipper(con)) for pid, con in packets.iteritems())
+
+
+class LazyPayload(object):
+    """
+    Packet body that is decoded on the first attribute access. Handlers
+    that ignore the packet never pay for the decoding.
+    """
+    __slots__ = ["_pid", "_body", "_payload"]
+
+    def __init__(self, pid, body):
+        self._pid = pid
+        self._body = body
+        self._payload = None
+
+    def decode(self):
+        if self._payload is None:
+            self._payload = decode_packet(self._pid, self._body)
+            self._body = None
+        return self._payload
+
+    def __getattr__(self, name):
+        return getattr(self.decode(), name)
+
+    def __getitem__(self, name):
+        return self.decode()[name]
+
+    def __repr__(self):
+        return "<LazyPayload %d %r>" % (self._pid, self._payload)
+
+
+def decoded(payload):
+    """ decoded payload from payload possibly wrapped in LazyPayload """
+    if isinstance(payload, LazyPayload):
+        return payload.decode()
+    return payload
+
+
+class PacketBuffer(object):
+    """
+    Receive buffer cutting the stream into (packet id, packet body) frames.
+    In lazy mode read_packets does not decode the bodies and returns them
+    wrapped in LazyPayload.
+    """
+
+    def __init__(self, lazy=False):
+        self.buf = bytearray()
+        self.cursor = 0
+        self.wanted = 1
+        self.lazy = lazy
+
+    def __len__(self):
+        return len(self.buf) - self.cursor
+
+    @property
+    def leftover(self):
+        return str(self.buf[self.cursor:])
+
+    def append(self, bytestream):
+        self.buf.extend(bytestream)
+
+    def next_frame(self):
+        """
+        Returns bounds of next complete frame as tuple (packet id, start, end)
+        or None if the buffer does not hold complete packet. Packet body is
+        buf[start + 1:end].
+        """
+        buf = self.buf
+        if len(buf) < self.wanted:
+            return None
+        start = self.cursor
+        pid = buf[start]
+        skip = skippers.get(pid, None)
+        if skip is None:
+            raise UnknownPacket(pid)
+        try:
+            end = skip(buf, start + 1, _Context())
+        except NeedMoreData as e:
+            self.wanted = len(buf) + e.missing
+            return None
+        self.cursor = end
+        self.wanted = end + 1
+        return pid, start, end
+
+    def frames(self):
+        """
+        List of all complete frames in the buffer as (packet id, packet body).
+        Bodies are read only buffer objects sharing one copy of the frames.
+        """
+        bounds = []
+        try:
+            while True:
+                frame = self.next_frame()
+                if frame is None:
+                    break
+                bounds.append(frame)
+        finally:
+            first = bounds[0][1] if bounds else self.cursor
+            chunk = str(self.buf[first:self.cursor])
+            self.compact()
+        return [(pid, buffer(chunk, start + 1 - first, end - start - 1)) for pid, start, end in bounds]
+
+    def compact(self):
+        if self.cursor > 0:
+            del self.buf[:self.cursor]
+            self.wanted -= self.cursor
+            self.cursor = 0
+
+    def read_packets(self):
+        """ list of all complete packets as (packet id, payload) tuples """
+        if self.lazy:
+            return [(pid, LazyPayload(pid, body)) for pid, body in self.frames()]
+        return [(pid, decode_packet(pid, body)) for pid, body in self.frames()]
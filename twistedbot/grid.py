@@ -1,15 +1,22 @@
 
-import StringIO
 import array
 import math
 import sys
+import zlib
+from collections import defaultdict, deque, namedtuple
+
+from twisted.internet import threads
 
 import utils
 import blocks
 import config
 import logbot
 import fops
+import walkability
 from axisbox import AABB
+from gridspace import GridSpace
+from pathfinding import SectionGraph
+from sectionstore import section_hash
 
 
 log = logbot.getlogger("GRID")
@@ -27,6 +34,9 @@ class Chunk(object):
         self.grid_z = self.z << 4
         self.block_types = [None for _ in xrange(self.levels)]
         self.meta = [None for _ in xrange(self.levels)]
+        self.section_keys = [None for _ in xrange(self.levels)]  # None for sections not in the store
+        self.walk_states = [None for _ in xrange(self.levels)]  # computed on first use
+        self.block_masks = [None for _ in xrange(self.levels)]  # bit of every block id in the section, computed on first use
         self.block_light = []  # ignore block light
         self.sky_light = []  # ifnore sky light
         self.biome = self.biomes[:]
@@ -50,12 +60,83 @@ class Chunk(object):
         return "%s %s %s" % (str(self.coords), self.complete, [i if i is None else 1 for i in self.block_types])
 
 
+ChunkColumn = namedtuple("ChunkColumn", "x z continuous primary_bit block_types meta hashes biome")
+
+
+def read_column(data, offset, x, z, continuous, primary_bit, add_bit, light_data=True):
+    """
+    Cuts one chunk column out of decompressed chunk data starting at offset,
+    returns the offset after the column and ChunkColumn. Sections are hashed
+    here for the section store.
+    """
+    levels = [i for i in xrange(Chunk.levels) if primary_bit & (1 << i)]
+    block_types = [None for _ in xrange(Chunk.levels)]
+    meta = [None for _ in xrange(Chunk.levels)]
+    hashes = [None for _ in xrange(Chunk.levels)]
+    for i in levels:
+        block_types[i] = array.array('B', data[offset:offset + 4096])  # y, z, x
+        offset += 4096
+    for i in levels:
+        meta[i] = array.array('B', data[offset:offset + 2048])
+        offset += 2048
+    for i in levels:
+        hashes[i] = section_hash(block_types[i], meta[i])
+    if light_data:
+        # ignore block light and sky light
+        offset += 2 * 2048 * len(levels)
+    # higher block id value will be used after Mojang adds them
+    offset += 2048 * len([i for i in xrange(Chunk.levels) if add_bit >> i & 1])
+    biome = None
+    if continuous:
+        biome = array.array('b', data[offset:offset + 256])
+        offset += 256
+    return offset, ChunkColumn(x, z, continuous, primary_bit, block_types, meta, hashes, biome)
+
+
+def decode_columns(zlib_data, columns, light_data=True):
+    """
+    Decompresses chunk data and cuts it into section arrays. Does not touch
+    the grid, runs in a worker thread. Columns are tuples
+    (x, z, continuous, primary_bit, add_bit) in order of the data.
+    """
+    data = zlib.decompress(zlib_data)
+    offset = 0
+    out = []
+    for x, z, continuous, primary_bit, add_bit in columns:
+        offset, column = read_column(data, offset, x, z, continuous, primary_bit, add_bit, light_data)
+        out.append(column)
+    return out
+
+
+class GridUpdate(object):
+    """
+    Change of the grid waiting in the queue, applied in order of arrival.
+    Chunk loads are ready once their data is decoded.
+    """
+
+    def __init__(self, coords, apply=None):
+        self.coords = coords
+        self.apply = apply
+
+    @property
+    def ready(self):
+        return self.apply is not None
+
+
 class Grid(object):
     def __init__(self, dimension):
         self.dimension = dimension
+        self.store = dimension.world.section_store
         self.chunks = {}
         self.chunks_loaded = 0
         self.spawn_position = None
+        self.updates = deque()
+        self.updating = defaultdict(int)
+        self.grid_space = GridSpace(self, limit=dimension.world.config.GRIDSPACE_CACHE_LIMIT)
+        self.section_graph = SectionGraph(self.grid_space)
+        # counts the changes of the grid, a section keeps the count of its last change
+        self.changes = 0
+        self.section_versions = {}
 
     def in_spawn_area(self, coords):
         return abs(coords[0] - self.spawn_position[0]) <= 16 or abs(coords[2] - self.spawn_position[2]) <= 16
@@ -70,22 +151,140 @@ class Grid(object):
         return self.get_block(crds.x, crds.y, crds.z)
 
     def get_block(self, x, y, z):
+        block_type, meta = self.get_block_type(x, y, z)
+        return self.make_block(x, y, z, block_type, meta)
+
+    def get_block_kind(self, x, y, z):
+        """
+        Shared block without coordinates, see blocks.block_kind. Does not
+        allocate, use it when only the type properties are needed.
+        """
+        return blocks.block_kinds[self.get_block_index(x, y, z)]
+
+    def get_block_flags(self, x, y, z):
+        """ block properties as blocks.block_flags bits """
+        return blocks.block_flags[self.get_block_index(x, y, z)]
+
+    def get_block_index(self, x, y, z):
+        """ block type << 4 | meta, index into blocks.block_kinds and blocks.block_flags """
         if y > 255 or y < 0:
-            return self.make_block(x, y, z, 0, 0)
-        chunk_x = x >> 4
-        chunk_z = z >> 4
-        chunk = self.get_chunk((chunk_x, chunk_z))
+            return 0
+        chunk = self.chunks.get((x >> 4, z >> 4), None)
         if chunk is None:
-            return self.make_block(x, y, z, 0, 0)
+            return 0
         y_level = y >> 4
         block_types = chunk.block_types[y_level]
         if block_types is None:
-            return self.make_block(x, y, z, 0, 0)
-        cx = x & 15
-        cy = y & 15
-        cz = z & 15
-        pos = self.chunk_array_position(cx, cy, cz)
-        return self.make_block(x, y, z, block_types[pos], chunk.get_meta(y_level, pos))
+            return 0
+        pos = (y & 15) * 256 + (z & 15) * 16 + (x & 15)
+        meta = chunk.meta[y_level][pos >> 1]
+        return block_types[pos] << 4 | (meta >> 4 if pos & 1 else meta & 15)
+
+    def get_block_type(self, x, y, z):
+        """ block type and meta at x, y, z """
+        if y > 255 or y < 0:
+            return 0, 0
+        chunk = self.chunks.get((x >> 4, z >> 4), None)
+        if chunk is None:
+            return 0, 0
+        y_level = y >> 4
+        block_types = chunk.block_types[y_level]
+        if block_types is None:
+            return 0, 0
+        pos = (y & 15) * 256 + (z & 15) * 16 + (x & 15)
+        return block_types[pos], chunk.get_meta(y_level, pos)
+
+    def walk_state(self, x, y, z):
+        """ walkability state bits of the cell """
+        if 0 <= y < 256:
+            chunk = self.chunks.get((x >> 4, z >> 4), None)
+            if chunk is not None:
+                level = y >> 4
+                states = chunk.walk_states[level]
+                if states is None:
+                    states = chunk.walk_states[level] = self._section_walk_states(chunk, level)
+                return states[(y & 15) * 256 + (z & 15) * 16 + (x & 15)]
+        return self.cell_walk_state(x, y, z)
+
+    def section_walk_states(self, chunk, level):
+        """ walkability states of a whole section, computed on first use """
+        states = chunk.walk_states[level]
+        if states is None:
+            states = chunk.walk_states[level] = self._section_walk_states(chunk, level)
+        return states
+
+    def cell_walk_state(self, x, y, z):
+        flags = self.get_block_flags(x, y, z)
+        climbable = flags & blocks.CLIMBABLE != 0
+        if flags & blocks.VINE:
+            climbable = self.get_block(x, y, z).is_climbable
+        return walkability.cell_state(self.get_block_flags(x, y - 1, z), flags, self.get_block_flags(x, y + 1, z), climbable)
+
+    def _section_ids(self, chunk, level):
+        if 0 <= level < chunk.levels and chunk.block_types[level] is not None:
+            return chunk.block_types[level].tostring(), chunk.meta[level]
+        return None, None
+
+    def _section_walk_states(self, chunk, level):
+        ids, meta = self._section_ids(chunk, level)
+        ids_below, meta_below = self._section_ids(chunk, level - 1)
+        ids_above, meta_above = self._section_ids(chunk, level + 1)
+        states = walkability.section_states(
+            walkability.flags_of(ids_below, meta_below, walkability.SECTION - walkability.LAYER, walkability.SECTION),
+            walkability.flags_of(ids, meta, 0, walkability.SECTION),
+            walkability.flags_of(ids_above, meta_above, 0, walkability.LAYER))
+        if ids is not None:
+            pos = ids.find(walkability.VINE)
+            while pos >= 0:
+                x = chunk.grid_x + (pos & 15)
+                y = (level << 4) + (pos >> 8)
+                z = chunk.grid_z + ((pos >> 4) & 15)
+                states[pos] = self.cell_walk_state(x, y, z)
+                pos = ids.find(walkability.VINE, pos + 1)
+        return states
+
+    def _invalidate_walk_states(self, chunk_x, chunk_z, levels):
+        """
+        Drops the states of the changed levels and of the levels next to
+        them, and of the neighbouring chunks' sections with vines, whose
+        climbability depends on the blocks beside.
+        """
+        chunk = self.chunks.get((chunk_x, chunk_z), None)
+        if chunk is not None:
+            for level in levels:
+                for i in (level - 1, level, level + 1):
+                    if 0 <= i < chunk.levels:
+                        chunk.walk_states[i] = None
+        for i, j in utils.cross:
+            chunk = self.chunks.get((chunk_x + i, chunk_z + j), None)
+            if chunk is None:
+                continue
+            for level in levels:
+                block_types = chunk.block_types[level]
+                if block_types is not None and blocks.Vines.number in block_types:
+                    chunk.walk_states[level] = None
+
+    def _update_walk_states(self, x, y, z):
+        """ after a block change at x, y, z """
+        cells = ((x, y - 1, z), (x, y, z), (x, y + 1, z), (x - 1, y, z), (x + 1, y, z), (x, y, z - 1), (x, y, z + 1))
+        self.grid_space.invalidate_cells(cells)
+        self.section_graph.invalidate_cells(cells)
+        self._sections_changed(set((cx >> 4, cy >> 4, cz >> 4) for cx, cy, cz in cells
+                                   if 0 <= cy <= 255 and (cx >> 4, cz >> 4) in self.chunks))
+        for cx, cy, cz in cells:
+            if cy < 0 or cy > 255:
+                continue
+            chunk = self.chunks.get((cx >> 4, cz >> 4), None)
+            if chunk is None:
+                continue
+            states = chunk.walk_states[cy >> 4]
+            if states is not None:
+                states[(cy & 15) * 256 + (cz & 15) * 16 + (cx & 15)] = self.cell_walk_state(cx, cy, cz)
+
+    def _sections_changed(self, sections):
+        self.changes += 1
+        for section in sections:
+            self.section_versions[section] = self.changes
 
     def chunk_updated(self, chunk_x, chunk_z):
         pass
@@ -96,60 +295,115 @@ class Grid(object):
         self.chunks[crd] = chunk
         return chunk
 
-    def _load_chunk(self, x, z, continuous, primary_bit, add_bit, data, light_data=True):
-        if primary_bit == 0:
-            try:
-                del self.chunks[(x, z)]
+    def _commit_column(self, column):
+        x, z = column.x, column.z
+        if column.primary_bit == 0:
+            chunk = self.chunks.pop((x, z), None)
+            if chunk is not None:
+                self._release_sections(chunk)
+                self._invalidate_walk_states(x, z, range(chunk.levels))
                 return
-            except KeyError:
-                pass
         self.chunks_loaded += 1
         chunk = self.get_chunk((x, z))
         if chunk is None:
             chunk = self.new_chunk(x, z)
-        if continuous:
-            chunk.complete = True
-        else:
+        if not column.continuous:
             log.msg("WARNING: received noncontinuous chunk, current complete state is %s" % chunk.complete)
         for i in xrange(chunk.levels):
-            if primary_bit & (1 << i):
-                data_str = data.read(4096)
-                ndata = array.array('B', data_str)  # y, z, x
-                chunk.block_types[i] = ndata
-        for i in xrange(chunk.levels):
-            if primary_bit & (1 << i):
-                data_str = data.read(2048)
-                ndata = array.array('B', data_str)
-                chunk.meta[i] = ndata
-        if light_data:
-            for i in xrange(chunk.levels):
-                if primary_bit & (1 << i):
-                    data_str = data.read(2048)
-                    #ndata = array.array('B', data_str)
-            for i in xrange(chunk.levels):
-                if primary_bit & (1 << i):
-                    data_str = data.read(2048)
-                    #ndata = array.array('B', data_str)
-        # higher block id value will be used after Mojang adds them
-        if add_bit > 0:
-            for i in xrange(chunk.levels):
-                if add_bit >> i & 1:
-                    data_str = data.read(2048)
-                    ndata = array.array('B', data_str)
-        if continuous:
-            data_str = data.read(256)
-            chunk.biome = array.array('b', data_str)
-
-    def load_chunk(self, x, z, continuous, primary_bit, add_bit, data_array):
-        self._load_chunk(x, z, continuous, primary_bit, add_bit, StringIO.StringIO(data_array))
-        self.chunk_updated(x, z)
-
-    def load_bulk_chunk(self, metas, data_array, light_data):
-        data = StringIO.StringIO(data_array)
-        for meta in metas:
-            self._load_chunk(meta.x, meta.z, True, meta.primary_bitmap, meta.add_bitmap, data, light_data=light_data)
-        for meta in metas:
-            self.chunk_updated(meta.x, meta.z)
+            if column.block_types[i] is not None:
+                if chunk.section_keys[i] is not None:
+                    self.store.release(chunk.section_keys[i])
+                key = (self.dimension.number, x, z, i, column.hashes[i])
+                chunk.block_types[i], chunk.meta[i] = self.store.acquire(key, column.block_types[i], column.meta[i])
+                chunk.section_keys[i] = key
+                chunk.block_masks[i] = None
+        self._invalidate_walk_states(x, z, [i for i in xrange(chunk.levels) if column.block_types[i] is not None])
+        if column.biome is not None:
+            chunk.biome = column.biome
+        if column.continuous:
+            chunk.complete = True
+
+    def _release_sections(self, chunk):
+        for i, key in enumerate(chunk.section_keys):
+            if key is not None:
+                self.store.release(key)
+                chunk.section_keys[i] = None
+
+    def _own_section(self, chunk, level):
+        """ copy on write of a section shared through the store """
+        key = chunk.section_keys[level]
+        if key is None:
+            return
+        chunk.section_keys[level] = None
+        if not self.store.detach(key):
+            chunk.block_types[level] = array.array('B', chunk.block_types[level])
+            chunk.meta[level] = array.array('B', chunk.meta[level])
+
+    def _commit_columns(self, columns):
+        for column in columns:
+            self._commit_column(column)
+        changed = set()
+        for column in columns:
+            changed.add((column.x, column.z))
+            for i, j in utils.cross:
+                changed.add((column.x + i, column.z + j))  # vines next to the column
+        self.grid_space.invalidate_chunks(changed)
+        self.section_graph.invalidate_chunks(changed)
+        self._sections_changed((chunk_x, level, chunk_z) for chunk_x, chunk_z in changed for level in xrange(16))
+        for chunk_x, chunk_z in changed:
+            if (chunk_x, chunk_z) not in self.chunks:
+                for level in xrange(16):
+                    self.section_versions.pop((chunk_x, level, chunk_z), None)
+        for column in columns:
+            self.chunk_updated(column.x, column.z)
+
+    def _queue_update(self, update):
+        self.updates.append(update)
+        for crd in update.coords:
+            self.updating[crd] += 1
+
+    def _apply_in_order(self, coords, fn, *args):
+        """ changes of chunks that wait for their data are queued behind it """
+        if any(crd in self.updating for crd in coords):
+            self._queue_update(GridUpdate(coords, lambda: fn(*args)))
+        else:
+            fn(*args)
+
+    def _schedule_load(self, zlib_data, columns, light_data=True):
+        update = GridUpdate([(col[0], col[1]) for col in columns])
+        self._queue_update(update)
+        d = threads.deferToThread(decode_columns, zlib_data, columns, light_data)
+        d.addCallback(self._columns_decoded, update)
+        d.addErrback(self._columns_failed, update)
+
+    def _columns_decoded(self, columns, update):
+        update.apply = lambda: self._commit_columns(columns)
+
+    def _columns_failed(self, failure, update):
+        log.err(failure, "cannot decode chunks %s" % update.coords)
+        update.apply = lambda: None
+
+    def commit_updates(self, limit=config.CHUNK_COMMIT_LIMIT):
+        """
+        Called every tick, applies decoded chunks and the changes queued
+        behind them, about limit chunk columns at a time.
+        """
+        committed = 0
+        while self.updates and self.updates[0].ready and committed < limit:
+            update = self.updates.popleft()
+            for crd in update.coords:
+                self.updating[crd] -= 1
+                if self.updating[crd] == 0:
+                    del self.updating[crd]
+            update.apply()
+            committed += len(update.coords)
+
+    def load_chunk(self, x, z, continuous, primary_bit, add_bit, zlib_data):
+        self._schedule_load(zlib_data, [(x, z, continuous, primary_bit, add_bit)])
+
+    def load_bulk_chunk(self, metas, zlib_data, light_data):
+        columns = [(meta.x, meta.z, True, meta.primary_bitmap, meta.add_bitmap) for meta in metas]
+        self._schedule_load(zlib_data, columns, light_data=light_data)
 
     def chunk_array_position(self, x, y, z):
         """ compute index from 3D to 1D """
@@ -173,21 +427,33 @@ class Grid(object):
         cy = y & 15
         cz = z & 15
         pos = self.chunk_array_position(cx, cy, cz)
+        self._own_section(chunk, y_level)
         chunk.block_types[y_level][pos] = block_type
         chunk.set_meta(y_level, pos, meta)
+        if chunk.block_masks[y_level] is not None:
+            # the bit of the replaced id stays, the mask may only say too much
+            chunk.block_masks[y_level] |= 1 << block_type
+        self._update_walk_states(x, y, z)
         new_block = self.make_block(x, y, z, block_type, meta)
         return current_block, new_block
 
     def block_change(self, x, y, z, btype, bmeta):
-        _, _ = self.change_block_to(x, y, z, btype, bmeta)
+        self._apply_in_order([(x >> 4, z >> 4)], self.change_block_to, x, y, z, btype, bmeta)
 
     def multi_block_change(self, chunk_x, chunk_z, blocks):
+        self._apply_in_order([(chunk_x, chunk_z)], self._multi_block_change, chunk_x, chunk_z, blocks)
+
+    def _multi_block_change(self, chunk_x, chunk_z, blocks):
         shift_x = chunk_x << 4
         shift_z = chunk_z << 4
         for block in blocks:
             _, _ = self.change_block_to(block.x + shift_x, block.y, block.z + shift_z, block.block_id, block.meta)
 
     def on_explosion(self, x, y, z, records):
+        coords = list(set((int(x + rec.x) >> 4, int(z + rec.z) >> 4) for rec in records))
+        self._apply_in_order(coords, self._explosion, x, y, z, records)
+
+    def _explosion(self, x, y, z, records):
         for rec in records:
             rx = x + rec.x
             ry = y + rec.y
@@ -212,12 +478,19 @@ class Grid(object):
             if blk is not None:
                 yield blk
 
-    def is_any_liquid(self, bb):
-        for blk in self.blocks_in_aabb(bb):
-            if blk.material.is_liquid:
+    def block_kinds_in_aabb(self, bb):
+        for x, y, z in bb.grid_area:
+            yield self.get_block_kind(x, y, z)
+
+    def any_flag_in_aabb(self, bb, flag):
+        for x, y, z in bb.grid_area:
+            if blocks.block_flags[self.get_block_index(x, y, z)] & flag:
                 return True
         return False
 
+    def is_any_liquid(self, bb):
+        return self.any_flag_in_aabb(bb, blocks.LIQUID)
+
     def aabb_collides(self, bb):
         for col_bb in self.collision_aabbs_in(bb):
             if col_bb.collides(bb):
@@ -226,27 +499,26 @@ class Grid(object):
 
     def collision_aabbs_in(self, bb):
         out = []
-        for blk in self.blocks_in_aabb(bb.extend_to(0, -1, 0)):
-            blk.add_grid_bounding_boxes_to(out)
+        for x, y, z in bb.extend_to(0, -1, 0).grid_area:
+            index = self.get_block_index(x, y, z)
+            if blocks.block_flags[index] & blocks.NON_SOLID:
+                continue  # no bounding boxes
+            self.make_block(x, y, z, index >> 4, index & 15).add_grid_bounding_boxes_to(out)
         return out
 
     def avoid_aabbs_in(self, bb):
         out = []
-        for blk in self.blocks_in_aabb(bb):  # lava, fire, web
-            if blk.is_lava or blk.number == blocks.Fire.number or blk.number == blocks.Cobweb.number:
-                out.append(AABB.from_block_cube(blk.x, blk.y, blk.z))
+        for x, y, z in bb.grid_area:
+            if blocks.block_flags[self.get_block_index(x, y, z)] & blocks.AVOID:
+                out.append(AABB.from_block_cube(x, y, z))
         return out
 
     def aabb_on_ladder(self, bb):
-        blk = self.get_block(bb.gridpos_x, bb.gridpos_y, bb.gridpos_z)
-        return blk.number == blocks.Ladders.number or blk.number == blocks.Vines.number
+        return self.get_block_flags(bb.gridpos_x, bb.gridpos_y, bb.gridpos_z) & (blocks.LADDER | blocks.VINE) != 0
 
     def aabb_in_water(self, bb):
         #TODO return the bast water block instead of boolean
-        for blk in self.blocks_in_aabb(bb.expand(-0.001, -0.4010000059604645, -0.001)):
-            if blk.is_water:
-                return True
-        return False
+        return self.any_flag_in_aabb(bb.expand(-0.001, -0.4010000059604645, -0.001), blocks.WATER)
 
     def standing_on_solidblock(self, bb):
         standing_on = None
@@ -293,28 +565,42 @@ class Grid(object):
             for z in xrange(min_z, max_z):
                 yield (x, z)
 
+    def section_block_mask(self, chunk, level):
+        """ bit 1 << block id is set for the ids in the section, None if the section is empty """
+        block_types = chunk.block_types[level]
+        if block_types is None:
+            return None
+        mask = chunk.block_masks[level]
+        if mask is None:
+            mask = 0
+            for block_id in set(block_types.tostring()):
+                mask |= 1 << ord(block_id)
+            chunk.block_masks[level] = mask
+        return mask
+
     def blocks_in_distance(self, coords, block_number=None, block_filter=None, distance=160):
+        """ blocks of the type in the chunks around, only sections whose mask has the type are scanned """
         center_section = (coords / 16.0).grid_shift()
+        bit = 1 << block_number
+        char = chr(block_number)
         for chunk_crd in self.grid_column_around(center_section, distance=distance / 16 + 1):
             chunk = self.get_chunk(chunk_crd)
             if chunk is None:
                 continue
-            for level, block_types in enumerate(chunk.block_types):
-                if block_types is None:
+            for level in xrange(chunk.levels):
+                mask = self.section_block_mask(chunk, level)
+                if mask is None or not mask & bit:
                     continue
-                if block_types.count(block_number) > 0:
-                    for pos, block_id in enumerate(block_types):
-                        if block_id == block_number:
-                            meta = chunk.get_meta(level, pos)
-                            if block_filter is not None and not block_filter(meta):
-                                continue
-                            cx = pos & 15
-                            cz = (pos >> 4) & 15
-                            cy = pos / 256
-                            x = cx + chunk_crd[0] * 16
-                            y = cy + level * 16
-                            z = cz + chunk_crd[1] * 16
-                            yield self.make_block(x, y, z, block_number, meta)
+                ids = chunk.block_types[level].tostring()
+                pos = ids.find(char)
+                while pos >= 0:
+                    meta = chunk.get_meta(level, pos)
+                    if block_filter is None or block_filter(meta):
+                        x = (pos & 15) + chunk_crd[0] * 16
+                        y = (pos >> 8) + level * 16
+                        z = ((pos >> 4) & 15) + chunk_crd[1] * 16
+                        yield self.make_block(x, y, z, block_number, meta)
+                    pos = ids.find(char, pos + 1)
 
     def raycast_to_block(self, position, direction, max_distance=40):
         g_position = position.grid_shift()
@@ -380,8 +666,7 @@ class Grid(object):
                 else:
                     gz = gz + stepz
                     tmaxz = tmaxz + tdz
-            blk = self.get_block(gx, gy, gz)
-            if blk.number != blocks.Air.number:
-                return blk
+            if self.get_block_kind(gx, gy, gz).number != blocks.Air.number:
+                return self.get_block(gx, gy, gz)
             if (g_position.x - gx) ** 2 + (g_position.y - gy) ** 2 + (g_position.z - gz) ** 2 > sqr_max_distance:
                 return blocks.Air(self, 0, 0, 0, 0)
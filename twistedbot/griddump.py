@@ -0,0 +1,88 @@
+"""
+Chunk dumps of a grid.
+
+A dump holds the block ids and metadata of chunk columns, enough to build
+the same terrain in another grid, for example to replay path searches
+outside of a game. The file starts with MAGIC, then for every column a
+header (chunk x, chunk z, bit mask of the sections present) followed by
+the block ids of the present sections and then their metadata, 4096 and
+2048 bytes a section.
+"""
+
+import array
+import struct
+
+import logbot
+from grid import Chunk, ChunkColumn
+from sectionstore import section_hash
+
+
+log = logbot.getlogger("GRIDDUMP")
+
+MAGIC = "TBGRID1\n"
+COLUMN_HEADER = struct.Struct("<iiH")
+
+
+def save(grid, filename, chunks=None):
+    """ writes the given chunk coordinates, all loaded chunks if None """
+    if chunks is None:
+        chunks = grid.chunks.keys()
+    count = 0
+    with open(filename, "wb") as f:
+        f.write(MAGIC)
+        for coords in sorted(chunks):
+            chunk = grid.get_chunk(coords)
+            if chunk is None:
+                continue
+            levels = [i for i in xrange(chunk.levels) if chunk.block_types[i] is not None]
+            if not levels:
+                # reads as air without it, an empty column would unload the chunk
+                continue
+            primary_bit = 0
+            for i in levels:
+                primary_bit |= 1 << i
+            f.write(COLUMN_HEADER.pack(chunk.x, chunk.z, primary_bit))
+            for i in levels:
+                f.write(chunk.block_types[i].tostring())
+            for i in levels:
+                f.write(chunk.meta[i].tostring())
+            count += 1
+    log.msg("saved %d chunks to %s" % (count, filename))
+    return count
+
+
+def read_columns(filename):
+    """ ChunkColumn of every column in the dump """
+    with open(filename, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("%s is not a grid dump" % filename)
+    offset = len(MAGIC)
+    columns = []
+    while offset < len(data):
+        x, z, primary_bit = COLUMN_HEADER.unpack_from(data, offset)
+        offset += COLUMN_HEADER.size
+        levels = [i for i in xrange(Chunk.levels) if primary_bit & (1 << i)]
+        block_types = [None for _ in xrange(Chunk.levels)]
+        meta = [None for _ in xrange(Chunk.levels)]
+        hashes = [None for _ in xrange(Chunk.levels)]
+        for i in levels:
+            block_types[i] = array.array('B', data[offset:offset + 4096])
+            offset += 4096
+        for i in levels:
+            meta[i] = array.array('B', data[offset:offset + 2048])
+            offset += 2048
+        if offset > len(data):
+            raise ValueError("%s is truncated" % filename)
+        for i in levels:
+            hashes[i] = section_hash(block_types[i], meta[i])
+        columns.append(ChunkColumn(x, z, True, primary_bit, block_types, meta, hashes, None))
+    return columns
+
+
+def load(grid, filename):
+    """ commits the columns of the dump to the grid """
+    columns = read_columns(filename)
+    grid._commit_columns(columns)
+    log.msg("loaded %d chunks from %s" % (len(columns), filename))
+    return len(columns)
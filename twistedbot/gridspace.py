@@ -1,8 +1,14 @@
 
 
+import math
+from collections import defaultdict
+
+import config
 import logbot
 import utils
 import fops
+import walkability
+from axisbox import AABB
 
 
 log = logbot.getlogger("GRIDSPACE")
@@ -15,26 +21,24 @@ class NodeState(object):
         self.y = y
         self.z = z
         self.coords = utils.Vector(self.x, self.y, self.z)
-        self.block_0 = grid.get_block(self.x, self.y - 1, self.z)
-        self.block_1 = grid.get_block(self.x, self.y, self.z)
-        self.block_2 = grid.get_block(self.x, self.y + 1, self.z)
-        self.can_be = self.block_1.can_fall_through and self.block_2.can_fall_through
-        self.can_stand = self.block_0.can_stand_on and self.can_be
-        self.can_jump = self.can_stand and self.block_1.is_free and self.block_2.is_free
-        self.can_fall = self.can_be and self.block_0.can_fall_through
-        self.can_climb = self.can_be and self.block_1.is_climbable
-        self.in_fire = self.block_1.is_burning or self.block_2.is_burning
-        self.in_water = self.block_1.is_water or self.block_2.is_water
-        self.can_hold = self.in_water or self.block_1.is_ladder or (self.block_1.is_vine and self.block_1.is_climbable)
+        state = grid.walk_state(x, y, z)
+        self.can_be = state & walkability.CAN_BE != 0
+        self.can_stand = state & walkability.CAN_STAND != 0
+        self.can_jump = state & walkability.CAN_JUMP != 0
+        self.can_fall = state & walkability.CAN_FALL != 0
+        self.can_climb = state & walkability.CAN_CLIMB != 0
+        self.in_fire = state & walkability.IN_FIRE != 0
+        self.in_water = state & walkability.IN_WATER != 0
+        self.can_hold = state & walkability.CAN_HOLD != 0
         self.platform_y = self.y
         self.center_x = self.x + 0.5
         self.center_z = self.z + 0.5
 
     def __repr__(self):
         if self.can_stand:
-            return "ON %s" % self.block_0
+            return "ON %s %s" % (self.grid.get_block_kind(self.x, self.y - 1, self.z).name, self.coords)
         else:
-            return "IN %s" % self.block_1
+            return "IN %s %s" % (self.grid.get_block_kind(self.x, self.y, self.z).name, self.coords)
 
     def vertical_center_in(self, center):
         return fops.lte(self.x, center.x) and fops.lte(center.x, (self.x + 1)) and fops.lte(self.z, center.z) and fops.lte(center.z, (self.z + 1))
@@ -50,10 +54,25 @@ class NodeState(object):
 
 
 class GridSpace(object):
+    """
+    Node states of one grid, kept for the life of the grid. The grid drops
+    the states of the cells it changes. The cache holds at most about
+    limit states in two generations: states not used since the current
+    generation filled up are dropped with the old one. Each generation
+    has an index of its cells by chunk, the keys of moved or dropped
+    states may linger in it until the generation goes.
+    """
 
-    def __init__(self, grid):
+    def __init__(self, grid, limit=config.GRIDSPACE_CACHE_LIMIT):
         self.grid = grid
+        self.limit = limit
+        self.clear()
+
+    def clear(self):
         self.cache = {}
+        self.old_cache = {}
+        self.chunk_cells = defaultdict(set)
+        self.old_chunk_cells = defaultdict(set)
 
     def get_state_coords(self, coords):
         return self._get_state(coords.tuple)
@@ -65,10 +84,30 @@ class GridSpace(object):
         try:
             return self.cache[t_coords]
         except KeyError:
-            state = NodeState(self.grid, t_coords[0], t_coords[1], t_coords[2])
+            state = self.old_cache.pop(t_coords, None)
+            if state is None:
+                state = NodeState(self.grid, t_coords[0], t_coords[1], t_coords[2])
             self.cache[t_coords] = state
+            self.chunk_cells[(t_coords[0] >> 4, t_coords[2] >> 4)].add(t_coords)
+            if len(self.cache) * 2 >= self.limit:
+                self.old_cache = self.cache
+                self.old_chunk_cells = self.chunk_cells
+                self.cache = {}
+                self.chunk_cells = defaultdict(set)
             return state
 
+    def invalidate_cells(self, cells):
+        for crd in cells:
+            self.cache.pop(crd, None)
+            self.old_cache.pop(crd, None)
+
+    def invalidate_chunks(self, chunks):
+        """ chunks is a set of chunk coordinates """
+        for cache, chunk_cells in ((self.cache, self.chunk_cells), (self.old_cache, self.old_chunk_cells)):
+            for chunk in chunks:
+                for crd in chunk_cells.pop(chunk, ()):
+                    cache.pop(crd, None)
+
     def positions_to_dig(self, coords):
         center = utils.Vector(coords.x, coords.y - 1, coords.z)
         for x in xrange(-5, 6):
@@ -224,7 +263,60 @@ class GridSpace(object):
     def can_stand(self, x, y, z):
         return self.get_state(x, y, z).can_stand
 
+    def is_plain(self, state):
+        """ standing cell with nothing to climb, swim or burn in """
+        return state.can_stand and not (state.in_water or state.in_fire or state.can_hold or state.can_climb)
+
+    def can_walk_straight(self, from_state, to_state):
+        """
+        The line between the centers of two cells of one level can be walked
+        without steps: every cell under the bot along the line is plain
+        standing ground and the bot swept along it collides with no block.
+        """
+        y = from_state.y
+        if to_state.y != y or not self.is_plain(from_state) or not self.is_plain(to_state):
+            return False
+        dx = to_state.x - from_state.x
+        dz = to_state.z - from_state.z
+        radius = config.PLAYER_RADIUS
+        # samples closer than the width of the bot, no cell under the way is skipped
+        samples = max(abs(dx), abs(dz)) * 4
+        seen = set()
+        for i in xrange(samples + 1):
+            px = from_state.center_x + dx * i / float(samples)
+            pz = from_state.center_z + dz * i / float(samples)
+            for x in xrange(int(math.floor(px - radius)), int(math.floor(px + radius)) + 1):
+                for z in xrange(int(math.floor(pz - radius)), int(math.floor(pz + radius)) + 1):
+                    if (x, z) in seen:
+                        continue
+                    seen.add((x, z))
+                    if not self.is_plain(self.get_state(x, y, z)):
+                        return False
+        bb = AABB.from_player_coords(utils.Vector(from_state.center_x, y, from_state.center_z))
+        area = bb.union(bb.offset(dx=dx, dz=dz))
+        move = [dx, 0, dz]
+        for col_bb in self.grid.collision_aabbs_in(area) + self.grid.avoid_aabbs_in(area):
+            # the ground under the way only touches the bot
+            if col_bb.max_y <= y:
+                continue
+            if bb.sweep_collision(col_bb, move)[0]:
+                return False
+        return True
+
+    def can_go_straight(self, from_state, to_state):
+        """ can_go for neighbours, can_walk_straight for cells further apart """
+        if abs(to_state.x - from_state.x) <= 1 and abs(to_state.z - from_state.z) <= 1:
+            return self.can_go(from_state, to_state)
+        return self.can_walk_straight(from_state, to_state)
+
+    def versions_between(self, from_coords, to_coords):
+        """ versions of the grid sections a move between the cells depends on """
+        versions = self.grid.section_versions
+        return [versions.get((x, y, z), 0)
+                for x in xrange((min(from_coords.x, to_coords.x) - 1) >> 4, ((max(from_coords.x, to_coords.x) + 1) >> 4) + 1)
+                for y in xrange((min(from_coords.y, to_coords.y) - 4) >> 4, ((max(from_coords.y, to_coords.y) + 2) >> 4) + 1)
+                for z in xrange((min(from_coords.z, to_coords.z) - 1) >> 4, ((max(from_coords.z, to_coords.z) + 1) >> 4) + 1)]
+
 
 def can_stand_coords(grid, coords):
-    gs = GridSpace(grid)
-    return gs.can_stand(coords.x, coords.y, coords.z)
+    return grid.grid_space.can_stand(coords.x, coords.y, coords.z)
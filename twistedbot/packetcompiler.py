@@ -0,0 +1,561 @@
+"""
+Compiler of the construct packet table into straight-line Python.
+
+Every packet definition in packets.py is walked once and turned into a
+parse function and a build function. Runs of fixed size fields are read
+and written with a single precompiled struct, lengths, counts, conditions
+and adapters call the functions from the construct definition directly.
+Constructs the compiler does not know are handed over to construct, so
+the compiled functions give the same results as the table itself.
+
+The generated source is cached in compiled_packets.py next to this file
+and generated again when packets.py or this file changes.
+"""
+
+import os
+import sys
+import imp
+import hashlib
+
+from construct import Construct, Struct, Sequence, MetaArray, RepeatUntil
+from construct import MetaField, StaticField, FormatField, Switch, Value
+from construct import Peek, Reconfig, Subconstruct
+from construct import StringAdapter, LengthValueAdapter
+
+import logbot
+
+
+log = logbot.getlogger("PACKETS")
+
+CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "compiled_packets.py")
+
+PRELUDE = '''\
+# generated by packetcompiler.py from the packet table in packets.py, do not edit
+
+from struct import Struct, error, pack, unpack_from
+from cStringIO import StringIO
+
+from construct import Container, ListContainer
+from construct import FieldError, ArrayError, SwitchError
+
+
+DIGEST = %r
+
+
+class Context(dict):
+    __slots__ = []
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __copy__(self):
+        return Context(self)
+'''
+
+
+def _is_embedded(con):
+    return con._is_flag(Construct.FLAG_EMBED)
+
+
+def _inherits(con, cls, method):
+    return getattr(type(con), method).im_func is getattr(cls, method).im_func
+
+
+def _plain_field(con):
+    return type(con) is FormatField and con.name is not None and not _is_embedded(con)
+
+
+def _flat_sequence(con):
+    return type(con) is Sequence and con.nested and not any(_is_embedded(sc) for sc in con.subcons)
+
+
+def _literal(key):
+    return type(key) in (int, long, bool, str)
+
+
+class _Writer(object):
+    """ collects indented source lines and hands out temporary names """
+
+    def __init__(self, depth):
+        self.lines = []
+        self.depth = depth
+        self.count = 0
+
+    def __call__(self, line):
+        self.lines.append("    " * self.depth + line)
+
+    def tmp(self, prefix):
+        self.count += 1
+        return "%s%d" % (prefix, self.count)
+
+
+class PacketCompiler(object):
+
+    def __init__(self):
+        self.refs = {}
+        self.packers = {}
+
+    def ref(self, path):
+        """ module level name bound to the object at path in the packet table """
+        if path not in self.refs:
+            self.refs[path] = "R%d" % len(self.refs)
+        return self.refs[path]
+
+    def packer(self, fmt):
+        if fmt not in self.packers:
+            self.packers[fmt] = "S%d" % len(self.packers)
+        return self.packers[fmt]
+
+    def field_runs(self, subcons):
+        """ split subcons to runs of plain fields sharing the byte order and single constructs """
+        i = 0
+        while i < len(subcons):
+            j = i
+            while j < len(subcons) and _plain_field(subcons[j]) and \
+                    subcons[j].packer.format[0] == subcons[i].packer.format[0]:
+                j += 1
+            if j - i > 1:
+                yield i, subcons[i:j]
+                i = j
+            else:
+                yield i, [subcons[i]]
+                i += 1
+
+    def run_format(self, run):
+        return run[0].packer.format[0] + "".join(f.packer.format[1:] for f in run)
+
+    # parsing
+
+    def parse(self, con, path, ctx, w, embedded=False):
+        """
+        Emits code parsing con at buf[pos:], returns expression of the value.
+        Embedded constructs store their fields in ctx and return None.
+        """
+        if isinstance(con, FormatField):
+            v = w.tmp("v")
+            w("%s = %s.unpack_from(buf, pos)[0]" % (v, self.packer(con.packer.format)))
+            w("pos += %d" % con.length)
+            return v
+        elif isinstance(con, StaticField):
+            return self.parse_read(str(con.length), w)
+        elif isinstance(con, MetaField):
+            n = w.tmp("n")
+            w("%s = %s(%s)" % (n, self.ref(path + ".lengthfunc"), ctx))
+            return self.parse_read(n, w)
+        elif (type(con) is Struct and con.nested) or _flat_sequence(con):
+            return self.parse_struct(con, path, ctx, w, embedded)
+        elif type(con) is MetaArray:
+            return self.parse_array(con, path, ctx, w)
+        elif type(con) is RepeatUntil:
+            return self.parse_repeat(con, path, ctx, w)
+        elif type(con) is Switch and all(_literal(k) for k in con.cases):
+            return self.parse_switch(con, path, ctx, w, embedded)
+        elif type(con) is Value:
+            if embedded:
+                return None
+            return "%s(%s)" % (self.ref(path + ".func"), ctx)
+        elif type(con) is Peek:
+            return self.parse_peek(con, path, ctx, w)
+        elif type(con) is Reconfig:
+            return self.parse(con.subcon, path + ".subcon", ctx, w, _is_embedded(con))
+        elif isinstance(con, StringAdapter) and _inherits(con, StringAdapter, "_decode"):
+            v = self.parse(con.subcon, path + ".subcon", ctx, w)
+            if con.encoding:
+                return "%s.decode(%r)" % (v, con.encoding)
+            return v
+        elif isinstance(con, LengthValueAdapter) and _inherits(con, LengthValueAdapter, "_decode"):
+            if _flat_sequence(con.subcon):
+                return self.parse_struct(con.subcon, path + ".subcon", ctx, w, item=1)
+            return "%s[1]" % self.parse(con.subcon, path + ".subcon", ctx, w)
+        elif isinstance(con, Subconstruct) and hasattr(con, "_decode"):
+            v = self.parse(con.subcon, path + ".subcon", ctx, w)
+            return "%s._decode(%s, %s)" % (self.ref(path), v, ctx)
+        elif type(con) is Subconstruct:
+            return self.parse(con.subcon, path + ".subcon", ctx, w, embedded)
+        return self.parse_fallback(con, path, ctx, w, embedded)
+
+    def parse_read(self, n, w):
+        v = w.tmp("v")
+        end = w.tmp("end")
+        w("%s = pos + %s" % (end, n))
+        w("if %s < pos or %s > len(buf):" % (end, end))
+        w("    raise FieldError('expected %%d, found %%d' %% (%s, len(buf) - pos))" % n)
+        w("%s = buf[pos:%s]" % (v, end))
+        w("pos = %s" % end)
+        return v
+
+    def parse_struct(self, con, path, ctx, w, embedded=False, item=None):
+        sequence = type(con) is Sequence
+        if embedded and not sequence:
+            c = ctx
+        else:
+            c = w.tmp("c")
+            w("%s = Context(_=%s)" % (c, ctx))
+        names = []
+        for i, run in self.field_runs(con.subcons):
+            if len(run) > 1:
+                targets = ", ".join("%s[%r]" % (c, f.name) for f in run)
+                fmt = self.run_format(run)
+                w("%s = %s.unpack_from(buf, pos)" % (targets, self.packer(fmt)))
+                w("pos += %d" % sum(f.length for f in run))
+                names.extend(f.name for f in run)
+                continue
+            sc = run[0]
+            subpath = "%s.subcons[%d]" % (path, i)
+            if _is_embedded(sc):
+                self.parse(sc, subpath, c, w, embedded=True)
+                continue
+            v = self.parse(sc, subpath, c, w)
+            if sc.name is not None:
+                w("%s[%r] = %s" % (c, sc.name, v))
+                names.append(sc.name)
+        if sequence:
+            if embedded:
+                return None
+            values = ["%s[%r]" % (c, name) for name in names]
+            if item is not None:
+                return values[item]
+            return "ListContainer([%s])" % ", ".join(values)
+        if embedded:
+            return None
+        w("del %s['_']" % c)
+        return "Container(**%s)" % c
+
+    def parse_array(self, con, path, ctx, w):
+        n = w.tmp("n")
+        v = w.tmp("v")
+        # construct reads no items for a negative count
+        w("%s = max(0, %s(%s))" % (n, self.ref(path + ".countfunc"), ctx))
+        sub = con.subcon
+        if type(sub) is FormatField:
+            fmt = sub.packer.format
+            w("%s = ListContainer(unpack_from('%s%%d%s' %% %s, buf, pos))" % (v, fmt[0], fmt[1:], n))
+            w("pos += %d * %s" % (sub.length, n))
+            return v
+        w("%s = ListContainer()" % v)
+        w("for _ in xrange(%s):" % n)
+        w.depth += 1
+        e = self.parse(sub, path + ".subcon", ctx, w)
+        w("%s.append(%s)" % (v, e))
+        w.depth -= 1
+        return v
+
+    def parse_repeat(self, con, path, ctx, w):
+        v = w.tmp("v")
+        e = w.tmp("e")
+        w("%s = []" % v)
+        w("while True:")
+        w.depth += 1
+        w("%s = %s" % (e, self.parse(con.subcon, path + ".subcon", ctx, w)))
+        w("%s.append(%s)" % (v, e))
+        w("if %s(%s, %s):" % (self.ref(path + ".predicate"), e, ctx))
+        w("    break")
+        w.depth -= 1
+        return v
+
+    def parse_switch(self, con, path, ctx, w, embedded):
+        k = w.tmp("k")
+        v = w.tmp("v")
+        w("%s = %s(%s)" % (k, self.ref(path + ".keyfunc"), ctx))
+        branches = [("if %s == %r:" % (k, key), case, "%s.cases[%r]" % (path, key))
+                    for key, case in sorted(con.cases.iteritems(), key=lambda kv: repr(kv[0]))]
+        if con.default is not Switch.NoDefault:
+            branches.append(("else:", con.default, path + ".default"))
+        for n, (head, case, subpath) in enumerate(branches):
+            if n > 0 and head != "else:":
+                head = "el" + head
+            w(head)
+            w.depth += 1
+            mark = len(w.lines)
+            e = self.parse(case, subpath, ctx, w, _is_embedded(case))
+            if e is not None and not embedded:
+                w("%s = %s" % (v, e))
+            if len(w.lines) == mark:
+                w("pass")
+            w.depth -= 1
+        if con.default is Switch.NoDefault:
+            w("else:")
+            w("    raise SwitchError('no default case defined')")
+        if embedded:
+            return None
+        if con.include_key:
+            return "(%s, %s)" % (k, v)
+        return v
+
+    def parse_peek(self, con, path, ctx, w):
+        p = w.tmp("p")
+        v = w.tmp("v")
+        w("%s = pos" % p)
+        w("try:")
+        w.depth += 1
+        w("%s = %s" % (v, self.parse(con.subcon, path + ".subcon", ctx, w)))
+        w.depth -= 1
+        w("except (FieldError, error):")
+        w("    %s = None" % v)
+        w("pos = %s" % p)
+        return v
+
+    def parse_fallback(self, con, path, ctx, w, embedded):
+        s = w.tmp("s")
+        v = w.tmp("v")
+        w("%s = StringIO(buf)" % s)
+        w("%s.seek(pos)" % s)
+        if embedded:
+            w("%s['<obj>'] = %s" % (ctx, ctx))
+        w("%s = %s._parse(%s, %s)" % (v, self.ref(path), s, ctx))
+        w("pos = %s.tell()" % s)
+        if embedded:
+            w("%s.pop('<obj>', None)" % ctx)
+            return None
+        return v
+
+    # building
+
+    def build(self, con, path, v, ctx, w, embedded=False):
+        """
+        Emits code appending the bytes of value v to the output,
+        v has to be a name or a subscription.
+        """
+        if isinstance(con, FormatField):
+            w("write(%s.pack(%s))" % (self.packer(con.packer.format), v))
+        elif isinstance(con, StaticField):
+            self.build_write(str(con.length), v, w)
+        elif isinstance(con, MetaField):
+            n = w.tmp("n")
+            w("%s = %s(%s)" % (n, self.ref(path + ".lengthfunc"), ctx))
+            self.build_write(n, v, w)
+        elif type(con) is Struct and con.nested:
+            self.build_struct(con, path, v, ctx, w, embedded)
+        elif _flat_sequence(con):
+            self.build_sequence(con, path, v, ctx, w)
+        elif type(con) is MetaArray:
+            self.build_array(con, path, v, ctx, w)
+        elif type(con) is Switch and all(_literal(k) for k in con.cases):
+            self.build_switch(con, path, v, ctx, w)
+        elif type(con) is Value:
+            w("%s[%r] = %s(%s)" % (ctx, con.name, self.ref(path + ".func"), ctx))
+        elif type(con) is Peek:
+            if con.perform_build:
+                self.build(con.subcon, path + ".subcon", v, ctx, w)
+        elif type(con) is Reconfig:
+            self.build(con.subcon, path + ".subcon", v, ctx, w, _is_embedded(con))
+        elif isinstance(con, StringAdapter) and _inherits(con, StringAdapter, "_encode"):
+            if con.encoding:
+                e = w.tmp("e")
+                w("%s = %s.encode(%r)" % (e, v, con.encoding))
+                v = e
+            self.build(con.subcon, path + ".subcon", v, ctx, w)
+        elif isinstance(con, Subconstruct) and hasattr(con, "_encode"):
+            e = w.tmp("e")
+            w("%s = %s._encode(%s, %s)" % (e, self.ref(path), v, ctx))
+            self.build(con.subcon, path + ".subcon", e, ctx, w)
+        elif type(con) is Subconstruct:
+            self.build(con.subcon, path + ".subcon", v, ctx, w, embedded)
+        else:
+            self.build_fallback(con, path, v, ctx, w, embedded)
+
+    def build_write(self, n, v, w):
+        w("if len(%s) != %s:" % (v, n))
+        w("    raise FieldError('expected %%d, found %%d' %% (%s, len(%s)))" % (n, v))
+        w("write(%s)" % v)
+
+    def build_struct(self, con, path, v, ctx, w, embedded):
+        if embedded:
+            o, c = v, ctx
+        else:
+            o = w.tmp("o")
+            c = w.tmp("c")
+            w("%s = %s" % (o, v))
+            w("%s = Context(_=%s)" % (c, ctx))
+        for i, run in self.field_runs(con.subcons):
+            if len(run) > 1:
+                for f in run:
+                    w("%s[%r] = %s.%s" % (c, f.name, o, f.name))
+                fmt = self.run_format(run)
+                w("write(%s.pack(%s))" % (self.packer(fmt), ", ".join("%s[%r]" % (c, f.name) for f in run)))
+                continue
+            sc = run[0]
+            subpath = "%s.subcons[%d]" % (path, i)
+            if _is_embedded(sc):
+                self.build(sc, subpath, o, c, w, embedded=True)
+            elif sc.name is None:
+                self.build(sc, subpath, "None", c, w)
+            elif type(sc) is Value:
+                self.build(sc, subpath, None, c, w)
+            else:
+                w("%s[%r] = %s.%s" % (c, sc.name, o, sc.name))
+                self.build(sc, subpath, "%s[%r]" % (c, sc.name), c, w)
+
+    def build_sequence(self, con, path, v, ctx, w):
+        it = w.tmp("it")
+        c = w.tmp("c")
+        w("%s = iter(%s)" % (it, v))
+        w("%s = Context(_=%s)" % (c, ctx))
+        for i, sc in enumerate(con.subcons):
+            subpath = "%s.subcons[%d]" % (path, i)
+            if sc.name is None:
+                self.build(sc, subpath, "None", c, w)
+            else:
+                w("%s[%r] = next(%s)" % (c, sc.name, it))
+                self.build(sc, subpath, "%s[%r]" % (c, sc.name), c, w)
+
+    def build_array(self, con, path, v, ctx, w):
+        n = w.tmp("n")
+        w("%s = %s(%s)" % (n, self.ref(path + ".countfunc"), ctx))
+        w("if len(%s) != %s:" % (v, n))
+        w("    raise ArrayError('expected %%d, found %%d' %% (%s, len(%s)))" % (n, v))
+        sub = con.subcon
+        if type(sub) is FormatField:
+            fmt = sub.packer.format
+            w("write(pack('%s%%d%s' %% %s, *%s))" % (fmt[0], fmt[1:], n, v))
+            return
+        e = w.tmp("e")
+        w("for %s in %s:" % (e, v))
+        w.depth += 1
+        mark = len(w.lines)
+        self.build(sub, path + ".subcon", e, ctx, w)
+        if len(w.lines) == mark:
+            w("pass")
+        w.depth -= 1
+
+    def build_switch(self, con, path, v, ctx, w):
+        k = w.tmp("k")
+        if con.include_key:
+            value = w.tmp("v")
+            w("%s, %s = %s" % (k, value, v))
+            v = value
+        else:
+            w("%s = %s(%s)" % (k, self.ref(path + ".keyfunc"), ctx))
+        branches = [("if %s == %r:" % (k, key), case, "%s.cases[%r]" % (path, key))
+                    for key, case in sorted(con.cases.iteritems(), key=lambda kv: repr(kv[0]))]
+        if con.default is not Switch.NoDefault:
+            branches.append(("else:", con.default, path + ".default"))
+        for n, (head, case, subpath) in enumerate(branches):
+            if n > 0 and head != "else:":
+                head = "el" + head
+            w(head)
+            w.depth += 1
+            mark = len(w.lines)
+            self.build(case, subpath, v, ctx, w, _is_embedded(case))
+            if len(w.lines) == mark:
+                w("pass")
+            w.depth -= 1
+        if con.default is Switch.NoDefault:
+            w("else:")
+            w("    raise SwitchError('no default case defined')")
+
+    def build_fallback(self, con, path, v, ctx, w, embedded):
+        s = w.tmp("s")
+        w("%s = StringIO()" % s)
+        if embedded:
+            w("%s['<unnested>'] = True" % ctx)
+        w("%s._build(%s, %s, %s)" % (self.ref(path), v, s, ctx))
+        w("write(%s.getvalue())" % s)
+
+    # packets
+
+    def compile_parser(self, pid, con):
+        w = _Writer(2)
+        w("c0 = Context()")
+        w("return %s" % self.parse(con, "packets[%d]" % pid, "c0", w))
+        return ["def parse_%d(buf):" % pid,
+                "    pos = 0",
+                "    try:"] + w.lines + [
+                "    except error as e:",
+                "        raise FieldError(e)"]
+
+    def compile_builder(self, pid, con):
+        w = _Writer(2)
+        w("c0 = Context()")
+        mark = len(w.lines)
+        self.build(con, "packets[%d]" % pid, "obj", "c0", w)
+        if len(w.lines) == mark:
+            w("pass")
+        return ["def build_%d(obj):" % pid,
+                "    out = []",
+                "    write = out.append",
+                "    try:"] + w.lines + [
+                "    except error as e:",
+                "        raise FieldError(e)",
+                "    return ''.join(out)"]
+
+    def generate(self, packets, digest):
+        """ source of the module with parse_* and build_* functions of all packets """
+        functions = []
+        compiled = []
+        for pid, con in sorted(packets.iteritems()):
+            try:
+                lines = self.compile_parser(pid, con) + ["", ""] + self.compile_builder(pid, con)
+            except Exception as e:
+                log.err(_why="cannot compile packet %d %s: %s" % (pid, con.name, e))
+                continue
+            functions.extend(lines + ["", ""])
+            compiled.append(pid)
+        out = [PRELUDE % digest]
+        for fmt, name in sorted(self.packers.iteritems(), key=lambda kv: int(kv[1][1:])):
+            out.append("%s = Struct(%r)" % (name, fmt))
+        out.append("")
+        for path, name in sorted(self.refs.iteritems(), key=lambda kv: int(kv[1][1:])):
+            out.append("%s = None" % name)
+        out.extend(["", "", "def bind(packets):"])
+        if self.refs:
+            out.append("    global %s" % ", ".join(sorted(self.refs.values(), key=lambda n: int(n[1:]))))
+        else:
+            out.append("    pass")
+        for path, name in sorted(self.refs.iteritems(), key=lambda kv: int(kv[1][1:])):
+            out.append("    %s = %s" % (name, path))
+        out.extend(["", ""])
+        out.extend(functions)
+        out.append("parsers = {%s}" % ", ".join("%d: parse_%d" % (pid, pid) for pid in compiled))
+        out.append("builders = {%s}" % ", ".join("%d: build_%d" % (pid, pid) for pid in compiled))
+        return "\n".join(out) + "\n"
+
+
+def _digest(*filenames):
+    md5 = hashlib.md5()
+    for filename in filenames:
+        try:
+            with open(os.path.splitext(filename)[0] + ".py", "rb") as f:
+                md5.update(f.read())
+        except IOError:
+            return None
+    return md5.hexdigest()
+
+
+def _store(source):
+    tmp = CACHE + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(source)
+        if os.path.exists(CACHE):
+            os.remove(CACHE)
+        os.rename(tmp, CACHE)
+    except (IOError, OSError) as e:
+        log.msg("cannot write %s: %s" % (CACHE, e))
+
+
+def load(packets, definitions):
+    """
+    Returns dictionaries of parse and build functions by packet id,
+    definitions is the file name of the packet table.
+    """
+    digest = _digest(definitions, __file__)
+    try:
+        import compiled_packets as module
+        if digest is None or module.DIGEST != digest:
+            module = None
+    except Exception:
+        module = None
+    if module is None:
+        source = PacketCompiler().generate(packets, digest)
+        name = __name__.rpartition(".")[0] + ".compiled_packets" if "." in __name__ else "compiled_packets"
+        module = sys.modules[name] = imp.new_module(name)
+        module.__file__ = CACHE
+        exec compile(source, CACHE, "exec") in module.__dict__
+        if digest is not None:
+            _store(source)
+    module.bind(packets)
+    return module.parsers, module.builders
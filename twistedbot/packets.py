@@ -1,6 +1,7 @@
 
 # original version from https://github.com/MostAwesomeDude/bravo
 
+import struct
 from StringIO import StringIO
 
 from collections import namedtuple
@@ -19,10 +20,13 @@ from construct import SBInt8, SBInt16, SBInt32, SBInt64
 from construct import BFloat32, BFloat64
 from construct import BitStruct, BitField
 from construct import StringAdapter, LengthValueAdapter, Sequence
+from construct import FormatField
 
 from pynbt import NBTFile
 
 import logbot
+import fastpackets
+import packetcompiler
 
 # Strings.
 # This one is a UCS2 string, which effectively decodes single writeChar()
@@ -818,6 +822,81 @@ def parse_packets_incrementally(bytestream):
 
 packets_by_name = dict((v.name, k) for (k, v) in packets.iteritems())
 
+compiled_parsers, compiled_builders = packetcompiler.load(packets, __file__)
+
+
+def decode_packet(pid, body):
+    """
+    Parse the body of a single, complete packet into a Container,
+    or into a record from fastpackets for the high frequency packets.
+    """
+
+    decoder = fastpackets.decoders.get(pid, None)
+    if decoder is None:
+        decoder = compiled_parsers.get(pid, None)
+    if decoder is not None:
+        return decoder(body)
+    return packets[pid].parse(body)
+
+
+def _fixed_fields(subcons, path=()):
+    """
+    Flat list of (path, struct format) of the fields of a packet built only
+    from plain format fields and nested structs, None for anything else.
+    """
+    fields = []
+    for sc in subcons:
+        if type(sc) is FormatField and sc.packer.format[0] == ">":
+            fields.append((path + (sc.name,), sc.packer.format[1:]))
+        elif type(sc) is Struct and sc.nested:
+            sub = _fixed_fields(sc.subcons, path + (sc.name,))
+            if sub is None:
+                return None
+            fields.extend(sub)
+        else:
+            return None
+    return fields
+
+
+def _compile_pack(header, fields):
+    """
+    Function packing header and payload fields with one struct. Fields are
+    read by key at every level, nested parts may be dicts or Containers.
+    """
+    packer = struct.Struct(">B" + "".join(fmt for _, fmt in fields))
+    args = ", ".join("p%s" % "".join("[%r]" % key for key in path) for path, _ in fields)
+    return eval("lambda p: pack(%d, %s)" % (header, args), {"pack": packer.pack})
+
+
+class PacketEncoder(object):
+    """
+    Cached encoder of one packet name. Packets with fixed layout are packed
+    together with the header byte by one struct, reading the payload fields
+    directly, without building a Container. Others go through fastpackets,
+    the compiled builder or construct.
+    """
+
+    def __init__(self, header):
+        self.header = header
+        self.prefix = chr(header)
+        self.encoder = fastpackets.encoders.get(header, None)
+        self.builder = compiled_builders.get(header, packets[header].build)
+        fields = _fixed_fields(packets[header].subcons)
+        self.pack = None if fields is None else _compile_pack(header, fields)
+
+    def encode(self, payload):
+        if self.encoder is not None and fastpackets.is_record(payload):
+            # decoded records go back through the codec they came from
+            return self.prefix + self.encoder(payload)
+        if self.pack is not None:
+            return self.pack(payload)
+        if self.encoder is not None:
+            return self.prefix + self.encoder(payload)
+        return self.prefix + self.builder(Container(**payload))
+
+
+packet_encoders = {}
+
 
 def make_packet(packet, payload, template=None):
     """
@@ -833,10 +912,13 @@ def make_packet(packet, payload, template=None):
         return ""
 
     header = packets_by_name[packet]
-    container = Container(**payload)
 
     if template is None:
-        template = packets[header]
+        encoder = packet_encoders.get(packet, None)
+        if encoder is None:
+            encoder = packet_encoders[packet] = PacketEncoder(header)
+        return encoder.encode(payload)
+    container = Container(**payload)
     payload = template.build(container)
     return chr(header) + payload
 
@@ -1,10 +1,13 @@
 
 import heapq
-import time
+from collections import defaultdict, OrderedDict
+
+from twisted.internet.task import Cooperator
 
 import config
 import logbot
-from gridspace import GridSpace
+import utils
+import walkability
 from axisbox import AABB
 
 
@@ -38,174 +41,1070 @@ class PathOverLimit(BaseEx):
     pass
 
 
+def _budget_terminator():
+    """ ends the cooperator turn once the path search budget is spent """
+    deadline = utils.monotonic() + config.PATHFIND_TIME_BUDGET
+    return lambda: utils.monotonic() >= deadline
+
+
+_cooperator = Cooperator(terminationPredicateFactory=_budget_terminator)
+
+
+def cooperate(search):
+    """
+    Run a path search as a cooperative task. All searches together get
+    about config.PATHFIND_TIME_BUDGET seconds per reactor turn.
+    """
+    return _cooperator.cooperate(search)
+
+
+# cells are packed into one integer: 26 bits x, 26 bits z and 9 bits y,
+# y from -128 to 383 covers the cells above the top and below the bottom
+XZ_OFFSET = 1 << 25
+XZ_MASK = (1 << 26) - 1
+Y_OFFSET = 1 << 7
+Y_MASK = (1 << 9) - 1
+Z_SHIFT = 9
+X_SHIFT = Z_SHIFT + 26
+
+
+def pack_coords(x, y, z):
+    return (x + XZ_OFFSET) << X_SHIFT | (z + XZ_OFFSET) << Z_SHIFT | (y + Y_OFFSET)
+
+
+def unpack_coords(key):
+    return utils.Vector((key >> X_SHIFT) - XZ_OFFSET, (key & Y_MASK) - Y_OFFSET, ((key >> Z_SHIFT) & XZ_MASK) - XZ_OFFSET)
+
+
+def section_of_key(key):
+    return (((key >> X_SHIFT) - XZ_OFFSET) >> 4, ((key & Y_MASK) - Y_OFFSET) >> 4, (((key >> Z_SHIFT) & XZ_MASK) - XZ_OFFSET) >> 4)
+
+
+# path repairs search around a broken stretch only
+REPAIR_STEPS = 16
+REPAIR_ITERATIONS = 1000
+
+# least cost of one block of height on any move, keeps the heuristic admissible
+COST_VERTICAL = min(config.COST_JUMP, config.COST_FALL, config.COST_LADDER, config.COST_SWIM * config.COST_DIRECT)
+
+
+def cost_estimate(a, b):
+    """ never more than the cost of edge_cost steps from a to b """
+    adx = abs(a.x - b.x)
+    adz = abs(a.z - b.z)
+    h_diagonal = min(adx, adz)
+    h_straight = adx + adz
+    h = config.COST_DIAGONAL * h_diagonal + config.COST_DIRECT * (h_straight - 2 * h_diagonal)
+    return h + COST_VERTICAL * abs(a.y - b.y)
+
+
+def box_estimate(a, low, high):
+    """ cost_estimate from a to the nearest cell of the box from low to high """
+    x = a.x
+    if x < low.x:
+        adx = low.x - x
+    elif x > high.x:
+        adx = x - high.x
+    else:
+        adx = 0
+    z = a.z
+    if z < low.z:
+        adz = low.z - z
+    elif z > high.z:
+        adz = z - high.z
+    else:
+        adz = 0
+    y = a.y
+    if y < low.y:
+        ady = low.y - y
+    elif y > high.y:
+        ady = y - high.y
+    else:
+        ady = 0
+    h_diagonal = min(adx, adz)
+    h_straight = adx + adz
+    h = config.COST_DIAGONAL * h_diagonal + config.COST_DIRECT * (h_straight - 2 * h_diagonal)
+    return h + COST_VERTICAL * ady
+
+
+def edge_cost(state_from, state_to):
+    """
+    Horizontal part of a step is COST_DIRECT or COST_DIAGONAL, each block
+    of height adds COST_JUMP or COST_FALL, or COST_LADDER when climbing
+    straight up or down. Steps through water cost COST_SWIM per block.
+    """
+    dx = state_to.x != state_from.x
+    dz = state_to.z != state_from.z
+    dy = state_to.y - state_from.y
+    if dx and dz:
+        horizontal = config.COST_DIAGONAL
+    elif dx or dz:
+        horizontal = config.COST_DIRECT
+    else:
+        horizontal = 0
+    if state_from.in_water and state_to.in_water:
+        cost = config.COST_SWIM * (horizontal + config.COST_DIRECT * abs(dy))
+    elif dy == 0:
+        cost = horizontal
+    elif horizontal == 0 and (state_from.can_hold or state_from.can_climb):
+        cost = config.COST_LADDER * abs(dy)
+    elif dy > 0:
+        cost = horizontal + config.COST_JUMP * dy
+    else:
+        cost = horizontal + config.COST_FALL * -dy
+    if state_to.in_fire:
+        cost += config.COST_BURNING
+    return cost
+
+
 class PathNode(object):
-    def __init__(self, coords=None, cost=1):
+    """ one step of a found path """
+
+    def __init__(self, coords=None, g=0, step=0):
         self.coords = coords
-        self.cost = cost
-        self.g = 0
-        self.h = 0
-        self.f = 0
-        self.step = 0
-        self._parent = None
-        self.hash = hash(self.coords)
+        self.g = g
+        self.step = step
 
     def __repr__(self):
-        #return "%s:st%s:cost:%s:g%s:h%s:f%s" % (str(self.coords), self.step, self.cost, self.g, self.h, self.f)
         return str(self.coords)
 
-    def __lt__(self, other):
-        return self.f < other.f
-
     def __eq__(self, other):
         return self.coords == other.coords
 
     def __hash__(self):
-        return self.hash
+        return hash(self.coords)
 
-    @property
-    def parent(self):
-        return self._parent
 
-    @parent.setter
-    def parent(self, p):
-        self._parent = p
-        self.step = p.step + 1
+class PathCache(object):
+    """
+    Found paths by dimension, start and goal, the least recently used are
+    dropped first. An entry remembers the grid change count its search
+    started from and is stale once a section around its cells changed
+    later, or was dropped with its chunk.
+    """
+
+    def __init__(self, size=config.PATH_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def __repr__(self):
+        return "PathCache %d entries, %d hits, %d misses, %d stale" % (len(self.entries), self.hits, self.misses, self.stale)
+
+    def get(self, dimension, start_coords, goal_coords):
+        """ path as a list of PathNode from the goal to the start, None if not cached """
+        key = (dimension, start_coords.tuple, goal_coords.tuple)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        steps, sections, known, changes = entry
+        section_versions = dimension.grid.section_versions
+        for section in sections:
+            version = section_versions.get(section, None)
+            if version is None:
+                stale = section in known
+            else:
+                stale = version > changes
+            if stale:
+                self.stale += 1
+                self.misses += 1
+                return None
+        self.entries[key] = entry
+        self.hits += 1
+        return [PathNode(coords, g, step) for coords, g, step in steps]
+
+    def put(self, dimension, start_coords, goal_coords, path, changes_then):
+        """
+        changes_then is the change count of the grid the search started
+        from, the path is not kept if a section around it changed since
+        """
+        sections = set()
+        for node in path:
+            x, y, z = node.coords.x, node.coords.y, node.coords.z
+            # moves look one block aside, one up and falls up to three down
+            for i, j in utils.plane:
+                for k in (-3, -1, 0, 1, 2):
+                    sections.add(((x + i) >> 4, (y + k) >> 4, (z + j) >> 4))
+        section_versions = dimension.grid.section_versions
+        known = set()
+        for section in sections:
+            version = section_versions.get(section, None)
+            if version is None:
+                continue
+            if version > changes_then:
+                return
+            known.add(section)
+        steps = [(node.coords, node.g, node.step) for node in path]
+        self.entries.pop((dimension, start_coords.tuple, goal_coords.tuple), None)
+        self.entries[(dimension, start_coords.tuple, goal_coords.tuple)] = (steps, sections, known, changes_then)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
 
-    def set_score(self, g, h):
-        self.g = g
-        self.h = h
-        self.f = g + h
+
+path_cache = PathCache()
 
 
 class AStarCoords(object):
+    # the goal test is the goal cell, found paths can be shared
+    cacheable = True
+    # goals are cells, jumps over flat ground can stop on them
+    jump_points = True
+
     def __init__(self, dimension, start_coords, goal_coords):
+        self.dimension = dimension
+        self.start_coords = start_coords
         self.goal_coords = goal_coords
-        self.goal_node = PathNode(goal_coords)
-        self.start_node = PathNode(start_coords)
-        self.astar = AStarAlgo(graph=GridSpace(dimension.grid), start_node=self.start_node, goal_node=self.goal_node, is_goal=self.is_goal, heuristics=self.heuristics)
-        self.t_start = time.time()
+        self.astar = self.make_astar(dimension)
+        self.time_budget = dimension.world.config.PATHFIND_TIME_BUDGET
+        self.t_start = utils.monotonic()
+        self.search_time = 0
+        self.slices = 0
         self.path = None
+        if self.cacheable:
+            self.path = path_cache.get(dimension, start_coords, goal_coords)
+            # the grid the search sees, changes while it runs make the path stale
+            self.changes = dimension.grid.changes
+
+    def make_astar(self, dimension):
+        if self.jump_points and dimension.world.config.PATHFIND_JUMP_POINTS:
+            return AStarJumpAlgo(graph=dimension.grid.grid_space, start_coords=self.start_coords, goal_coords=self.goal_coords, is_goal=self.is_goal, heuristics=self.heuristics, max_cost=self.max_cost(), goal_keys=self.goal_keys())
+        return AStarAlgo(graph=dimension.grid.grid_space, start_coords=self.start_coords, goal_coords=self.goal_coords, is_goal=self.is_goal, heuristics=self.heuristics, max_cost=self.max_cost())
+
+    def max_cost(self):
+        """ step limit of the search, None for the limit from start to goal_coords """
+        return None
+
+    def goal_keys(self):
+        return set([pack_coords(self.goal_coords.x, self.goal_coords.y, self.goal_coords.z)])
 
-    def heuristics(self, start, goal):
-        adx = abs(start.coords.x - goal.coords.x)
-        adz = abs(start.coords.z - goal.coords.z)
-        h_diagonal = min(adx, adz)
-        h_straight = adx + adz
-        h = config.COST_DIAGONAL * h_diagonal + config.COST_DIRECT * (h_straight - 2 * h_diagonal)
-        return h
+    def heuristics(self, state):
+        return cost_estimate(state, self.goal_coords)
 
-    def is_goal(self, current):
-        return current == self.goal_node
+    def is_goal(self, state):
+        return state.x == self.goal_coords.x and state.y == self.goal_coords.y and state.z == self.goal_coords.z
 
     def time_sice_start(self):
-        return time.time() - self.t_start
+        return utils.monotonic() - self.t_start
+
+    @property
+    def nodes_expanded(self):
+        return len(self.astar.closed_set)
+
+    @property
+    def iterations_per_second(self):
+        if self.search_time == 0:
+            return 0
+        return self.astar.iter_count / self.search_time
+
+    def log_stats(self):
+        log.msg('time consumed %.4f sec, searched %.4f sec in %d slices, made %d iterations, %.0f per sec, expanded %d nodes' %
+                (self.time_sice_start(), self.search_time, self.slices, self.astar.iter_count, self.iterations_per_second, self.nodes_expanded))
 
     def next(self):
-        count = 0
+        """ search for about time_budget seconds """
+        if self.path is not None:
+            log.msg('path %d steps long from cache, %s' % (len(self.path), path_cache))
+            raise StopIteration()
+        t_slice = utils.monotonic()
+        deadline = t_slice + self.time_budget
+        astar_next = self.astar.next
         try:
-            while count < 1000:
-                self.astar.next()
+            while True:
+                # look at the clock every few iterations only
+                for _ in xrange(8):
+                    astar_next()
+                if utils.monotonic() >= deadline:
+                    self._end_slice(t_slice)
+                    return
         except PathNotFound:
-            log.err("did not find path between %s and %s" % (self.start_node.coords, self.goal_node.coords))
-            log.msg('time consumed %s sec, made %d iterations' % (self.time_sice_start(), self.astar.iter_count))
+            self._end_slice(t_slice)
+            log.err("did not find path between %s and %s" % (self.start_coords, self.goal_coords))
+            self.log_stats()
             raise StopIteration()
         except PathFound:
+            self._end_slice(t_slice)
             log.msg('found path %d steps long' % len(self.astar.path))
-            log.msg('time consumed %s sec, made %d iterations' % (self.time_sice_start(), self.astar.iter_count))
+            self.log_stats()
             self.path = self.astar.path
+            if self.cacheable:
+                path_cache.put(self.dimension, self.start_coords, self.goal_coords, self.path, self.changes)
             raise StopIteration()
         except PathOverLimit:
-            log.err("finding path over limit between %s and %s" % (self.start_node.coords, self.goal_node.coords))
-            log.msg('time consumed %s sec, made %d iterations' % (self.time_sice_start(), self.astar.iter_count))
+            self._end_slice(t_slice)
+            log.err("finding path over limit between %s and %s" % (self.start_coords, self.goal_coords))
+            self.log_stats()
             raise StopIteration()
-        except:
-            raise
+
+    def _end_slice(self, t_slice):
+        self.search_time += utils.monotonic() - t_slice
+        self.slices += 1
 
 
 class AStarMultiCoords(AStarCoords):
-    def __init__(self, multiple_goals=None, **kwargs):
-        self.multiple_goals = [PathNode(g) for g in multiple_goals]
-        super(AStarMultiCoords, self).__init__(**kwargs)
+    """
+    Nearest reachable cell of multiple_goals. The goals are a set of packed
+    coordinates and the heuristic is the estimate to the bounding box of
+    the goals, it never overestimates so the first goal found is the
+    nearest one. goal_coords is the cell of the box nearest to the start.
+    """
+    cacheable = False
 
-    def is_goal(self, current):
-        for g in self.multiple_goals:
-            if current == g:
-                return True
-        else:
-            return False
+    def __init__(self, multiple_goals=None, start_coords=None, **kwargs):
+        goals = list(multiple_goals)
+        self.multiple_goals = set(pack_coords(g.x, g.y, g.z) for g in goals)
+        self.low = utils.Vector(min(g.x for g in goals), min(g.y for g in goals), min(g.z for g in goals))
+        self.high = utils.Vector(max(g.x for g in goals), max(g.y for g in goals), max(g.z for g in goals))
+        nearest = utils.Vector(min(max(start_coords.x, self.low.x), self.high.x),
+                               min(max(start_coords.y, self.low.y), self.high.y),
+                               min(max(start_coords.z, self.low.z), self.high.z))
+        super(AStarMultiCoords, self).__init__(start_coords=start_coords, goal_coords=nearest, **kwargs)
+
+    def max_cost(self):
+        """ the limit of the farthest corner of the box, any goal is within it """
+        start = self.start_coords
+        far = max(abs(start.x - self.low.x), abs(start.x - self.high.x)) + \
+            max(abs(start.y - self.low.y), abs(start.y - self.high.y)) + \
+            max(abs(start.z - self.low.z), abs(start.z - self.high.z))
+        return max(32, min(far * 2, config.PATHFIND_LIMIT))
+
+    def goal_keys(self):
+        return self.multiple_goals
+
+    def heuristics(self, state):
+        return box_estimate(state, self.low, self.high)
+
+    def is_goal(self, state):
+        return pack_coords(state.x, state.y, state.z) in self.multiple_goals
 
 
 class AStarBBCol(AStarCoords):
+    cacheable = False
+    jump_points = False
+
     def __init__(self, bb=None, **kwargs):
         self.bb = bb
         super(AStarBBCol, self).__init__(goal_coords=bb.bottom_center, **kwargs)
 
-    def is_goal(self, current):
-        x = current.coords.x
-        y = current.coords.y
-        z = current.coords.z
+    def is_goal(self, state):
+        x = state.x
+        y = state.y
+        z = state.z
         return self.bb.collides(AABB(x, y, z, x + 1, y + config.PLAYER_HEIGHT, z + 1))
 
 
+class AStarSectionsCoords(AStarCoords):
+    """ long trips, searched on the section graph of the grid first """
+
+    def make_astar(self, dimension):
+        return AStarSectionsAlgo(section_graph=dimension.grid.section_graph, start_coords=self.start_coords, goal_coords=self.goal_coords, heuristics=self.heuristics)
+
+
+class TravelPlan(object):
+    """
+    Path of a running travel kept usable while blocks change. Cells changed
+    by block events are collected, the steps ahead near them are checked
+    before the next step is taken, and a broken stretch is replaced by a
+    short search from the last good step to any later step of the path.
+    Steps are pulled into one straight move as far as the bot can walk
+    the line, up to smooth_steps cells.
+    """
+
+    def __init__(self, grid_space, path, smooth_steps=0):
+        self.grid_space = grid_space
+        self.cells = [node.coords for node in reversed(path)]
+        self.smooth_steps = smooth_steps
+        self.next_index = 0
+        self.from_index = 0
+        self.changed = set()
+        self.repairs = 0
+
+    def on_block_change(self, x, y, z, block_id, block_meta):
+        self.changed.add((x, y, z))
+
+    def on_multi_block_change(self, x, z, blocks):
+        shift_x = x << 4
+        shift_z = z << 4
+        for block in blocks:
+            self.changed.add((block.x + shift_x, block.y, block.z + shift_z))
+
+    def on_explosion(self, x, y, z, radius, records, **kwargs):
+        for rec in records:
+            self.changed.add((int(x + rec.x), int(y + rec.y), int(z + rec.z)))
+
+    @property
+    def finished(self):
+        return self.next_index >= len(self.cells)
+
+    def take_step(self):
+        """ the cell to move from and the farthest step in a straight line from it """
+        self.from_index = max(self.next_index - 1, 0)
+        last = self.next_index
+        if last > 0:
+            gs = self.grid_space
+            from_state = gs.get_state_coords(self.cells[self.from_index])
+            end = min(len(self.cells), self.from_index + self.smooth_steps + 1)
+            while last + 1 < end and gs.can_walk_straight(from_state, gs.get_state_coords(self.cells[last + 1])):
+                last += 1
+        self.next_index = last + 1
+        return self.cells[self.from_index], self.cells[last]
+
+    def repair(self):
+        """ checks the steps ahead near changed cells, False if a broken one cannot be bypassed """
+        if not self.changed:
+            return True
+        # changes of chunks still waiting for their data are not in the grid yet, they wait here too
+        updating = self.grid_space.grid.updating
+        changed = set()
+        pending = set()
+        for cell in self.changed:
+            if (cell[0] >> 4, cell[2] >> 4) in updating:
+                pending.add(cell)
+            else:
+                changed.add(cell)
+        self.changed = pending
+        if not changed:
+            return True
+        broken = [i for i in xrange(max(self.next_index - 1, 0), len(self.cells) - 1)
+                  if self._near(changed, i) and not self._can_step(i)]
+        if not broken:
+            return True
+        return self._bypass(broken[0], broken[-1] + 1)
+
+    def reroute(self):
+        """ bypasses the step just taken, False if there is no way around it """
+        first = self.from_index
+        if self.next_index < 2:
+            return False
+        if not self._bypass(first, self.next_index - 1):
+            return False
+        self.next_index = first + 1
+        return True
+
+    def _near(self, changed, i):
+        u = self.cells[i]
+        v = self.cells[i + 1]
+        for x, y, z in changed:
+            for c in (u, v):
+                if abs(c.x - x) <= 2 and abs(c.z - z) <= 2 and abs(c.y - y) <= 4:
+                    return True
+        return False
+
+    def _can_step(self, i):
+        v = self.cells[i + 1]
+        for state in self.grid_space.neighbours_of(self.cells[i]):
+            if state.x == v.x and state.y == v.y and state.z == v.z:
+                return True
+        return False
+
+    def _bypass(self, first, last):
+        """ replaces steps first to last with a way from first to any later step """
+        goal = self.cells[last]
+        targets = dict((pack_coords(c.x, c.y, c.z), i) for i, c in enumerate(self.cells) if i >= last)
+        astar = AStarAlgo(graph=self.grid_space, start_coords=self.cells[first],
+                          heuristics=lambda state: cost_estimate(state, goal),
+                          is_goal=lambda state: pack_coords(state.x, state.y, state.z) in targets,
+                          max_cost=2 * (last - first) + REPAIR_STEPS)
+        try:
+            for _ in xrange(REPAIR_ITERATIONS):
+                astar.next()
+            return False
+        except PathFound:
+            pass
+        except (PathNotFound, PathOverLimit):
+            return False
+        rejoin = astar.path[0].coords
+        way = [node.coords for node in reversed(astar.path)]
+        self.cells = self.cells[:first] + way + self.cells[targets[pack_coords(rejoin.x, rejoin.y, rejoin.z)] + 1:]
+        self.repairs += 1
+        log.msg("repaired path between %s and %s" % (way[0], rejoin))
+        return True
+
+
 class AStarAlgo(object):
+    """
+    A* over the states of a GridSpace. Cells are keyed by packed integer
+    coordinates, g scores and parents live in dicts and the open list is a
+    heap with lazy deletion: a cell reached again at a lower cost is pushed
+    again and the stale entry is skipped when it comes up. Ties in f go to
+    the cell closer to the goal.
+    """
 
-    def __init__(self, graph=None, start_node=None, goal_node=None, heuristics=None, is_goal=None, max_cost=None):
+    def __init__(self, graph=None, start_coords=None, goal_coords=None, heuristics=None, is_goal=None, max_cost=None):
         self.graph = graph
-        self.start_node = start_node
-        self.goal_node = goal_node
         self.heuristics = heuristics
         self.is_goal = is_goal
         if max_cost is None:
-            vdist = start_node.coords - goal_node.coords
+            vdist = start_coords - goal_coords
             self.max_cost = int(max(32, min(vdist.manhatan_size * 2, config.PATHFIND_LIMIT)))
+            log.msg("limit for astar is %s" % self.max_cost)
         else:
             self.max_cost = int(max_cost)
-        log.msg("limit for astar is %s" % self.max_cost)
         self.path = None
+        start_state = graph.get_state_coords(start_coords)
+        start = pack_coords(start_state.x, start_state.y, start_state.z)
+        self.g = {start: 0}
+        self.parent = {start: None}
+        self.steps = {start: 0}
+        self.states = {start: start_state}
         self.closed_set = set()
-        self.open_heap = [self.start_node]
-        self.open_set = set([self.start_node])
-        self.start_node.set_score(0, self.heuristics(self.start_node, self.goal_node))
+        h = self.heuristics(start_state)
+        self.open_heap = [(h, h, start)]
         self.iter_count = 0
 
-    def reconstruct_path(self, current):
+    def reconstruct_path(self, key):
         nodes = []
-        nodes.append(current)
-        while current.parent is not None:
-            nodes.append(current.parent)
-            current = current.parent
+        while key is not None:
+            nodes.append(PathNode(self.states[key].coords, self.g[key], self.steps[key]))
+            key = self.parent[key]
         return nodes
 
-    def get_edge_cost(self, node_from, node_to):
-        return config.COST_DIRECT
-
-    def neighbours(self, node):
-        for state in self.graph.neighbours_of(node.coords):
-            if state.coords not in self.closed_set:
-                yield PathNode(state.coords)
+    def get_edge_cost(self, state_from, state_to):
+        return edge_cost(state_from, state_to)
 
     def next(self):
         self.iter_count += 1
-        if not self.open_set:
-            raise PathNotFound()
-        x = heapq.heappop(self.open_heap)
-        if self.is_goal(x):
-            self.path = self.reconstruct_path(x)
+        open_heap = self.open_heap
+        closed_set = self.closed_set
+        while True:
+            if not open_heap:
+                raise PathNotFound()
+            current = heapq.heappop(open_heap)[2]
+            if current not in closed_set:
+                break
+        state = self.states[current]
+        if self.is_goal(state):
+            self.path = self.reconstruct_path(current)
             self.graph = None
             raise PathFound()
-        self.open_set.remove(x)
-        self.closed_set.add(x.coords)
-        for y in self.neighbours(x):
-            tentative_g_core = x.g + self.get_edge_cost(x, y)
-            if y not in self.open_set:
-                y.set_score(tentative_g_core, self.heuristics(y, self.goal_node))
-                y.parent = x
-                heapq.heappush(self.open_heap, y)
-                self.open_set.add(y)
-                if y.step > self.max_cost:
-                    raise PathOverLimit()
-            elif tentative_g_core < y.g:
-                y.set_score(tentative_g_core, self.heuristics(y, self.goal_node))
-                y.parent = x
-                if y.step > self.max_cost:
+        closed_set.add(current)
+        self.expand(current, state)
+
+    def expand(self, current, state):
+        closed_set = self.closed_set
+        open_heap = self.open_heap
+        g = self.g
+        current_g = g[current]
+        step = self.steps[current] + 1
+        for to_state in self.graph.neighbours_of(state.coords):
+            key = pack_coords(to_state.x, to_state.y, to_state.z)
+            if key in closed_set:
+                continue
+            tentative_g = current_g + self.get_edge_cost(state, to_state)
+            if tentative_g < g.get(key, tentative_g + 1):
+                if step > self.max_cost:
                     raise PathOverLimit()
+                g[key] = tentative_g
+                self.parent[key] = current
+                self.steps[key] = step
+                self.states[key] = to_state
+                h = self.heuristics(to_state)
+                heapq.heappush(open_heap, (tentative_g + h, h, key))
+
+
+# kinds of cells for the jump point search
+FLAT = 1  # plain standing cell, walking between flat cells of one level costs the distance
+BLOCKED = 2  # no move into it
+OTHER = 3  # drops, steps, ladders, water and fire
+FLAT_MASK = walkability.CAN_STAND | walkability.CAN_HOLD | walkability.IN_WATER | walkability.IN_FIRE
+# ends of a straight jump
+NODE = 1
+DEAD = 2
+OPEN = 3
+# one block along x and along z in packed coordinates
+X_KEY = 1 << X_SHIFT
+Z_KEY = 1 << Z_SHIFT
+ADJACENCY_KEYS = [i * X_KEY + j * Z_KEY for i, j in utils.adjacency]
+
+
+class AStarJumpAlgo(AStarAlgo):
+    """
+    A* with jump points over open flat ground. A flat cell whose neighbours
+    are all flat or blocked is a cell of a uniform grid without corner
+    cutting. It is expanded only in the directions its parent does not
+    reach as cheaply, and each direction is followed until a goal, a cell
+    where the path may have to turn or a cell next to something other than
+    flat ground, which becomes the next node. Any other cell is expanded in
+    full. goal_keys are the packed goal cells, the jumps stop on them.
+
+    Jumps work on packed coordinates. The kinds of all neighbours of a
+    plain cell are known, the jumps look them up without checks.
+    """
+
+    def __init__(self, goal_keys=None, **kwargs):
+        super(AStarJumpAlgo, self).__init__(**kwargs)
+        self.goal_keys = goal_keys
+        self.walk_state = self.graph.grid.walk_state
+        self.kinds = {}
+        self.plains = {}
+        self.scans = {}
+
+    def kind(self, key):
+        try:
+            return self.kinds[key]
+        except KeyError:
+            pass
+        x = (key >> X_SHIFT) - XZ_OFFSET
+        y = (key & Y_MASK) - Y_OFFSET
+        z = ((key >> Z_SHIFT) & XZ_MASK) - XZ_OFFSET
+        state = self.walk_state(x, y, z)
+        if state & FLAT_MASK == walkability.CAN_STAND:
+            kind = FLAT
+        elif state & (walkability.CAN_BE | walkability.CAN_HOLD) == 0 and \
+                self.walk_state(x, y + 1, z) & (walkability.CAN_STAND | walkability.CAN_HOLD) == 0:
+            # not even a step up
+            kind = BLOCKED
+        else:
+            kind = OTHER
+        self.kinds[key] = kind
+        return kind
+
+    def is_plain(self, key):
+        """ flat cell with flat or blocked cells around """
+        try:
+            return self.plains[key]
+        except KeyError:
+            pass
+        kinds = self.kinds
+        kind = self.kind
+        plain = kind(key) == FLAT
+        if plain:
+            for d in ADJACENCY_KEYS:
+                k = kinds.get(key + d, None)
+                if k is None:
+                    k = kind(key + d)
+                if k == OTHER:
+                    plain = False
+                    break
+        self.plains[key] = plain
+        return plain
+
+    def directions(self, current, x, y, z):
+        """ directions to follow from a plain cell """
+        parent = self.parent[current]
+        if parent is None:
+            return utils.adjacency
+        from_state = self.states[parent]
+        if from_state.y != y or self.kinds[parent] != FLAT:
+            return utils.adjacency
+        dx = cmp(x, from_state.x)
+        dz = cmp(z, from_state.z)
+        if dx and dz:
+            return ((dx, dz), (dx, 0), (0, dz))
+        directions = [(dx, dz)]
+        kinds = self.kinds
+        back = current - dx * X_KEY - dz * Z_KEY
+        # a side the parent could not step to diagonally is forced
+        for s in (1, -1):
+            if kinds[back + s * (dz * dz * X_KEY + dx * dx * Z_KEY)] != FLAT:
+                directions.extend(((s * dz * dz, s * dx * dx), (dx + s * dz * dz, dz + s * dx * dx)))
+        return directions
+
+    def jump(self, key, dx, dz, limit):
+        """
+        (key, distance) of the next node from the cell key in direction dx,
+        dz, None for a dead end. A jump as long as the limit ends in a node,
+        expanding it stops the search the way any step over the limit does.
+        """
+        if not (dx and dz):
+            forward = dx * X_KEY + dz * Z_KEY
+            n, how = self.scan(key, forward, dz * dz * X_KEY + dx * dx * Z_KEY, limit)
+            if how == DEAD:
+                return None
+            return key + n * forward, n
+        kinds = self.kinds
+        goal_keys = self.goal_keys
+        x_step = dx * X_KEY
+        z_step = dz * Z_KEY
+        for n in xrange(1, limit + 1):
+            if kinds[key + x_step] != FLAT or kinds[key + z_step] != FLAT:
+                return None
+            key += x_step + z_step
+            if kinds[key] != FLAT:
+                return None
+            if n == limit or key in goal_keys or not self.is_plain(key):
+                return key, n
+            # nothing past the limit is worth turning for
+            if self.scan(key, x_step, Z_KEY, limit - n)[1] == NODE or self.scan(key, z_step, X_KEY, limit - n)[1] == NODE:
+                return key, n
+        return None
+
+    def scan(self, key, forward, aside, limit):
+        """
+        Straight scan from the cell key as (distance, how it ended): NODE
+        for a node, DEAD for a cell that is not flat, OPEN at the limit.
+        Scans are remembered, a longer limit repeats an OPEN one only.
+        """
+        memo_key = (key, forward)
+        scan = self.scans.get(memo_key, None)
+        if scan is None or (scan[1] == OPEN and scan[0] < limit):
+            scan = self.scans[memo_key] = self._scan(key, forward, aside, limit)
+        end, how = scan
+        if end > limit:
+            return limit, OPEN
+        return end, how
+
+    def _scan(self, key, forward, aside, limit):
+        kinds = self.kinds
+        plains = self.plains
+        goal_keys = self.goal_keys
+        for n in xrange(1, limit + 1):
+            key += forward
+            if kinds[key] != FLAT:
+                return n, DEAD
+            if key in goal_keys:
+                return n, NODE
+            plain = plains.get(key, None)
+            if plain is None:
+                plain = self.is_plain(key)
+            if not plain:
+                return n, NODE
+            # a side cell the previous cell could not step to diagonally
+            if kinds[key + aside] == FLAT and kinds[key + aside - forward] != FLAT:
+                return n, NODE
+            if kinds[key - aside] == FLAT and kinds[key - aside - forward] != FLAT:
+                return n, NODE
+        return limit, OPEN
+
+    def expand(self, current, state):
+        if not self.is_plain(current):
+            super(AStarJumpAlgo, self).expand(current, state)
+            return
+        step = self.steps[current]
+        if step >= self.max_cost:
+            raise PathOverLimit()
+        x = state.x
+        y = state.y
+        z = state.z
+        closed_set = self.closed_set
+        g = self.g
+        current_g = g[current]
+        for dx, dz in self.directions(current, x, y, z):
+            found = self.jump(current, dx, dz, self.max_cost - step)
+            if found is None:
+                continue
+            key, n = found
+            if key in closed_set:
+                continue
+            tentative_g = current_g + n * (config.COST_DIAGONAL if dx and dz else config.COST_DIRECT)
+            if tentative_g < g.get(key, tentative_g + 1):
+                to_state = self.graph.get_state(x + n * dx, y, z + n * dz)
+                g[key] = tentative_g
+                self.parent[key] = current
+                self.steps[key] = step + n
+                self.states[key] = to_state
+                h = self.heuristics(to_state)
+                heapq.heappush(self.open_heap, (tentative_g + h, h, key))
+
+    def reconstruct_path(self, key):
+        """ cells a jump went over are put in the path """
+        nodes = []
+        while key is not None:
+            state = self.states[key]
+            g = self.g[key]
+            step = self.steps[key]
+            nodes.append(PathNode(state.coords, g, step))
+            key = self.parent[key]
+            if key is None:
+                break
+            from_state = self.states[key]
+            n = step - self.steps[key]
+            if n > 1:
+                dx = cmp(from_state.x, state.x)
+                dz = cmp(from_state.z, state.z)
+                cost = (g - self.g[key]) / n
+                for i in xrange(1, n):
+                    nodes.append(PathNode(utils.Vector(state.x + i * dx, state.y, state.z + i * dz), g - i * cost, step - i))
+        return nodes
+
+
+SECTION_STEPS = 4096
+# the abstract search trades a little path cost for far fewer expansions
+SECTIONS_HEURISTIC_WEIGHT = 1.5
+# cells that are nodes of the GridSpace graph
+NODE_STATES = walkability.CAN_STAND | walkability.CAN_HOLD
+
+
+def run_steps(astar):
+    """ runs astar to its end, yielding every few iterations """
+    try:
+        while True:
+            for _ in xrange(8):
+                astar.next()
+            yield
+    except (PathFound, PathNotFound, PathOverLimit):
+        pass
+
+
+def _border_groups(moves):
+    """ moves out of a section grouped by runs of touching cells """
+    by_cell = defaultdict(list)
+    for move in moves:
+        by_cell[(move[0].x, move[0].y, move[0].z)].append(move)
+    seen = set()
+    for cell in sorted(by_cell):
+        if cell in seen:
+            continue
+        seen.add(cell)
+        group = []
+        todo = [cell]
+        while todo:
+            x, y, z = todo.pop()
+            group.extend(by_cell[(x, y, z)])
+            for i, j in utils.plane:
+                for k in (-1, 0, 1):
+                    crd = (x + i, y + k, z + j)
+                    if crd in by_cell and crd not in seen:
+                        seen.add(crd)
+                        todo.append(crd)
+        group.sort(key=lambda move: (move[0].x, move[0].z, move[0].y))
+        yield group
+
+
+class SectionSpace(object):
+    """ GridSpace moves that stay inside one section """
+
+    def __init__(self, grid_space, section):
+        self.grid_space = grid_space
+        self.section = section
+
+    def get_state_coords(self, coords):
+        return self.grid_space.get_state_coords(coords)
+
+    def neighbours_of(self, coords):
+        sx, sy, sz = self.section
+        for state in self.grid_space.neighbours_of(coords):
+            if state.x >> 4 == sx and state.y >> 4 == sy and state.z >> 4 == sz:
+                yield state
+
+
+class SectionGraph(object):
+    """
+    Abstract graph over the 16x16x16 sections of a grid for long path
+    searches. Its nodes are cells from where a GridSpace move leads into
+    another section, one per run of such cells towards each neighbour. The
+    moves out of a section are found when a search first needs them, the
+    costs between the nodes of a section when a search first expands one of
+    them. Both are dropped when the section or a neighbour changes.
+    """
+
+    def __init__(self, grid_space):
+        self.grid_space = grid_space
+        self.exits = {}
+        self.links = {}
+        self.version = 0
+
+    def invalidate_cells(self, cells):
+        self.invalidate_sections(set((x >> 4, y >> 4, z >> 4) for x, y, z in cells))
+
+    def invalidate_sections(self, sections):
+        self.version += 1
+        if not self.exits and not self.links:
+            return
+        for sx, sy, sz in sections:
+            for i, j in utils.plane:
+                for k in (-1, 0, 1):
+                    crd = (sx + i, sy + k, sz + j)
+                    self.exits.pop(crd, None)
+                    self.links.pop(crd, None)
+
+    def invalidate_chunks(self, chunks):
+        """ chunks is a set of chunk coordinates """
+        self.version += 1
+        if not self.exits and not self.links:
+            return
+        around = set((x + i, z + j) for x, z in chunks for i, j in utils.plane)
+        for cache in (self.exits, self.links):
+            for crd in [crd for crd in cache if (crd[0], crd[2]) in around]:
+                del cache[crd]
+
+    def compute_exits(self, section, result):
+        """
+        Appends to result the moves out of section as a dict from cell key
+        to a list of (cell key, cost), yields now and then.
+        """
+        version = self.version
+        gs = self.grid_space
+        walk_state = gs.grid.walk_state
+        bx, by, bz = section[0] << 4, section[1] << 4, section[2] << 4
+        moves = defaultdict(list)
+        count = 0
+        for ly in xrange(16):
+            # falls reach three blocks down, jumps one up
+            vertical_border = ly < 3 or ly == 15
+            for lx in xrange(16):
+                for lz in xrange(16):
+                    if not (vertical_border or lx == 0 or lx == 15 or lz == 0 or lz == 15):
+                        continue
+                    x, y, z = bx + lx, by + ly, bz + lz
+                    if not walk_state(x, y, z) & NODE_STATES:
+                        continue
+                    state = gs.get_state(x, y, z)
+                    for to_state in gs.neighbours_of(state.coords):
+                        to_section = (to_state.x >> 4, to_state.y >> 4, to_state.z >> 4)
+                        if to_section != section:
+                            moves[to_section].append((state, to_state))
+                    count += 1
+                    if count % 16 == 0:
+                        yield
+        exits = defaultdict(list)
+        for to_moves in moves.itervalues():
+            for group in _border_groups(to_moves):
+                state, to_state = group[len(group) // 2]
+                exits[pack_coords(state.x, state.y, state.z)].append((pack_coords(to_state.x, to_state.y, to_state.z), edge_cost(state, to_state)))
+        exits = dict(exits)
+        if version == self.version:
+            self.exits[section] = exits
+        result.append(exits)
+
+    def compute_links(self, key, exits, result):
+        """
+        Appends to result the costs of moves inside its section from cell key
+        to the exits of the section as a list of (cell key, cost) and the
+        number of search iterations, yields now and then.
+        """
+        version = self.version
+        section = section_of_key(key)
+        remaining = set(exits)
+        remaining.discard(key)
+
+        def is_goal(state):
+            remaining.discard(pack_coords(state.x, state.y, state.z))
+            return not remaining
+        astar = AStarAlgo(graph=SectionSpace(self.grid_space, section), start_coords=unpack_coords(key),
+                          heuristics=lambda state: 0, is_goal=is_goal, max_cost=SECTION_STEPS)
+        for _ in run_steps(astar):
+            yield
+        links = [(crd, astar.g[crd]) for crd in exits if crd != key and crd not in remaining and crd in astar.g]
+        if version == self.version:
+            self.links.setdefault(section, {})[key] = links
+        result.append((links, astar.iter_count))
+
+
+class AStarSectionsAlgo(object):
+    """
+    Hierarchical A*. Searches the SectionGraph from the start to the goal
+    cell, then fills in each hop inside a section with a search that stays
+    in that section. Runs as a generator, next() makes one small step.
+    """
+
+    def __init__(self, section_graph=None, start_coords=None, goal_coords=None, heuristics=None):
+        self.section_graph = section_graph
+        self.grid_space = section_graph.grid_space
+        self.heuristics = heuristics
+        self.start = pack_coords(start_coords.x, start_coords.y, start_coords.z)
+        self.goal = pack_coords(goal_coords.x, goal_coords.y, goal_coords.z)
+        # the abstract search gives up well past any sensible detour
+        self.max_cost = 2 * cost_estimate(start_coords, goal_coords) + 64
+        self.path = None
+        self.closed_set = set()
+        self.iter_count = 0
+        self.steps = self._search()
+
+    def next(self):
+        self.steps.next()
+
+    def _cell_search(self, from_key, to_key):
+        target = unpack_coords(to_key)
+        return AStarAlgo(graph=SectionSpace(self.grid_space, section_of_key(from_key)), start_coords=unpack_coords(from_key),
+                         heuristics=lambda state: cost_estimate(state, target),
+                         is_goal=lambda state: state.x == target.x and state.y == target.y and state.z == target.z,
+                         max_cost=SECTION_STEPS)
+
+    def _links_of(self, key, links):
+        """ appends to links the abstract edges from key, yields now and then """
+        graph = self.section_graph
+        section = section_of_key(key)
+        exits = graph.exits.get(section)
+        if exits is None:
+            result = []
+            for _ in graph.compute_exits(section, result):
+                yield
+            exits = result[0]
+        intra = graph.links.get(section, {}).get(key)
+        if intra is None:
+            result = []
+            for _ in graph.compute_links(key, exits, result):
+                yield
+            intra, iterations = result[0]
+            self.iter_count += iterations
+        links.extend(intra)
+        links.extend(exits.get(key, []))
+        if section == section_of_key(self.goal):
+            astar = self._cell_search(key, self.goal)
+            for _ in run_steps(astar):
+                yield
+            self.iter_count += astar.iter_count
+            if astar.path is not None:
+                links.append((self.goal, astar.path[0].g))
+
+    def _search(self):
+        start, goal = self.start, self.goal
+        g = {start: 0}
+        parent = {start: None}
+        weight = SECTIONS_HEURISTIC_WEIGHT
+        h = self.heuristics(unpack_coords(start)) * weight
+        open_heap = [(h, h, start)]
+        closed_set = self.closed_set
+        while open_heap:
+            f, _, current = heapq.heappop(open_heap)
+            if current in closed_set:
+                continue
+            if current == goal:
+                for _ in self._refine(parent):
+                    yield
+                raise PathFound()
+            if f > self.max_cost:
+                raise PathOverLimit()
+            closed_set.add(current)
+            self.iter_count += 1
+            links = []
+            for _ in self._links_of(current, links):
+                yield
+            current_g = g[current]
+            for key, cost in links:
+                if key in closed_set:
+                    continue
+                tentative_g = current_g + cost
+                if tentative_g < g.get(key, tentative_g + 1):
+                    g[key] = tentative_g
+                    parent[key] = current
+                    h = self.heuristics(unpack_coords(key)) * weight
+                    heapq.heappush(open_heap, (tentative_g + h, h, key))
+            yield
+        raise PathNotFound()
+
+    def _refine(self, parent):
+        """ cells of the path from the abstract one """
+        keys = []
+        key = self.goal
+        while key is not None:
+            keys.append(key)
+            key = parent[key]
+        keys.reverse()
+        cells = [unpack_coords(keys[0])]
+        for from_key, to_key in zip(keys, keys[1:]):
+            if section_of_key(from_key) != section_of_key(to_key):
+                cells.append(unpack_coords(to_key))
+                continue
+            astar = self._cell_search(from_key, to_key)
+            for _ in run_steps(astar):
+                yield
+            self.iter_count += astar.iter_count
+            if astar.path is None:
+                # the section changed under the search
+                raise PathNotFound()
+            cells.extend(node.coords for node in reversed(astar.path[:-1]))
+        path = []
+        cost = 0
+        from_state = None
+        for step, coords in enumerate(cells):
+            state = self.grid_space.get_state_coords(coords)
+            if from_state is not None:
+                cost += edge_cost(from_state, state)
+            path.append(PathNode(coords, cost, step))
+            from_state = state
+        path.reverse()
+        self.path = path
@@ -0,0 +1,233 @@
+"""
+Path searches in worker processes.
+
+A worker is sent the walkability states of the grid sections around the
+start and the goal and runs A* over them, away from the reactor. Each
+worker remembers the sections it was sent, later requests carry only the
+sections whose version changed since.
+"""
+
+import itertools
+import multiprocessing
+import signal
+import weakref
+from collections import deque
+
+from twisted.internet import defer, reactor, threads
+
+import config
+import logbot
+import utils
+import walkability
+from gridspace import GridSpace
+from pathfinding import AStarAlgo, PathFound, PathNotFound, PathOverLimit, PathNode, cost_estimate, path_cache
+
+
+log = logbot.getlogger("PATHWORKER")
+
+# cells outside the sent sections are air
+AIR_STATE = walkability.cell_state(ord(walkability.AIR), ord(walkability.AIR), ord(walkability.AIR), False)
+
+
+class SnapshotGrid(object):
+    """ walk states of the sections a worker was sent, stands in for Grid in GridSpace """
+
+    def __init__(self):
+        self.sections = {}
+
+    def update(self, box, delta):
+        for key, states in delta:
+            self.sections[key] = states
+        box = set(box)
+        for key in [key for key in self.sections if key not in box]:
+            del self.sections[key]
+
+    def walk_state(self, x, y, z):
+        states = self.sections.get((x >> 4, y >> 4, z >> 4), None)
+        if states is None:
+            return AIR_STATE
+        return states[(y & 15) * 256 + (z & 15) * 16 + (x & 15)]
+
+
+def search_snapshot(grid, start, goal):
+    """ path from start to goal as a list of (x, y, z, g, step) from the goal, None if not found """
+    goal_coords = utils.Vector(*goal)
+    astar = AStarAlgo(graph=GridSpace(grid), start_coords=utils.Vector(*start), goal_coords=goal_coords,
+                      heuristics=lambda state: cost_estimate(state, goal_coords),
+                      is_goal=lambda state: state.x == goal_coords.x and state.y == goal_coords.y and state.z == goal_coords.z)
+    try:
+        while True:
+            astar.next()
+    except PathFound:
+        return [(node.coords.x, node.coords.y, node.coords.z, node.g, node.step) for node in astar.path], astar.iter_count
+    except (PathNotFound, PathOverLimit):
+        return None, astar.iter_count
+
+
+def serve(conn):
+    """ worker process loop, None ends it. A failed search is answered with None """
+    # handlers of the reactor are inherited with the fork, the parent handles ctrl-c
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    grids = {}
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        token, box, delta, start, goal = message
+        grid = grids.get(token, None)
+        if grid is None:
+            grid = grids[token] = SnapshotGrid()
+        grid.update(box, delta)
+        try:
+            conn.send(search_snapshot(grid, start, goal))
+        except Exception:
+            log.err(_why="search from %s to %s failed" % (start, goal))
+            grids.pop(token)
+            conn.send(None)
+
+
+class Worker(object):
+    def __init__(self):
+        self.busy = False
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(child_conn,))
+        self.process.daemon = True
+        self.process.start()
+        self.sent = {}
+
+    def call(self, message):
+        """ runs in a reactor thread pool thread """
+        self.conn.send(message)
+        return self.conn.recv()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (IOError, OSError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def restart(self):
+        self.stop()
+        self.conn.close()
+        self.start()
+
+
+class PathWorkers(object):
+    """
+    Pool of worker processes. One request at a time goes to each worker,
+    the rest wait in order.
+    """
+
+    def __init__(self, count, margin):
+        self.margin = margin
+        self.workers = [Worker() for _ in xrange(count)]
+        self.waiting = deque()
+        self.tokens = weakref.WeakKeyDictionary()
+        self.new_token = itertools.count().next
+        self.sections_sent = 0
+        self.sections_reused = 0
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def search(self, grid, start_coords, goal_coords):
+        """ Deferred firing with the path as a list of PathNode from the goal, or None """
+        path = path_cache.get(grid.dimension, start_coords, goal_coords)
+        if path is not None:
+            return defer.succeed(path)
+        d = defer.Deferred()
+        self.waiting.append((grid, start_coords, goal_coords, d))
+        self._dispatch()
+        return d
+
+    def _dispatch(self):
+        for worker in self.workers:
+            if not self.waiting:
+                return
+            if worker.busy:
+                continue
+            grid, start_coords, goal_coords, d = self.waiting.popleft()
+            worker.busy = True
+            # the worker searches the grid as it is now
+            changes = grid.changes
+            wd = threads.deferToThread(worker.call, self._message(worker, grid, start_coords, goal_coords))
+            wd.addCallbacks(self._found, self._failed, callbackArgs=(worker, grid, start_coords, goal_coords, changes), errbackArgs=(worker,))
+            wd.addBoth(self._done, worker)
+            wd.chainDeferred(d)
+
+    def _message(self, worker, grid, start_coords, goal_coords):
+        token = self.tokens.get(grid, None)
+        if token is None:
+            token = self.tokens[grid] = self.new_token()
+        sent = worker.sent.get(token, {})
+        now_sent = {}
+        box = []
+        delta = []
+        versions = grid.section_versions
+        margin = self.margin
+        min_y = max(0, (min(start_coords.y, goal_coords.y) - margin) >> 4)
+        max_y = min(config.WORLD_HEIGHT / 16 - 1, (max(start_coords.y, goal_coords.y) + margin) >> 4)
+        for chunk_x in xrange((min(start_coords.x, goal_coords.x) - margin) >> 4, ((max(start_coords.x, goal_coords.x) + margin) >> 4) + 1):
+            for chunk_z in xrange((min(start_coords.z, goal_coords.z) - margin) >> 4, ((max(start_coords.z, goal_coords.z) + margin) >> 4) + 1):
+                chunk = grid.get_chunk((chunk_x, chunk_z))
+                if chunk is None:
+                    continue
+                for level in xrange(min_y, max_y + 1):
+                    key = (chunk_x, level, chunk_z)
+                    version = versions.get(key, 0)
+                    box.append(key)
+                    now_sent[key] = version
+                    if sent.get(key, None) == version:
+                        self.sections_reused += 1
+                    else:
+                        delta.append((key, bytearray(grid.section_walk_states(chunk, level))))
+                        self.sections_sent += 1
+        worker.sent[token] = now_sent
+        return token, box, delta, start_coords.tuple, goal_coords.tuple
+
+    def _found(self, result, worker, grid, start_coords, goal_coords, changes):
+        if result is None:
+            log.msg("worker failed to search from %s to %s" % (start_coords, goal_coords))
+            # the worker dropped its sections
+            worker.sent = {}
+            return None
+        steps, iterations = result
+        log.msg("worker made %d iterations, sections sent %d reused %d" % (iterations, self.sections_sent, self.sections_reused))
+        if steps is None:
+            return None
+        path = [PathNode(utils.Vector(x, y, z), g, step) for x, y, z, g, step in steps]
+        path_cache.put(grid.dimension, start_coords, goal_coords, path, changes)
+        return path
+
+    def _failed(self, failure, worker):
+        log.err(failure, "path worker failed, restarting it")
+        # stopping a hung worker waits for it, the worker stays busy until it is back
+        d = threads.deferToThread(worker.restart)
+        d.addErrback(log.err, "cannot restart path worker")
+        d.addCallback(lambda _: None)
+        return d
+
+    def _done(self, result, worker):
+        worker.busy = False
+        reactor.callLater(0, self._dispatch)
+        return result
+
+
+_workers = None
+
+
+def workers(bot_config):
+    """ the pool of this process, started on first use """
+    global _workers
+    if _workers is None:
+        _workers = PathWorkers(bot_config.PATHFIND_WORKERS, bot_config.PATHFIND_WORKER_MARGIN)
+        reactor.addSystemEventTrigger("before", "shutdown", _workers.stop)
+    return _workers
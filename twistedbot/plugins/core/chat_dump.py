@@ -0,0 +1,36 @@
+import time
+
+from twistedbot.plugins.base import PluginChatBase
+from twistedbot import griddump
+
+
+class Dump(PluginChatBase):
+    @property
+    def command_verb(self):
+        return "dump"
+
+    @property
+    def help(self):
+        return ["dump [radius]",
+                "saves loaded chunks to a file for benchmark.py",
+                "radius - only chunks that many chunks around the bot"]
+
+    def command(self, sender, command, args):
+        grid = self.world.grid
+        chunks = None
+        if args:
+            try:
+                radius = int(args[0])
+            except ValueError:
+                self.send_chat_message("radius has to be a number")
+                return
+            position = self.world.bot.position_grid
+            chunk_x = position.x >> 4
+            chunk_z = position.z >> 4
+            chunks = [(x, z) for x in xrange(chunk_x - radius, chunk_x + radius + 1) for z in xrange(chunk_z - radius, chunk_z + radius + 1)]
+        filename = "grid_%s_%d_%s.dump" % (self.world.bot.name, self.world.dimension.number, time.strftime("%Y%m%d%H%M%S"))
+        count = griddump.save(grid, filename, chunks)
+        self.send_chat_message("saved %d chunks to %s" % (count, filename))
+
+
+plugin = Dump
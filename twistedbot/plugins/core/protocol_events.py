@@ -23,7 +23,7 @@ class ProtocolEvents(PluginEventHandlerBase):
         self.world.bot.on_connection_lost()
 
     def on_ping(self, ping_id):
-        self.world.send_packet("keep alive", {"pid": ping_id})
+        self.world.send_packet("keep alive", {"pid": ping_id}, immediate=True)
 
     def on_login(self, bot_eid, level_type, game_mode, dimension, difficulty, max_players):
         log.msg("Login data: eid:%s level type:%s, game_mode:%s, dimension:%s, difficulty:%s, max players:%s" %
@@ -135,8 +135,8 @@ class ProtocolEvents(PluginEventHandlerBase):
         #TODO relevant when we can enchant or use anvil
         pass
 
-    def on_load_chunk(self, x, z, continuous, primary_bit, add_bit, data_array):
-        self.world.grid.load_chunk(x=x, z=z, continuous=continuous, primary_bit=primary_bit, add_bit=add_bit, data_array=data_array)
+    def on_load_chunk(self, x, z, continuous, primary_bit, add_bit, zlib_data):
+        self.world.grid.load_chunk(x=x, z=z, continuous=continuous, primary_bit=primary_bit, add_bit=add_bit, zlib_data=zlib_data)
 
     def on_multi_block_change(self, x, z, blocks):
         self.world.grid.multi_block_change(chunk_x=x, chunk_z=z, blocks=blocks)
@@ -144,8 +144,8 @@ class ProtocolEvents(PluginEventHandlerBase):
     def on_block_change(self, x, y, z, block_id, block_meta):
         self.world.grid.block_change(x=x, y=y, z=z, btype=block_id, bmeta=block_meta)
 
-    def on_load_bulk_chunk(self, metas, data_array, light_data):
-        self.world.grid.load_bulk_chunk(metas=metas, data_array=data_array, light_data=light_data)
+    def on_load_bulk_chunk(self, metas, zlib_data, light_data):
+        self.world.grid.load_bulk_chunk(metas=metas, zlib_data=zlib_data, light_data=light_data)
 
     def on_explosion(self, x, y, z, radius, records, player_motion_x, player_motion_y, player_motion_z):
         log.msg("Explosion at %f %f %f radius %f blocks affected %d" % (x, y, z, radius, len(records)))
@@ -6,6 +6,8 @@ from collections import defaultdict
 import twistedbot.logbot as logbot
 from twistedbot.packets import packets
 from twistedbot.packets import Container, Metadata
+from twistedbot.fastpackets import is_record
+from twistedbot.framing import decoded
 
 from pynbt import NBTFile
 
@@ -40,8 +42,11 @@ statistics = defaultdict(lambda: defaultdict(int))
 def format_packet(data, prefix="  ", depth=1):
     """ return formated string of the packet """
     prefixstr = prefix * depth
+    data = decoded(data)
     if isinstance(data, NBTFile):
         return data.pretty(indent=depth, indent_str=prefix)
+    if is_record(data):
+        data = data._asdict()
     if isinstance(data, Container) or isinstance(data, types.DictType):
         out = []
         for k, v in data.iteritems():
@@ -58,7 +63,7 @@ def format_packet(data, prefix="  ", depth=1):
                 pr = str(v)
             elif isinstance(v, types.UnicodeType):
                 pr = v.encode('utf8')
-            elif isinstance(v, Container):
+            elif isinstance(v, Container) or is_record(v):
                 pr = "\n%s" % format_packet(v, depth=depth + 1)
             elif isinstance(v, types.TupleType) or isinstance(v, types.ListType):
                 pr = "array length %d, first element:\n%s" % (len(v), format_packet(v[0], depth=depth + 1))
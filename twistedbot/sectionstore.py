@@ -0,0 +1,54 @@
+"""
+Chunk sections shared between grids.
+
+Bots connected to the same server receive the same chunks. Sections are
+kept in a store keyed by (dimension, chunk x, chunk z, level, content hash)
+so identical sections are held in memory once, no matter how many grids
+loaded them. The store counts the references and drops a section when the
+last grid releases it. Grids must not modify a shared section, a grid that
+changes a block takes its own copy first, see detach.
+"""
+
+import hashlib
+
+
+def section_hash(block_types, meta):
+    return hashlib.sha1(block_types.tostring() + meta.tostring()).digest()
+
+
+class SectionStore(object):
+    def __init__(self):
+        self.sections = {}
+
+    def __len__(self):
+        return len(self.sections)
+
+    def acquire(self, key, block_types, meta):
+        """
+        Returns the stored (block_types, meta) arrays for the key. If the key
+        is not stored yet, the given arrays are stored and returned.
+        """
+        entry = self.sections.get(key, None)
+        if entry is None:
+            entry = self.sections[key] = [block_types, meta, 0]
+        entry[2] += 1
+        return entry[0], entry[1]
+
+    def release(self, key):
+        entry = self.sections[key]
+        entry[2] -= 1
+        if entry[2] == 0:
+            del self.sections[key]
+
+    def detach(self, key):
+        """
+        Releases the key before the caller modifies its section. Returns True
+        if the caller was the only user and may modify the arrays in place,
+        False if it has to modify a copy.
+        """
+        entry = self.sections[key]
+        if entry[2] == 1:
+            del self.sections[key]
+            return True
+        entry[2] -= 1
+        return False
@@ -1,5 +1,8 @@
 
 import math
+import time
+import ctypes
+import ctypes.util
 from collections import namedtuple
 
 from twisted.internet import defer, reactor
@@ -13,6 +16,35 @@ adjacency = cross + corners
 plane = [(i, j) for i in (-1, 0, 1) for j in (-1, 0, 1)]
 
 
+def _monotonic_clock():
+    """ seconds from an unspecified point, not affected by system time changes """
+    try:
+        return time.monotonic
+    except AttributeError:
+        pass
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library("rt") or "libc.so.6", use_errno=True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+
+    class timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    CLOCK_MONOTONIC = 1
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    ts = timespec()
+    ts_ref = ctypes.byref(ts)
+
+    def monotonic():
+        clock_gettime(CLOCK_MONOTONIC, ts_ref)
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic
+
+
+monotonic = _monotonic_clock()
+
+
 def do_now(fn, *args, **kwargs):
     return do_later(0, fn, *args, **kwargs)
 
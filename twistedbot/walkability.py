@@ -0,0 +1,111 @@
+"""
+Walkability of grid cells for the pathfinding.
+
+One byte of state bits per cell says whether the bot can be, stand, jump,
+fall, climb or hold on in it, and whether it is in fire or water. It is
+worked out from the block flags at y - 1, y and y + 1. Grid keeps the
+states of a whole 16x16x16 section in a bytearray. A section is computed
+at once: block ids are translated to flag bytes, the flag bytes turned
+into long integers and combined with bitwise operations on all cells
+together.
+"""
+
+from binascii import hexlify, unhexlify
+
+import blocks
+
+
+CAN_BE = 1
+CAN_STAND = 1 << 1
+CAN_JUMP = 1 << 2
+CAN_FALL = 1 << 3
+CAN_CLIMB = 1 << 4
+IN_FIRE = 1 << 5
+IN_WATER = 1 << 6
+CAN_HOLD = 1 << 7
+
+SECTION = 4096
+LAYER = 256
+
+# flag bits used here are the lowest byte of blocks.block_flags
+_meta_dependent = {}
+_id_flags = []
+for number in xrange(256):
+    per_meta = [chr(blocks.block_flags[number << 4 | meta] & 255) for meta in xrange(16)]
+    if len(set(per_meta)) > 1:
+        _meta_dependent[chr(number)] = per_meta
+    _id_flags.append(per_meta[0])
+_id_flags = "".join(_id_flags)
+
+AIR = _id_flags[blocks.Air.number]
+VINE = chr(blocks.Vines.number)
+
+_ones = int("01" * SECTION, 16)
+
+
+def flags_of(ids, meta, start, end):
+    """
+    Flag bytes of the cells start to end of a section, ids is a string of
+    the section block ids or None for a section without data.
+    """
+    if ids is None:
+        return AIR * (end - start)
+    flags = ids[start:end].translate(_id_flags)
+    for number, per_meta in _meta_dependent.iteritems():
+        pos = ids.find(number, start, end)
+        if pos < 0:
+            continue
+        flags = bytearray(flags)
+        while pos >= 0:
+            m = meta[pos >> 1]
+            flags[pos - start] = per_meta[m >> 4 if pos & 1 else m & 15]
+            pos = ids.find(number, pos + 1, end)
+        flags = str(flags)
+    return flags
+
+
+def _plane(value, bit):
+    return (value >> bit) & _ones
+
+
+def section_states(below, flags, above):
+    """
+    State bytes of a section from the flag bytes of its cells and of the
+    layers just below and above it. Vines come out as not climbable.
+    """
+    lower = int(hexlify(below + flags[:-LAYER]), 16)
+    middle = int(hexlify(flags), 16)
+    upper = int(hexlify(flags[LAYER:] + above), 16)
+    can_be = _plane(middle, 0) & _plane(upper, 0)
+    can_stand = can_be & _plane(lower, 1)
+    can_jump = can_stand & _plane(middle, 2) & _plane(upper, 2)
+    can_fall = can_be & _plane(lower, 0)
+    can_climb = can_be & _plane(middle, 3)
+    in_fire = _plane(middle, 4) | _plane(upper, 4)
+    in_water = _plane(middle, 5) | _plane(upper, 5)
+    can_hold = in_water | _plane(middle, 6)
+    states = can_be | can_stand << 1 | can_jump << 2 | can_fall << 3 | \
+        can_climb << 4 | in_fire << 5 | in_water << 6 | can_hold << 7
+    return bytearray(unhexlify("%0*x" % (2 * SECTION, states)))
+
+
+def cell_state(flags_0, flags_1, flags_2, climbable):
+    """ state bits from the block flags below, at and above the cell """
+    state = 0
+    if flags_1 & flags_2 & blocks.FALL_THROUGH:
+        state |= CAN_BE
+        if flags_0 & blocks.STAND_ON:
+            state |= CAN_STAND
+            if flags_1 & flags_2 & blocks.FREE:
+                state |= CAN_JUMP
+        if flags_0 & blocks.FALL_THROUGH:
+            state |= CAN_FALL
+        if climbable:
+            state |= CAN_CLIMB
+    if (flags_1 | flags_2) & blocks.BURNING:
+        state |= IN_FIRE
+    if (flags_1 | flags_2) & blocks.WATER:
+        state |= IN_WATER | CAN_HOLD
+    if flags_1 & blocks.LADDER or (flags_1 & blocks.VINE and climbable):
+        state |= CAN_HOLD
+    return state
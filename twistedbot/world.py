@@ -9,6 +9,7 @@ import config
 import inventory
 from entities import Entities
 from grid import Grid
+from sectionstore import SectionStore
 from statistics import Statistics
 from chat import Chat
 from botentity import BotEntity
@@ -20,18 +21,20 @@ log = logbot.getlogger("WORLD")
 
 
 class Dimension(object):
-    def __init__(self, world):
+    def __init__(self, world, number):
         self.world = world
+        self.number = number
         self.entities = Entities(self)
         self.grid = Grid(self)
         self.sign_waypoints = SignWayPoints(self)
 
 
 class World(object):
-    def __init__(self, host=None, port=None, commander_name=None, bot_name=None):
+    def __init__(self, host=None, port=None, commander_name=None, bot_name=None, bot_config=None, section_store=None):
         self.server_host = host
         self.server_port = port
-        self.config = config
+        self.config = config if bot_config is None else bot_config
+        self.section_store = SectionStore() if section_store is None else section_store
         self.eventregister = EventRegister(self)
         self.eventregister.setup()
         self.commander = Commander(commander_name)
@@ -48,7 +51,7 @@ class World(object):
         self.grid = None
         self.sign_waypoints = None
         self.dimension = None
-        self.dimensions = [Dimension(self), Dimension(self), Dimension(self)]
+        self.dimensions = [Dimension(self, -1), Dimension(self, 0), Dimension(self, 1)]
         self.spawn_position = None
         self.game_mode = None
         self.difficulty = None
@@ -71,11 +74,15 @@ class World(object):
 
     def tick(self):
         tick_start = datetime.now()
+        for dimension in self.dimensions:
+            dimension.grid.commit_updates(self.config.CHUNK_COMMIT_LIMIT)
         if self.logged_in:
             self.bot.tick()
             self.chat.tick()
             self.every_n_ticks()
             self.game_ticks += 1
+        if self.protocol is not None:
+            self.protocol.flush_packets()
         utils.do_later(self.predict_next_ticktime(tick_start), self.tick)
 
     def every_n_ticks(self, n=100):
@@ -85,9 +92,9 @@ class World(object):
         log.msg("Shutdown")
         self.factory.log_connection_lost = False
 
-    def send_packet(self, name, payload):
+    def send_packet(self, name, payload, immediate=False):
         if self.protocol is not None:
-            self.protocol.send_packet(name, payload)
+            self.protocol.send_packet(name, payload, immediate=immediate)
         else:
             log.err("Trying to send %s while disconnected" % name)
 
@@ -102,7 +109,7 @@ class World(object):
 
     @property
     def server_lag(self):
-        return self.players[config.USERNAME]
+        return self.players[self.config.USERNAME]
 
 
 class Commander(object):